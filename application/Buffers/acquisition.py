@@ -0,0 +1,270 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import pylsl
+
+from application.Buffers.lslringbuffer_multithreaded import LSLRINGBUFFER
+from application.Buffers.chunkreader import CHANNEL_FORMATS
+
+logger = logging.getLogger(__name__)
+
+
+class AcquisitionEngine:
+    """Service the inlets of many LSLRINGBUFFERs from a small pool of worker threads.
+
+    Instead of one thread (or GUI timer) per viewer pulling its own inlet, every
+    buffer is registered once with the engine. The engine keeps a schedule of
+    when each buffer is due, and its workers sleep until the next one is due,
+    pump it (pull one chunk into its ring) and reschedule it. The polling
+    interval follows the nominal rate of the stream, so a 2 kHz EEG stream is
+    pulled every `target_latency` seconds while a 10 Hz stream is only pulled
+    once per sample. A stream whose pulls keep failing backs off, up to
+    `max_backoff` seconds between two pulls, until a pull succeeds again.
+
+    Examples
+    --------
+        >>> engine = AcquisitionEngine(n_workers=2)
+        >>> engine.start()
+        >>> engine.add(lslringbuffer)
+        >>> samples, timestamps = lslringbuffer.get_latest(2.0)
+        >>> engine.stop()
+    """
+
+    def __init__(self, n_workers=2, target_latency=0.02, max_interval=0.1, max_backoff=5.0):
+        self.n_workers = n_workers
+        self.target_latency = target_latency  # seconds of data to wait for between two pulls
+        self.max_interval = max_interval  # longest sleep between two pulls of the same stream
+        self.max_backoff = max_backoff  # longest sleep between two pulls of a stream that keeps failing
+
+        self.schedule = []  # heap of (due time, token, buffer)
+        self.buffers = {}  # buffer -> token of its live entry in the schedule, the others are stale
+        self.busy = {}  # buffer -> token of the entry being pumped
+        self.failures = {}  # buffer -> number of pulls in a row that failed
+        self.lock = threading.RLock()
+        self.condition = threading.Condition(self.lock)  # workers wait for the next due buffer
+        self.idle = threading.Condition(self.lock)  # remove(wait=True) waits for the pump of its buffer
+        self.counter = itertools.count()
+        self.workers = []
+        self.running = False
+
+    def poll_interval(self, buffer):
+        """Seconds between two pulls of `buffer`, derived from its nominal rate.
+        """
+        fs = buffer.get_nominal_srate()
+        if not fs or fs <= 0:
+            # irregular rate stream, nothing to predict
+            return self.max_interval
+        return min(self.max_interval, max(self.target_latency, 1.0 / fs))
+
+    def add(self, buffer):
+        with self.condition:
+            if buffer in self.buffers:
+                return
+            if buffer in self.busy:
+                # removed and added back during a pull, the worker reschedules it once the pull is over
+                self.buffers[buffer] = self.busy[buffer]
+                return
+            self._schedule(buffer, time.monotonic())
+
+    def remove(self, buffer, wait=False):
+        # the entry of the buffer goes stale and is skipped when it becomes due (even if the buffer was
+        # added back meanwhile, under a new token), with `wait` this returns once a pull in progress is over,
+        # so its inlet can be closed
+        with self.condition:
+            self.buffers.pop(buffer, None)
+            self.failures.pop(buffer, None)
+            if wait:
+                self.idle.wait_for(lambda: buffer not in self.busy)
+
+    def clear(self):
+        with self.condition:
+            self.buffers.clear()
+            self.schedule.clear()
+            self.failures.clear()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        for i in range(self.n_workers):
+            worker = threading.Thread(target=self._work, name='lsl-acquisition-%d' % i, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def _schedule(self, buffer, due):
+        token = next(self.counter)
+        self.buffers[buffer] = token
+        heapq.heappush(self.schedule, (due, token, buffer))
+        self.condition.notify()
+
+    def _next_due(self):
+        # Block until a buffer is due and return it, or None when stopping
+        with self.condition:
+            while self.running:
+                if not self.schedule:
+                    self.condition.wait()
+                    continue
+
+                due, token, buffer = self.schedule[0]
+                if self.buffers.get(buffer) != token:
+                    # removed (and maybe added back) since it was scheduled
+                    heapq.heappop(self.schedule)
+                    continue
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+
+                heapq.heappop(self.schedule)
+                self.busy[buffer] = token
+                return buffer
+        return None
+
+    def _work(self):
+        while True:
+            buffer = self._next_due()
+            if buffer is None:
+                break
+
+            interval = self.poll_interval(buffer)
+            try:
+                sample, timestamp = buffer.pump()
+                # a full chunk means the inlet has a backlog, come back right away
+                if sample is not None and len(sample) >= buffer.reader.max_samples:
+                    interval = 0.0
+                failures = self.failures.pop(buffer, 0)
+                if failures:
+                    logger.info('Pulling %s works again after %d failures.', buffer.get_stream_name(), failures)
+            except Exception:
+                interval = self._failed(buffer, interval)
+
+            with self.condition:
+                token = self.busy.pop(buffer)
+                self.idle.notify_all()
+                if self.buffers.get(buffer) == token:
+                    self._schedule(buffer, time.monotonic() + interval)
+                elif buffer not in self.buffers:
+                    self.failures.pop(buffer, None)
+
+
+    def _failed(self, buffer, interval):
+        # a stream that keeps failing is pulled less and less often (up to `max_backoff` seconds apart) and
+        # only logged with its traceback the first time, then every time the number of failures doubles
+        failures = self.failures.get(buffer, 0) + 1
+        self.failures[buffer] = failures
+        if failures == 1:
+            logger.exception('Pulling %s failed.', buffer.get_stream_name())
+        elif failures & (failures - 1) == 0:
+            logger.warning('Pulling %s failed %d times in a row.', buffer.get_stream_name(), failures)
+        return min(self.max_backoff, max(interval, self.target_latency) * 2 ** failures)
+
+
+class BufferPool:
+    """Reference-counted LSLRINGBUFFERs of the streams being viewed.
+
+    Listing streams only needs their metadata (see application.Buffers.discovery).
+    The inlet and ring of a stream are created, and the stream added to the
+    `engine`, when it is first acquired. They are shared by every later
+    `acquire` of the same stream, and closed when the last user releases it,
+    so liblsl only buffers and the network only carries the streams actually
+    watched.
+
+    Examples
+    --------
+        >>> pool = BufferPool(engine)
+        >>> lslringbuffer = pool.acquire(discovery.streams()[0])
+        >>> samples, timestamps = lslringbuffer.get_latest(2.0)
+        >>> pool.release(lslringbuffer)
+    """
+
+    def __init__(self, engine, buffer_duration=4.0, max_buflen=4, open_timeout=2.0):
+        self.engine = engine
+        self.buffer_duration = buffer_duration  # seconds kept in every ring
+        self.max_buflen = max_buflen  # seconds buffered by liblsl for every inlet
+        self.open_timeout = open_timeout  # seconds to wait for a stream to answer, it may be gone
+        self.buffers = {}  # uid -> LSLRINGBUFFER
+        self.refcounts = {}  # uid -> number of users
+        self.lock = threading.Lock()
+
+    def acquire(self, stream):
+        """Return the ring buffer of `stream` (a StreamMetadata), opening its inlet
+        if nobody uses it yet. Raises ConnectionError if the stream doesn't answer
+        within `open_timeout` seconds (e.g. it went away since it was discovered).
+        """
+        uid = stream.get_uid()
+        with self.lock:
+            buffer = self.buffers.get(uid)
+            if buffer is not None:
+                self.refcounts[uid] += 1
+                return buffer
+
+        # opening waits on the network, so it is done without holding the pool
+        buffer = self._open(stream)
+        with self.lock:
+            shared = self.buffers.get(uid)
+            if shared is None:
+                self.buffers[uid] = buffer
+                self.refcounts[uid] = 1
+                self.engine.add(buffer)
+                return buffer
+            self.refcounts[uid] += 1
+        # acquired by someone else in the meantime
+        buffer.inlet.close_stream()
+        buffer.close()
+        return shared
+
+    def _open(self, stream):
+        # the inlet and ring of `stream`, sized from the info the stream sends now (the discovered one may be stale)
+        inlet = pylsl.StreamInlet(stream.info, max_buflen=self.max_buflen)
+        try:
+            inlet.open_stream(timeout=self.open_timeout)
+            info = inlet.info(timeout=self.open_timeout)
+        except (pylsl.TimeoutError, pylsl.LostError) as e:
+            raise ConnectionError('Could not open the stream %s: %s' % (stream.get_stream_name(), e)) from e
+
+        channels = stream.get_channels() if info.channel_count() == stream.get_channel_count() else None
+        return LSLRINGBUFFER(lsl_type=info.type(), name=info.name(), inlet=inlet, fs=info.nominal_srate(),
+                             buffer_duration=self.buffer_duration, num_channels=info.channel_count(),
+                             uid=info.uid(), hostname=info.hostname(),
+                             channel_format=CHANNEL_FORMATS[info.channel_format()], channels=channels)
+
+    def release(self, buffer):
+        # one user less, the inlet is closed when it was the last one
+        uid = buffer.get_uid()
+        with self.lock:
+            if self.buffers.get(uid) is not buffer:
+                return
+            self.refcounts[uid] -= 1
+            if self.refcounts[uid] > 0:
+                return
+            del self.buffers[uid], self.refcounts[uid]
+        self._close(buffer)
+
+    def get_refcount(self, uid):
+        with self.lock:
+            return self.refcounts.get(uid, 0)
+
+    def close(self):
+        # close every buffer, whoever still uses it
+        with self.lock:
+            buffers = list(self.buffers.values())
+            self.buffers.clear()
+            self.refcounts.clear()
+        for buffer in buffers:
+            self._close(buffer)
+
+    def _close(self, buffer):
+        self.engine.remove(buffer, wait=True)
+        buffer.inlet.close_stream()
+        buffer.close()
@@ -0,0 +1,48 @@
+import asyncio
+
+
+class _PullError:
+    # carries an exception raised in the executor over to the consumer
+    def __init__(self, error):
+        self.error = error
+
+
+async def stream_chunks(pull, maxsize=8, executor=None):
+    """Asynchronously iterate over the chunks returned by a blocking `pull`.
+
+    `pull()` runs in `executor` (the loop's default executor if None) and should
+    return a chunk, or None if nothing arrived before its own timeout. Chunks
+    are fed into an asyncio queue of `maxsize` chunks: when the consumer lags,
+    the queue fills up and pulling pauses until it catches up (backpressure).
+
+    `pull` should block for a bounded time, so the executor thread is released
+    shortly after the iteration stops.
+
+    Examples
+    --------
+        >>> async for samples, timestamps in stream_chunks(pull):
+        ...     await decoder.update(samples)
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize)
+
+    async def produce():
+        try:
+            while True:
+                chunk = await loop.run_in_executor(executor, pull)
+                if chunk is not None:
+                    await queue.put(chunk)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            await queue.put(_PullError(error))
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            chunk = await queue.get()
+            if isinstance(chunk, _PullError):
+                raise chunk.error
+            yield chunk
+    finally:
+        producer.cancel()
@@ -0,0 +1,103 @@
+from ctypes import byref, c_double, c_int, c_size_t
+
+import numpy as np
+import pylsl
+from pylsl.pylsl import handle_error
+
+# numpy dtype of every lsl channel format
+CHANNEL_FORMATS = {
+    pylsl.cf_float32: 'float32',
+    pylsl.cf_double64: 'float64',
+    pylsl.cf_string: 'string',
+    pylsl.cf_int32: 'int32',
+    pylsl.cf_int16: 'int16',
+    pylsl.cf_int8: 'int8',
+    pylsl.cf_int64: 'int64',
+}
+
+
+def channel_dtype(channel_format):
+    """numpy dtype of the samples of an lsl channel format, given as a pylsl
+    cf_* constant, its lsl name ('double64', 'int16', ...) or a numpy dtype name.
+    String streams are kept as objects.
+    """
+    if isinstance(channel_format, int):
+        channel_format = CHANNEL_FORMATS[channel_format]
+    if channel_format == 'double64':
+        channel_format = 'float64'
+    return np.dtype(object) if channel_format == 'string' else np.dtype(channel_format)
+
+
+class ChunkReader:
+    """Pull lsl chunks straight into reusable, correctly typed numpy arrays.
+
+    `pylsl.StreamInlet.pull_chunk()` builds a Python list of lists that then has
+    to be converted with `np.array`, and a list of timestamps even with
+    `dest_obj`. For numeric streams the reader instead calls liblsl's pull with
+    preallocated sample (in the stream's native format) and float64 timestamp
+    buffers, so no per-sample Python objects are created, for the samples nor
+    for their timestamps.
+
+    The arrays returned by `pull` are views of the reader's buffers and are
+    overwritten by the next call; copy them (or extend a ring with them) if they
+    have to outlive it.
+
+    Examples
+    --------
+        >>> reader = ChunkReader(inlet, max_samples=1024)
+        >>> samples, timestamps = reader.pull()
+        >>> if samples is not None:
+        ...     ring.extend(samples)
+    """
+
+    def __init__(self, inlet, max_samples=1024):
+        info = inlet.info()
+        self.inlet = inlet
+        self.max_samples = int(max_samples)
+        self.n_channels = info.channel_count()
+        self.channel_format = CHANNEL_FORMATS[info.channel_format()]
+
+        # string streams (e.g. markers) can't be pulled into a numeric buffer
+        self.numeric = self.channel_format != 'string'
+        if self.numeric:
+            self._samples = np.empty((self.max_samples, self.n_channels), dtype=self.channel_format)
+        self._timestamps = np.empty(self.max_samples, dtype='float64')
+
+        # ctypes views of both buffers, for pulling with liblsl directly (pylsl inlets only)
+        self.direct = self.numeric and isinstance(inlet, pylsl.StreamInlet)
+        if self.direct:
+            self._samples_c = (inlet.value_type * self._samples.size).from_buffer(self._samples)
+            self._timestamps_c = (c_double * self.max_samples).from_buffer(self._timestamps)
+            self._errcode = c_int()
+
+    def pull(self, timeout=0.0):
+        """Pull the available samples (at most `max_samples`).
+        Returns
+        -------
+        samples, timestamps: views of shape (n_samples, n_channels) and
+        (n_samples,), or (None, None) if no sample was available.
+        """
+        if self.direct:
+            # what pull_chunk(dest_obj=...) does, without building the list of timestamps
+            n_values = self.inlet.do_pull_chunk(self.inlet.obj, byref(self._samples_c), byref(self._timestamps_c),
+                                                c_size_t(self._samples.size), c_size_t(self.max_samples),
+                                                c_double(timeout), byref(self._errcode))
+            handle_error(self._errcode)
+            n = n_values // self.n_channels
+            return (self._samples[:n], self._timestamps[:n]) if n else (None, None)
+
+        if self.numeric:
+            _, timestamps = self.inlet.pull_chunk(timeout=timeout, max_samples=self.max_samples,
+                                                  dest_obj=self._samples)
+            n = len(timestamps)
+            samples = self._samples[:n]
+        else:
+            chunk, timestamps = self.inlet.pull_chunk(timeout=timeout, max_samples=self.max_samples)
+            n = len(timestamps)
+            samples = np.array(chunk, dtype=object).reshape(n, self.n_channels)
+
+        if n == 0:
+            return None, None
+
+        self._timestamps[:n] = timestamps
+        return samples, self._timestamps[:n]
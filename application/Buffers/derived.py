@@ -0,0 +1,83 @@
+import collections
+import threading
+
+from application.Buffers.ringbuffer import TimestampedRingBuffer
+from application.Buffers.subscription import DROP_OLDEST
+
+
+class DerivedStream:
+    """Filtered copy of a buffer's stream, computed in its acquisition thread.
+
+    Every chunk pumped into the source LSLRINGBUFFER goes through `filter`
+    (anything with an ``apply(chunk)``, e.g. a FilterChain) right after it is
+    written, and the result is written to the derived ring with the same
+    timestamps. Viewers and analysis consumers subscribe to the derived ring
+    like to the source one, so they share a single filtering pass and the
+    GUI thread only renders.
+
+    Examples
+    --------
+        >>> banded = lslringbuffer.derive('Butter', ButterFilter((1.0, 40.0), fs, n_channels))
+        >>> subscription = banded.subscribe(policy=COALESCE)
+        >>> samples, timestamps = subscription.get_all()
+        >>> banded.configure(ButterFilter.reset, (1.0, 30.0))   # redesigned in the acquisition thread
+        >>> banded.set_filter(NotchFilter(60, fs, n_channels))
+        >>> lslringbuffer.release_derived(banded)
+    """
+
+    def __init__(self, source, name, filter):
+        self.source = source
+        self.name = name
+        self.filter = filter
+        self.ring = TimestampedRingBuffer(capacity=source.ring.capacity, n_channels=source.get_channel_count(),
+                                          dtype='float64')
+        self.lock = threading.Lock()  # the filter is swapped between two chunks, never during one
+        self.changes = collections.deque()  # (function, args) to apply to the filter before the next chunk
+        self.refcount = 0
+
+    def push(self, samples, timestamps):
+        # called by the source's pump() with every new chunk
+        with self.lock:
+            while self.changes:
+                function, args = self.changes.popleft()
+                function(self.filter, *args)
+            filtered = self.filter.apply(samples)
+        self.ring.extend(filtered, timestamps)
+
+    def set_filter(self, filter):
+        # takes effect from the next chunk
+        with self.lock:
+            self.filter = filter
+
+    def configure(self, function, *args):
+        # function(filter, *args) runs in the acquisition thread at the next chunk boundary,
+        # so redesigns never block the caller (e.g. the GUI thread) nor happen during a chunk
+        self.changes.append((function, args))
+
+    def subscribe(self, policy=DROP_OLDEST, max_chunks=32, timeout=None):
+        return self.ring.subscribe(policy=policy, max_chunks=max_chunks, timeout=timeout)
+
+    def read_since(self, position):
+        return self.ring.read_since(position)
+
+    def get_window(self, t_start, t_end):
+        return self.ring.get_window(t_start, t_end)
+
+    def get_latest(self, seconds):
+        return self.ring.get_latest(seconds)
+
+    def get_stats(self):
+        return {"n_written": self.ring.n_written, "refcount": self.refcount,
+                "subscriptions": [subscription.stats() for subscription in self.ring.subscriptions]}
+
+    def get_stream_name(self):
+        return '%s (%s)' % (self.source.get_stream_name(), self.name)
+
+    def get_nominal_srate(self):
+        return self.source.get_nominal_srate()
+
+    def get_channel_count(self):
+        return self.source.get_channel_count()
+
+    def get_channels(self):
+        return self.source.get_channels()
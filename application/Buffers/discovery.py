@@ -0,0 +1,171 @@
+import logging
+import threading
+import xml.etree.ElementTree as ET
+
+import pylsl
+
+from application.Buffers.chunkreader import CHANNEL_FORMATS
+
+logger = logging.getLogger(__name__)
+
+
+def parse_channel_labels(xml, n_channels):
+    """Channel labels of the `<desc>` of a full stream info, or None if it has none.
+    Both ``desc/channels/channel`` and ``desc/channel`` with a ``label`` or
+    ``name`` are accepted.
+    """
+    desc = ET.fromstring(xml).find('desc')
+    if desc is None:
+        return None
+    channels_tree = desc.findall('channel') or (desc.find('channels').findall('channel')
+                                                if desc.find('channels') is not None else [])
+    labels = [(ch.find('label') if ch.find('label') is not None else ch.find('name')) for ch in channels_tree]
+    if len(labels) != n_channels or any(label is None or not label.text for label in labels):
+        return None
+    return [label.text for label in labels]
+
+
+class StreamMetadata:
+    """Metadata of a stream, read once from its full info.
+
+    Has the getters of LSLRINGBUFFER, so stream lists can be built from it
+    without opening an inlet. `info` is the resolver's StreamInfo, enough to
+    create an inlet.
+    """
+
+    def __init__(self, info, labels=None):
+        self.info = info
+        self.stream_name = info.name()
+        self.lsl_type = info.type()
+        self.num_channels = info.channel_count()
+        self.fs = info.nominal_srate()
+        self.channel_format = CHANNEL_FORMATS[info.channel_format()]
+        self.uid = info.uid()
+        self.source_id = info.source_id()
+        self.hostname = info.hostname()
+        self.channels = labels or ['Ch %i' % i for i in range(self.num_channels)]
+
+    def get_stream_name(self):
+        return self.stream_name
+
+    def get_stream_type(self):
+        return self.lsl_type
+
+    def get_nominal_srate(self):
+        return self.fs
+
+    def get_channel_count(self):
+        return self.num_channels
+
+    def get_channels(self):
+        return self.channels
+
+    def get_uid(self):
+        return self.uid
+
+    def get_source_id(self):
+        return self.source_id
+
+    def get_hostname(self):
+        return self.hostname
+
+    def get_channel_format(self):
+        return self.channel_format
+
+
+class StreamDiscovery:
+    """Background discovery of the lsl streams on the network.
+
+    A ContinuousResolver is polled every `interval` seconds. The full info of
+    every new stream (its `<desc>`, with the channel labels) is fetched and
+    parsed once, and cached by stream uid, so listing the streams or creating
+    an inlet never waits on the network. Streams that stop answering are
+    dropped from `streams()` after `forget_after` seconds, their metadata stays
+    cached in case they come back with the same uid.
+
+    Examples
+    --------
+        >>> from application.Buffers.discovery import discovery
+        >>> discovery.start()
+        >>> for stream in discovery.streams():
+        ...     print(stream.get_stream_name(), stream.get_channels())
+        >>> inlet = pylsl.StreamInlet(stream.info)
+        >>> discovery.stop()
+    """
+
+    def __init__(self, interval=0.5, forget_after=5.0, info_timeout=2.0):
+        self.interval = interval
+        self.forget_after = forget_after
+        self.info_timeout = info_timeout  # seconds to wait for the full info of a new stream
+
+        self.cache = {}  # uid -> StreamMetadata
+        self.available = []  # StreamMetadata of the streams of the last resolve
+        self.lock = threading.Lock()
+        self.resolved = threading.Event()  # set after the first resolve
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.resolver = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.resolver = pylsl.ContinuousResolver(forget_after=self.forget_after)
+        self.thread = threading.Thread(target=self._work, name='lsl-discovery', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.resolver = None
+        self.resolved.clear()
+
+    def streams(self, wait=1.0):
+        """Metadata of the streams currently on the network. Only waits (up to
+        `wait` seconds) for the first resolve after `start`.
+        """
+        self.resolved.wait(wait)
+        with self.lock:
+            return list(self.available)
+
+    def get(self, uid):
+        # cached metadata of the stream `uid`, or None
+        with self.lock:
+            return self.cache.get(uid)
+
+    def describe(self, info, inlet=None):
+        """Return the metadata of the stream of `info` (a StreamInfo), from the
+        cache or from its full info, fetched through `inlet` if given (a
+        temporary inlet otherwise, which does not open the data connection).
+        """
+        metadata = self.get(info.uid())
+        if metadata is not None:
+            return metadata
+
+        try:
+            full_info = (inlet or pylsl.StreamInlet(info)).info(timeout=self.info_timeout)
+            labels = parse_channel_labels(full_info.as_xml(), info.channel_count())
+        except Exception as e:
+            # not cached, so it is retried on the next resolve
+            logger.warning('Could not read the full info of %s: %s', info.name(), e)
+            return StreamMetadata(info)
+
+        metadata = StreamMetadata(info, labels)
+        with self.lock:
+            return self.cache.setdefault(metadata.uid, metadata)
+
+    def _work(self):
+        # the resolver collects answers in the background, give them `interval` seconds before the first read
+        while not self.stop_event.wait(self.interval):
+            try:
+                available = [self.describe(info) for info in self.resolver.results()]
+                with self.lock:
+                    self.available = available
+                self.resolved.set()
+            except Exception:
+                logger.exception('Resolving the lsl streams failed.')
+
+
+discovery = StreamDiscovery()
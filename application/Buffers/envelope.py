@@ -0,0 +1,155 @@
+import numpy as np
+
+from application.Buffers.ringbuffer import RingBuffer
+
+
+class _EnvelopeLevel:
+    # min, max and mean of consecutive bins of `bin_size` samples, in rings of `capacity` bins
+
+    def __init__(self, bin_size, factor, capacity, n_channels, dtype):
+        self.bin_size = bin_size
+        self.factor = factor  # bins of the finer level per bin of this one
+        self.min = RingBuffer(capacity, dtype=(dtype, n_channels))
+        self.max = RingBuffer(capacity, dtype=(dtype, n_channels))
+        self.mean = RingBuffer(capacity, dtype=(dtype, n_channels))
+        self.clear()
+
+    def clear(self):
+        self.min.clear()
+        self.max.clear()
+        self.mean.clear()
+        # completed bins of the finer level that don't fill a bin of this one yet
+        self.pending = [np.empty((0,) + self.min.shape[1:], dtype=self.min.dtype)] * 3
+
+    @property
+    def n_written(self):
+        return self.min.n_written
+
+    @property
+    def first(self):
+        # sample position of the oldest bin still stored
+        return (self.n_written - len(self.min)) * self.bin_size
+
+    def extend(self, lo, hi, mean):
+        """Add completed bins of the finer level, return the bins completed in this one.
+        """
+        lo, hi, mean = [np.concatenate((pending, new)) for pending, new in zip(self.pending, (lo, hi, mean))]
+        n = len(lo) // self.factor * self.factor
+        self.pending = [lo[n:].copy(), hi[n:].copy(), mean[n:].copy()]
+
+        shape = (-1, self.factor, lo.shape[1])
+        lo = lo[:n].reshape(shape).min(axis=1)
+        hi = hi[:n].reshape(shape).max(axis=1)
+        mean = mean[:n].reshape(shape).mean(axis=1)
+        self.min.extend(lo)
+        self.max.extend(hi)
+        self.mean.extend(mean)
+        return lo, hi, mean
+
+
+class EnvelopePyramid:
+    """Multi-resolution min/max/mean envelope of a multichannel stream.
+
+    Level 0 holds the raw samples, level k the minimum, maximum and mean of
+    bins of ``factor ** k`` samples. Every level is a ring of `capacity`
+    bins, so level k covers ``capacity * factor ** k`` samples: the coarser
+    the level, the longer the history, for the same (small) memory per level.
+    Levels are updated incrementally, each from the completed bins of the
+    finer one, so a chunk costs O(chunk length) whatever the history length.
+
+    `window` picks the finest level that covers the requested range in at most
+    `max_points` bins (typically the width of the plot in pixels), so the cost
+    of drawing it depends on the screen width and not on the number of samples.
+
+    Examples
+    --------
+        >>> pyramid = EnvelopePyramid(n_channels=32, capacity=8192, factor=4, n_levels=7)
+        >>> pyramid.extend(chunk)
+        >>> level, positions, lo, hi, mean = pyramid.window(pyramid.n_written - 600 * fs, max_points=1000)
+    """
+
+    def __init__(self, n_channels, capacity=8192, factor=4, n_levels=7, dtype=float):
+        if capacity < factor ** (n_levels - 1):
+            raise ValueError('capacity should hold at least one bin of the coarsest level')
+
+        self.n_channels = n_channels
+        self.factor = factor
+        self.raw = RingBuffer(capacity, dtype=(dtype, n_channels))
+        self.levels = [_EnvelopeLevel(factor ** k, factor, capacity, n_channels, dtype) for k in range(1, n_levels)]
+
+    @property
+    def n_written(self):
+        return self.raw.n_written
+
+    @property
+    def n_levels(self):
+        return len(self.levels) + 1
+
+    def history(self):
+        """Number of samples covered by the coarsest level."""
+        return self.n_written - (self.levels[-1].first if self.levels else self.raw.n_written - len(self.raw))
+
+    def extend(self, chunk):
+        chunk = np.asarray(chunk)
+        if len(chunk) == 0:
+            return
+        self.raw.extend(chunk)
+
+        lo = hi = mean = chunk
+        for level in self.levels:
+            lo, hi, mean = level.extend(lo, hi, mean)
+            if len(lo) == 0:
+                break
+
+    def clear(self):
+        self.raw.clear()
+        for level in self.levels:
+            level.clear()
+
+    def select_level(self, start, end, max_points):
+        # finest level that covers [start, end) in at most `max_points` bins (the coarsest one otherwise)
+        if end - start <= max_points and self.n_written - len(self.raw) <= start:
+            return 0
+        for k, level in enumerate(self.levels, 1):
+            if -(-(end - start) // level.bin_size) <= max_points and level.first <= start:
+                return k
+        return len(self.levels)
+
+    def window(self, start, end=None, max_points=1000, level=None):
+        """Return the envelope of the samples at positions [start, end) (`end`
+        defaults to `n_written`) at the level picked by `select_level`.
+        Returns
+        -------
+        level, positions, lo, hi, mean: the level, the position of the first
+        sample of every bin, and the min, max and mean of the bins, of shape
+        (n_bins, n_channels). At level 0 lo, hi and mean are the samples.
+        """
+        end = self.n_written if end is None else min(end, self.n_written)
+        start = max(0, min(start, end))
+        level = self.select_level(start, end, max_points) if level is None else level
+
+        if level == 0:
+            first = max(start, self.n_written - len(self.raw))
+            samples = self.raw.view(self.n_written - first)[:end - first]
+            return 0, np.arange(first, end), samples, samples, samples
+
+        ring = self.levels[level - 1]
+        size = ring.bin_size
+        # complete bins in the range, then the incomplete last bin, computed from the raw samples
+        first = max(start // size, ring.n_written - len(ring.min))
+        last = min(-(-end // size), ring.n_written)
+        n = max(0, last - first)
+        offset = ring.n_written - first
+        lo = ring.min.view(offset)[:n]
+        hi = ring.max.view(offset)[:n]
+        mean = ring.mean.view(offset)[:n]
+        positions = np.arange(first, first + n) * size
+
+        tail = ring.n_written * size
+        if end > tail:
+            samples = self.raw.view(self.n_written - tail)[:end - tail]
+            lo = np.concatenate((lo, samples.min(axis=0, keepdims=True)))
+            hi = np.concatenate((hi, samples.max(axis=0, keepdims=True)))
+            mean = np.concatenate((mean, samples.mean(axis=0, keepdims=True)))
+            positions = np.append(positions, tail)
+        return level, positions, lo, hi, mean
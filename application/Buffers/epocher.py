@@ -0,0 +1,123 @@
+import numpy as np
+
+from application.Buffers.ringbuffer import TimestampedRingBuffer
+
+
+class Epocher:
+    """Streaming marker-locked epoching.
+
+    Samples are kept in a timestamped ring and markers in a pending list. As
+    soon as the post-stimulus part of a marker's epoch has been received, the
+    epoch is cut out of the ring. All ready epochs are cut at once with one
+    fancy index, so bursts of markers closer together than the epoch length
+    (overlapping epochs) cost no more than isolated ones.
+
+    The epoch of a marker starts `tmin` seconds (negative: before the marker)
+    and ends `tmax` seconds after its onset, the sample nearest to the marker,
+    both included: ``round(tmax * fs) - round(tmin * fs) + 1`` samples.
+    Markers stay pending until the ring covers their whole window, also those
+    received before their first samples (e.g. while the ring is empty). A
+    marker is only dropped, and counted in `dropped`, once the ring has
+    overwritten the start of its window.
+
+    Examples
+    --------
+        >>> epocher = Epocher(fs=250, n_channels=32, tmin=-0.2, tmax=0.8)
+        >>> lslobj = LSLBUFFER(stream_type='EEG', buffer_size=4.0)
+        >>> lslobj.configure()
+        >>> lslobj.start()
+        >>> while True:
+        ...     data, marker = lslobj.get_data()
+        ...     epochs, labels, onsets = epocher.push_chunk(data, marker)
+        ...     # epochs has shape (n_epochs, n_channels, n_samples)
+    """
+
+    def __init__(self, fs, n_channels, tmin=-0.2, tmax=0.8, buffer_size=10.0, dtype=float):
+        if tmax <= tmin:
+            raise ValueError('tmax should be larger than tmin')
+
+        self.fs = fs
+        self.n_channels = n_channels
+        self.tmin = tmin
+        self.tmax = tmax
+        # sample offsets of an epoch relative to its onset sample, from tmin to tmax included
+        self.offsets = np.arange(int(round(tmin * fs)), int(round(tmax * fs)) + 1)
+        self.n_samples = len(self.offsets)
+
+        capacity = max(int(buffer_size * fs), 2 * self.n_samples)
+        self.ring = TimestampedRingBuffer(capacity, n_channels, dtype=dtype)
+
+        self.marker_times = np.empty(0)
+        self.marker_labels = np.empty(0, dtype=object)
+        self.dropped = 0
+        self.n_pushed = 0  # samples pushed, the clock of push_chunk
+
+    @property
+    def n_pending(self):
+        return len(self.marker_times)
+
+    def add_markers(self, marker_timestamps, markers):
+        """Queue markers (timestamps on the same clock as the samples).
+        """
+        if len(marker_timestamps) == 0:
+            return
+        self.marker_times = np.concatenate((self.marker_times, np.asarray(marker_timestamps, dtype=float)))
+        labels = np.empty(len(markers), dtype=object)
+        labels[:] = list(markers)
+        self.marker_labels = np.concatenate((self.marker_labels, labels))
+
+    def push(self, samples, timestamps, marker_timestamps=(), markers=()):
+        """Add samples with their timestamps and markers, and return the epochs
+        that became complete (see `pop_epochs`).
+        """
+        if samples is not None and len(samples) > 0:
+            self.ring.extend(samples, timestamps)
+            self.n_pushed += len(samples)
+        self.add_markers(marker_timestamps, markers)
+        return self.pop_epochs()
+
+    def push_chunk(self, samples, markers=()):
+        """Add the output of `LSLBUFFER.get_data`: a chunk and an iterable of
+        (ms relative to the first sample of the chunk, marker) pairs.
+
+        Sample times are derived from the sample count and the nominal rate.
+        """
+        markers = list(markers)
+        t0 = self.n_pushed / self.fs
+        timestamps = t0 + np.arange(len(samples)) / self.fs
+        marker_timestamps = [t0 + ms / 1000. for ms, _ in markers]
+        return self.push(samples, timestamps, marker_timestamps, [label for _, label in markers])
+
+    def pop_epochs(self):
+        """Cut the epochs of all pending markers whose window is complete.
+        Returns
+        -------
+        epochs, labels, onsets: array of shape (n_epochs, n_channels, n_samples),
+        the marker of each epoch and the timestamp of its onset sample.
+        """
+        samples, timestamps = self.ring.view()
+
+        # nearest sample: first one later than half a sample period before the marker
+        onsets = np.searchsorted(timestamps, self.marker_times - 0.5 / self.fs, side='left')
+        covered = onsets + self.offsets[0] >= 0
+        ready = covered & (onsets + self.offsets[-1] < len(timestamps))
+        # a window starting before the oldest sample is only lost once the ring has overwritten samples,
+        # until then its samples may still come (the marker arrived first, e.g. while the ring was empty)
+        lost = ~covered & (self.ring.n_written > len(self.ring))
+        done = ready | lost
+        self.dropped += int(np.count_nonzero(lost))
+
+        index = onsets[ready, np.newaxis] + self.offsets[np.newaxis, :]
+        epochs = np.ascontiguousarray(samples[index].transpose(0, 2, 1))
+        labels = self.marker_labels[ready]
+        onset_timestamps = timestamps[onsets[ready]]
+
+        self.marker_times = self.marker_times[~done]
+        self.marker_labels = self.marker_labels[~done]
+        return epochs, labels, onset_timestamps
+
+    def reset(self):
+        self.ring.clear()
+        self.marker_times = np.empty(0)
+        self.marker_labels = np.empty(0, dtype=object)
+        self.n_pushed = 0
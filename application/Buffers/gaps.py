@@ -0,0 +1,194 @@
+import numpy as np
+
+# How gaps are repaired
+NAN = 'nan'  # fill the missing samples with NaN
+LINEAR = 'linear'  # interpolate linearly between the samples around the gap
+
+REPAIRS = (None, NAN, LINEAR)
+
+# What is done with samples stamped clearly before the previous one
+DROP = 'drop'  # remove them
+REGRID = 'regrid'  # move their timestamp to one period after the previous one
+
+BACKWARDS = (None, DROP, REGRID)
+
+
+class GapDetector:
+    """Check the timestamps of incoming chunks against the nominal sampling rate.
+
+    Everything is computed with vectorized diffs of the chunk's timestamps
+    (and the last timestamp of the previous chunk). lsl timestamps jitter, by
+    several milliseconds at chunk boundaries, where they often step backwards,
+    so by default no sample is ever removed:
+
+    - steps that are not forward are counted as non monotonic. Those going back
+      by more than ``max(max_jitter, 3 periods)`` are clearly bad (out of
+      order), they are only removed (`backwards='drop'`) or moved one period
+      after the previous sample (`backwards='regrid'`) if asked;
+    - timestamps are compared to a nominal time grid that follows the stream
+      (its clock drift included). A sample late on the grid by more than
+      ``max(max_jitter, 1.5 periods)`` follows a gap, the number of missing
+      samples is its delay in periods. Gaps shorter than the jitter can't be
+      told from it, and are not counted;
+    - the deviations from the grid are the jitter.
+
+    With `repair`, gaps of at most `max_fill` seconds are filled with NaN or
+    linearly interpolated samples spread between the samples around the gap,
+    so consumers that assume uniform sampling (lfilter states, sample-count
+    time axes) stay aligned. Longer gaps (e.g. the source restarted) are only
+    counted.
+
+    Streams without a nominal rate (`fs` <= 0) are only checked for non
+    monotonic samples.
+
+    Examples
+    --------
+        >>> detector = GapDetector(fs=250, repair=LINEAR)
+        >>> samples, timestamps = detector.process(samples, timestamps)
+        >>> detector.stats()
+    """
+
+    def __init__(self, fs, repair=None, backwards=None, max_jitter=0.02, max_fill=1.0, tracking=0.1):
+        if repair not in REPAIRS:
+            raise ValueError('repair should be one of %s' % (REPAIRS,))
+        if backwards not in BACKWARDS:
+            raise ValueError('backwards should be one of %s' % (BACKWARDS,))
+        self.fs = fs
+        self.period = 1.0 / fs if fs and fs > 0 else None
+        self.repair = repair
+        self.backwards = backwards
+        self.max_jitter = max_jitter
+        self.max_fill = max_fill
+        self.tracking = tracking  # fraction of the mean deviation of a chunk the grid moves by
+        self.max_backwards = max(max_jitter, 3 * self.period) if self.period else 0.0
+        self.max_delay = max(max_jitter, 1.5 * self.period) if self.period else None
+        self.reset()
+
+    def reset(self):
+        self.last_timestamp = None
+        self.last_sample = None
+        self.first_timestamp = None
+        self.expected = None  # timestamp of the next sample on the grid
+        self.n_samples = 0
+        self.n_non_monotonic = 0
+        self.n_out_of_order = 0
+        self.n_dropped = 0
+        self.n_regridded = 0
+        self.n_gaps = 0
+        self.n_missing = 0
+        self.n_filled = 0
+        self.n_steps = 0
+        self.jitter_sum_squares = 0.0
+        self.jitter_max = 0.0
+
+    def stats(self):
+        span = (self.last_timestamp - self.first_timestamp) if self.n_samples > 1 else 0.0
+        return {"samples": self.n_samples, "non_monotonic": self.n_non_monotonic,
+                "out_of_order": self.n_out_of_order, "dropped": self.n_dropped, "regridded": self.n_regridded,
+                "gaps": self.n_gaps, "missing_samples": self.n_missing, "filled_samples": self.n_filled,
+                "jitter_rms": float(np.sqrt(self.jitter_sum_squares / self.n_steps)) if self.n_steps else 0.0,
+                "jitter_max": self.jitter_max,
+                "effective_srate": float((self.n_samples - 1) / span) if span > 0 else None}
+
+    def process(self, samples, timestamps):
+        """Count the non monotonic samples and the gaps of the chunk. Return it
+        unchanged, unless `backwards` or `repair` is set.
+        """
+        timestamps = np.asarray(timestamps)
+        if len(timestamps) == 0:
+            return samples, timestamps
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamps[0]
+
+        previous = np.concatenate(([-np.inf if self.last_timestamp is None else self.last_timestamp],
+                                   timestamps[:-1]))
+        steps = timestamps - previous
+        self.n_non_monotonic += int(np.count_nonzero(steps <= 0))
+        bad = steps < -self.max_backwards
+        if bad.any():
+            self.n_out_of_order += int(np.count_nonzero(bad))
+            if self.backwards == DROP:
+                keep = ~bad
+                self.n_dropped += int(np.count_nonzero(bad))
+                samples, timestamps = samples[keep], timestamps[keep]
+                if len(timestamps) == 0:
+                    return samples, timestamps
+            elif self.backwards == REGRID:
+                # every bad sample goes one period after the one before it (after its own regridding)
+                self.n_regridded += int(np.count_nonzero(bad))
+                timestamps = timestamps.copy()
+                for i in np.flatnonzero(bad):
+                    timestamps[i] = (timestamps[i - 1] if i else self.last_timestamp) + (self.period or 0.0)
+
+        fill = None
+        if self.period is not None:
+            fill = self._check_grid(timestamps)
+
+        if fill is not None and fill.any():
+            previous = np.concatenate(([self.last_timestamp if self.last_timestamp is not None
+                                        else timestamps[0]], timestamps[:-1]))
+            samples, timestamps = self._fill(samples, timestamps, previous, fill)
+
+        self.n_samples += len(timestamps)
+        self.last_timestamp = timestamps[-1]
+        self.last_sample = np.array(samples[-1])
+        return samples, timestamps
+
+    def _check_grid(self, timestamps):
+        # compare the chunk to the grid, re-anchored after every gap; return the samples to insert
+        # before every sample if `repair` is set
+        n = len(timestamps)
+        fill = np.zeros(n, dtype=int) if self.repair is not None else None
+        start = 0
+        deviations = []
+        if self.expected is None:
+            self.expected = timestamps[0]
+        while start < n:
+            grid = self.expected + np.arange(n - start) * self.period
+            deviation = timestamps[start:] - grid
+            late = np.flatnonzero(deviation > self.max_delay)
+            end = late[0] + start if len(late) else n
+            deviations.append(deviation[:end - start])
+            if end == n:
+                # the grid follows the stream slowly, so jitter averages out but clock drift doesn't build up
+                self.expected = grid[-1] + self.period + self.tracking * deviation.mean()
+                break
+            missing = int(np.rint(deviation[end - start] / self.period))
+            self.n_gaps += 1
+            self.n_missing += missing
+            if fill is not None and missing * self.period <= self.max_fill:
+                fill[end] = missing
+            self.expected = timestamps[end] + self.period
+            start = end + 1
+
+        jitter = np.concatenate(deviations)
+        self.n_steps += len(jitter)
+        if len(jitter):
+            self.jitter_sum_squares += float(np.dot(jitter, jitter))
+            self.jitter_max = max(self.jitter_max, float(np.abs(jitter).max()))
+        return fill
+
+    def _fill(self, samples, timestamps, previous, fill):
+        # insert fill[i] samples before sample i, evenly spread after the previous timestamp
+        n_fill = int(fill.sum())
+        self.n_filled += n_fill
+        owner = np.repeat(np.arange(len(fill)), fill)  # sample that follows every inserted one
+        k = np.arange(n_fill) - np.repeat(np.cumsum(fill) - fill, fill) + 1  # 1, 2, ... within each gap
+        fraction = k / (fill[owner] + 1)
+
+        positions = np.arange(len(timestamps)) + np.cumsum(fill)  # of the received samples in the output
+        out_timestamps = np.empty(len(timestamps) + n_fill)
+        out_samples = np.empty((len(out_timestamps),) + samples.shape[1:], dtype=np.result_type(samples, float))
+        is_fill = np.ones(len(out_timestamps), dtype=bool)
+        is_fill[positions] = False
+
+        out_timestamps[positions] = timestamps
+        out_timestamps[is_fill] = previous[owner] + fraction * (timestamps[owner] - previous[owner])
+        out_samples[positions] = samples
+        if self.repair == NAN:
+            out_samples[is_fill] = np.nan
+        else:
+            before = np.concatenate((self.last_sample[np.newaxis] if self.last_sample is not None
+                                     else samples[:1], samples[:-1]))
+            out_samples[is_fill] = before[owner] + fraction[:, np.newaxis] * (samples[owner] - before[owner])
+        return out_samples, out_timestamps
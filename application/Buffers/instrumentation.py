@@ -0,0 +1,206 @@
+import json
+import logging
+import math
+import os
+import threading
+import weakref
+
+import pylsl
+
+logger = logging.getLogger(__name__)
+
+# Histograms have one bucket per power of two, from 2**MIN_EXPONENT to 2**MAX_EXPONENT
+# (about 1 microsecond to 1 day in seconds, 1 to 2**17 in samples)
+MIN_EXPONENT = -20
+MAX_EXPONENT = 17
+
+
+class Histogram:
+    """Count, sum, min, max and power-of-two buckets of recorded values.
+
+    Recording is a handful of integer operations, so it can be left on in the
+    acquisition and render loops. It takes a lock, the acquisition thread
+    records while the GUI or reporter thread takes snapshots. Percentiles are
+    estimated from the buckets (upper bound of the bucket, so within a factor
+    of two).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.count = 0
+            self.sum = 0.0
+            self.min = math.inf
+            self.max = -math.inf
+            self.buckets = [0] * (MAX_EXPONENT - MIN_EXPONENT + 1)
+
+    def record(self, value):
+        if not metrics.enabled:
+            return
+        # value = m * 2**exponent with 0.5 <= m < 1, so the bucket is the power of two above the value
+        exponent = math.frexp(value)[1] if value > 0 else MIN_EXPONENT
+        bucket = min(max(exponent, MIN_EXPONENT), MAX_EXPONENT) - MIN_EXPONENT
+        with self.lock:
+            self.count += 1
+            self.sum += value
+            if value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+            self.buckets[bucket] += 1
+
+    def percentile(self, q):
+        with self.lock:
+            return self._percentile(q)
+
+    def _percentile(self, q):
+        if self.count == 0:
+            return None
+        rank = q / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(2.0 ** (i + MIN_EXPONENT), self.max)
+        return self.max
+
+    def snapshot(self):
+        with self.lock:
+            if self.count == 0:
+                return {"count": 0}
+            return {"count": self.count, "mean": self.sum / self.count, "min": self.min, "max": self.max,
+                    "p50": self._percentile(50), "p95": self._percentile(95), "p99": self._percentile(99)}
+
+
+class Metrics:
+    """Registry of the histograms of the hot paths and of the objects that report their state.
+
+    Histograms are named ``<what>/<whose>``, e.g. ``pull_seconds/EEG@<uid>``
+    or ``render_seconds/RawSignalViewer``. A histogram (or a source) with an
+    `owner` belongs to that object alone: if its name is taken by another
+    owner, ``#2``, ``#3``... is appended, and it is dropped when its owner is
+    garbage collected. Objects registered with `register` (buffers, inlets)
+    are kept as weak references, and their `get_stats()` is called when a
+    snapshot is taken, so state like ring fill levels and subscription depths
+    costs nothing between two snapshots.
+
+    Examples
+    --------
+        >>> from application.Buffers.instrumentation import metrics
+        >>> metrics.stats()['histograms']['pull_seconds/EEG@%s' % uid]['p95']
+        >>> metrics.enabled = False   # turn recording off
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.histograms = {}
+        self.sources = weakref.WeakValueDictionary()
+        self.lock = threading.Lock()
+
+    def histogram(self, name, owner=None):
+        if owner is not None:
+            with self.lock:
+                histogram = Histogram(self._unique(name, self.histograms))
+                self.histograms[histogram.name] = histogram
+            weakref.finalize(owner, self._drop, histogram)
+            return histogram
+
+        # shared by every caller with the same name
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram(name))
+        return histogram
+
+    def register(self, name, source):
+        # `source.get_stats()` is included in every snapshot for as long as `source` lives,
+        # under the returned name (`name`, or `name#2`... if another source has it)
+        with self.lock:
+            name = self._unique(name, self.sources)
+            self.sources[name] = source
+        return name
+
+    @staticmethod
+    def _unique(name, registry):
+        unique, k = name, 1
+        while unique in registry:
+            k += 1
+            unique = '%s#%d' % (name, k)
+        return unique
+
+    def _drop(self, histogram):
+        with self.lock:
+            if self.histograms.get(histogram.name) is histogram:
+                del self.histograms[histogram.name]
+
+    def stats(self):
+        sources = {}
+        for name, source in list(self.sources.items()):
+            try:
+                sources[name] = source.get_stats()
+            except Exception:
+                logger.exception('Getting the stats of %s failed.', name)
+        return {"histograms": {name: histogram.snapshot() for name, histogram in list(self.histograms.items())},
+                "sources": sources}
+
+    def reset(self):
+        for histogram in list(self.histograms.values()):
+            histogram.reset()
+
+
+metrics = Metrics()
+
+
+class StatsReporter:
+    """Periodically log the metrics snapshot, and/or push it as a json string
+    sample on an lsl outlet (type 'Stats') that any lsl tool can record.
+
+    Examples
+    --------
+        >>> reporter = StatsReporter(interval=5.0, log=True, outlet=True)
+        >>> reporter.start()
+        >>> reporter.stop()
+    """
+
+    def __init__(self, interval=5.0, log=True, outlet=False, registry=metrics):
+        self.interval = interval
+        self.log = log
+        self.registry = registry
+        self.outlet = None
+        if outlet:
+            info = pylsl.StreamInfo('LSLBufferStats', 'Stats', 1, pylsl.IRREGULAR_RATE, pylsl.cf_string,
+                                    'lslbuffer_stats_%d' % os.getpid())
+            self.outlet = pylsl.StreamOutlet(info)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def report(self):
+        snapshot = json.dumps(self.registry.stats())
+        if self.log:
+            logger.info('stats %s', snapshot)
+        if self.outlet is not None:
+            self.outlet.push_sample([snapshot])
+
+    def _work(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.report()
+            except Exception:
+                logger.exception('Reporting stats failed.')
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._work, name='lsl-stats', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
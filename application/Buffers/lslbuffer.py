@@ -2,6 +2,7 @@ from __future__ import division
 
 import time
 import logging
+import threading
 
 import numpy as np
 import pylsl
@@ -11,6 +12,13 @@ import time
 import socket
 import xml.etree.ElementTree as ET
 
+from application.Buffers.chunkreader import ChunkReader, channel_dtype
+from application.Buffers.ringbuffer import TimestampedRingBuffer
+from application.Buffers.lslringbuffer_multithreaded import MIN_PULL_TIMEOUT, MAX_PULL_TIMEOUT
+from application.Buffers.aiostream import stream_chunks
+from application.Buffers.instrumentation import metrics
+from application.Buffers.discovery import discovery
+
 logger = logging.getLogger(__name__)
 logger.info('Logger started.')
 
@@ -30,13 +38,32 @@ class LSLBUFFER():
         ...     data, marker = lslobj.get_data()
         ...     # do something with data and/or break the loop
         >>> obj.stop()
+
+    With `window=True` a background thread keeps the last `buffer_size`
+    seconds in a ring, and `get_data` returns the latest full window without
+    blocking, so decoders can run at a fixed rate:
+
+        >>> lslobj = LSLBUFFER(stream_type='EEG', buffer_size=1.0, window=True)
+        >>> lslobj.configure()
+        >>> lslobj.start()
+        >>> while True:
+        ...     data, timestamps, sequence, marker = lslobj.get_data()
+        ...     if data is not None and sequence != last_sequence:
+        ...         # decode the window
+        ...     time.sleep(0.01)
     """
 
-    def __init__(self, stream_type='EEG', buffer_size=4.0):
+    def __init__(self, stream_type='EEG', buffer_size=4.0, window=False):
 
         self.stream_type = stream_type  # stream type
         self.buffer_size = buffer_size  # Buffer size (second)
         self.eeg_stream_name = None
+        self.window = window  # fixed-window mode, filled by a background pull
+        self.ring = None
+        self.thread = None
+        self.running = threading.Event()
+        self.markers = []  # (time corrected timestamp, marker) pulled but not returned yet
+        self.markers_lock = threading.Lock()
 
     def configure(self, **kwargs):
         """Configure the lsl stream.
@@ -93,6 +120,10 @@ class LSLBUFFER():
 
         # lsl buffer defined
         self.max_samples = int(self.fs * self.buffer_size)
+        if self.window:
+            # twice the window, so a returned window stays intact for another `buffer_size` seconds
+            self.ring = TimestampedRingBuffer(2 * self.max_samples, self.n_channels,
+                                              dtype=channel_dtype(info.channel_format()))
         logger.debug('Configuration done.')
 
     def start(self):
@@ -104,35 +135,63 @@ class LSLBUFFER():
         if self.bool_marker_streams:
             self.lsl_marker_inlet.open_stream()
 
+        if self.window and self.thread is None:
+            self.running.set()
+            self.thread = threading.Thread(target=self._acquire, name='lslbuffer-%s' % self.eeg_stream_name,
+                                           daemon=True)
+            self.thread.start()
+
     def stop(self):
         """Close the lsl inlets.
         """
+        if self.thread is not None:
+            self.running.clear()
+            self.thread.join()
+            self.thread = None
+
         logger.debug('Closing lsl streams.')
         self.lsl_inlet.close_stream()
 
         if self.bool_marker_streams:
             self.lsl_marker_inlet.close_stream()
 
-    def get_data(self):
+    def get_data(self, timeout=pylsl.FOREVER):
         """Receive a chunk of data an markers.
+        Parameters
+        ----------
+        timeout: seconds to wait for samples, forever by default. If none
+        arrive in time, the chunk is empty and no markers are pulled.
+        Ignored in window mode, which never blocks.
         Returns
         -------
         chunk, markers: Markers is time in ms since relative to the
         first sample of that block.
+
+        In window mode: window, timestamps, sequence, markers. The window is a
+        read-only view of the last `buffer_size` seconds (None until that much
+        has been received), the sequence is the number of samples received so
+        far, so it only changes when the window does, and the markers are the
+        ones received since the previous call, in ms relative to the first
+        sample of the window.
         """
 
+        if self.window:
+            return self.get_window()
+
         tc_s = self.lsl_inlet.time_correction()
         if self.bool_marker_streams:
+            # block until we actually have data
+            samples, timestamps = self.lsl_inlet.pull_chunk(timeout=timeout, max_samples=self.max_samples)
+            samples = np.array(samples).reshape(-1, self.n_channels)
+            if not timestamps:
+                return samples, zip([], [])
+
             tc_m = self.lsl_marker_inlet.time_correction()
             markers, m_timestamps = self.lsl_marker_inlet.pull_chunk(timeout=0.0, max_samples=self.max_samples)
             # flatten the output of the lsl markers, which has the form
             # [[m1], [m2]], and convert to string
             markers = [str(i) for sublist in markers for i in sublist]
 
-            # block until we actually have data
-            samples, timestamps = self.lsl_inlet.pull_chunk(timeout=pylsl.FOREVER, max_samples=self.max_samples)
-            samples = np.array(samples).reshape(-1, self.n_channels)
-
             t0 = timestamps[0] + tc_s
             m_timestamps = [(i + tc_m - t0) * 1000 for i in m_timestamps]
 
@@ -140,11 +199,80 @@ class LSLBUFFER():
 
         else:
             # block until we actually have data
-            samples, timestamps = self.lsl_inlet.pull_chunk(timeout=pylsl.FOREVER, max_samples=self.max_samples)
+            samples, timestamps = self.lsl_inlet.pull_chunk(timeout=timeout, max_samples=self.max_samples)
             samples = np.array(samples).reshape(-1, self.n_channels)
 
             return samples
 
+    def get_window(self):
+        """Return the latest full window, its time corrected timestamps, its
+        sequence number and the new markers without blocking (see `get_data`).
+        """
+        with self.ring.lock:
+            sequence = self.ring.n_written
+            if len(self.ring) < self.max_samples:
+                return None, None, sequence, []
+            samples, timestamps = self.ring.samples.view(self.max_samples), self.ring.timestamps.view(self.max_samples)
+
+        with self.markers_lock:
+            markers, self.markers = self.markers, []
+        t0 = timestamps[0]
+        return samples, timestamps, sequence, [(float(t - t0) * 1000, marker) for t, marker in markers]
+
+    def _acquire(self):
+        # background pull of the window mode: samples into the ring, markers into the pending list
+        reader = ChunkReader(self.lsl_inlet)
+        # each pull sleeps in liblsl for about one sample period, as LSLRINGBUFFER.get_pull_timeout
+        timeout = min(MAX_PULL_TIMEOUT, max(MIN_PULL_TIMEOUT, 1.0 / self.fs)) if self.fs > 0 else MAX_PULL_TIMEOUT
+        while self.running.is_set():
+            samples, timestamps = reader.pull(timeout=timeout)
+            if samples is not None:
+                self.ring.extend(samples, timestamps + self.lsl_inlet.time_correction())
+
+            if self.bool_marker_streams:
+                markers, m_timestamps = self.lsl_marker_inlet.pull_chunk(timeout=0.0)
+                if m_timestamps:
+                    tc_m = self.lsl_marker_inlet.time_correction()
+                    with self.markers_lock:
+                        self.markers.extend((t + tc_m, str(i)) for t, sublist in zip(m_timestamps, markers)
+                                            for i in sublist)
+
+    def stream(self, maxsize=8, timeout=0.1):
+        """Asynchronously iterate over the `get_data` results.
+        The blocking pulls run in the event loop's default executor and wait
+        at most `timeout` seconds each, so the iteration can be stopped at any
+        time; at most `maxsize` results are queued for a lagging consumer.
+        In window mode every new window is yielded once, as returned by
+        `get_data`, waiting on the ring for new samples in between.
+        Examples
+        --------
+            >>> async for data, marker in lslobj.stream():
+            ...     # do something with data and/or break the loop
+            >>> async for window, timestamps, sequence, markers in windowed.stream():
+            ...     # decode the window
+        """
+        if self.window:
+            seen = [0]  # n_written at the last pass, full window or not
+
+            def pull():
+                # get_window hands out the pending markers, so it is only called once the window changed.
+                # The wait always starts from the last n_written seen, so a ring that is still filling
+                # doesn't make the loop spin
+                if self.ring.wait_for_data(seen[0], timeout=timeout) == seen[0]:
+                    return None
+                window, timestamps, sequence, markers = self.get_window()
+                seen[0] = sequence
+                if window is None:
+                    return None
+                return window, timestamps, sequence, markers
+        else:
+            def pull():
+                data = self.get_data(timeout=timeout)
+                samples = data[0] if self.bool_marker_streams else data
+                return data if len(samples) > 0 else None
+
+        return stream_chunks(pull, maxsize=maxsize)
+
     def get_channels(self):
         """Get channel names.
         """
@@ -185,7 +313,9 @@ class LSLInlet:
             streams = resolve_bypred("name='{}' and hostname='{}'".format(name, socket.gethostname()))
         """
         self.stream_type = name
+        self.stream_info = stream
         self.inlet = None
+        self.reader = None
         self.dtype = 'float64'
         self.stream_name = pylsl.StreamInfo.name(stream)
         # self.fs = pylsl.StreamInfo.nominal_srate(stream)
@@ -201,7 +331,12 @@ class LSLInlet:
             """
             logger.debug('Opening lsl streams.')
             self.inlet.open_stream()
-            # self.dtype = fmt2string[self.inlet.info().channel_format()]
+            self.reader = ChunkReader(self.inlet)
+            self.dtype = self.reader.channel_format
+            key = '%s@%s' % (self.stream_name, pylsl.StreamInfo.uid(stream))
+            self.pull_seconds = metrics.histogram('pull_seconds/%s' % key, owner=self)
+            self.pull_latency = metrics.histogram('pull_latency_seconds/%s' % key, owner=self)
+            self.chunk_samples = metrics.histogram('chunk_samples/%s' % key, owner=self)
             print('Connected to {} LSL stream successfully'.format(name))
             self.n_channels = self.inlet.info().channel_count()
             self.channels = ['Ch %i' % i for i in range(self.n_channels)]
@@ -212,12 +347,16 @@ class LSLInlet:
             print('Cannot connect to "{}" LSL stream'.format(name))
 
     def get_next_chunk(self):
-        # get next chunk
-        chunk, timestamp = self.inlet.pull_chunk()
-        # convert to numpy array
-        chunk = np.array(chunk, dtype=self.dtype)
-        # return first n_channels channels or None if empty chunk
-        return (chunk, timestamp) if chunk.shape[0] > 0 else (None, None)
+        # get next chunk, pulled straight into the reader's preallocated arrays.
+        # The returned arrays are views that are overwritten by the next pull.
+        # return chunk and timestamps or None if empty chunk
+        t0 = time.perf_counter()
+        sample, timestamp = self.reader.pull()
+        self.pull_seconds.record(time.perf_counter() - t0)
+        if sample is not None:
+            self.pull_latency.record(pylsl.local_clock() - timestamp[-1])
+            self.chunk_samples.record(len(sample))
+        return sample, timestamp
 
     def update_action(self):
         pass
@@ -242,20 +381,10 @@ class LSLInlet:
         return self.inlet.info().channel_count()
 
     def get_channels_labels(self):
-        for t in range(3):
-            time.sleep(0.5 * (t + 1))
-            try:
-                # print('wow') TODO too many repetitions
-                rt = ET.fromstring(self.info_as_xml())
-                channels_tree = rt.find('desc').findall("channel") or rt.find('desc').find("channels").findall(
-                    "channel")
-                labels = [(ch.find('label') if ch.find('label') is not None else ch.find('name')).text
-                          for ch in channels_tree]
-                return labels
-            except OSError:
-                print('OSError during reading channels names', t + 1)
-        return ['channel' + str(n + 1) for n in range(self.get_n_channels())]
+        # parsed once per stream uid and cached by the discovery service, see application.Buffers.discovery
+        return discovery.describe(self.stream_info, self.inlet).get_channels()
 
     def disconnect(self):
         del self.inlet
         self.inlet = None
+        self.reader = None
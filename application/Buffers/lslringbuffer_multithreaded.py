@@ -1,21 +1,29 @@
 from queue import Queue
 from threading import Thread
+import threading
 import time
-from pylsl import StreamInlet, resolve_stream, StreamInfo, StreamOutlet
-# Options for Ringbuffer
-# Option 1:
-# For having linked list
-# import collections
-# buffer_data = collections.deque()
-
-# Option 2:
-# For having numpy ringbuffer
+from pylsl import StreamInlet, resolve_stream, StreamInfo, StreamOutlet, local_clock
 import numpy as np
-from numpy_ringbuffer import RingBuffer
+
+from application.Buffers.ringbuffer import TimestampedRingBuffer
+from application.Buffers.sharedring import SharedRingBuffer
+from application.Buffers.subscription import DROP_OLDEST
+from application.Buffers.aiostream import stream_chunks
+from application.Buffers.chunkreader import ChunkReader, channel_dtype
+from application.Buffers.instrumentation import metrics
+from application.Buffers.gaps import GapDetector
+from application.Buffers.derived import DerivedStream
+
+# Number of samples kept for streams without a nominal sampling rate (irregular rate)
+IRREGULAR_BUFFER_LENGTH = 1024
+
+# Bounds (seconds) of the time run() sleeps in a pull while waiting for samples
+MIN_PULL_TIMEOUT = 0.02
+MAX_PULL_TIMEOUT = 0.1
 
 
 class LSLRINGBUFFER:
-    def __init__(self, lsl_type='EEG', name=None, inlet=None, fs=250, buffer_duration=4.0, num_channels=32, filter=filter, uid=None, hostname=None, channel_format='float32'):
+    def __init__(self, lsl_type='EEG', name=None, inlet=None, fs=250, buffer_duration=4.0, num_channels=32, filter=filter, uid=None, hostname=None, channel_format='float32', shared_memory=False, repair=None, scale=None, channels=None, backwards=None):
         #      self.queue = queue
         self.lsl_type = lsl_type  # Type of LSL that has to be parsed into the ring buffer
         self.stream_name=name
@@ -23,21 +31,57 @@ class LSLRINGBUFFER:
         self.fs = fs  # Sampling rate of LSL
         self.buffer_duration = buffer_duration  # Duration of Buffer
         self.num_channels = num_channels  # Number of channels
-        self.channels = ['Ch %i' % i for i in range(self.num_channels)]
+        self.channels = list(channels) if channels is not None else ['Ch %i' % i for i in range(self.num_channels)]
         self.uid = uid 
         self.hostname = hostname
         self.channel_format = channel_format
         self.filter = filter
         self.chunk=None
+        self.reader = None  # created on the first pull, the inlet may be attached later
+        self.queues = []  # queues fed by run(), for get_stats()
+        self.derived = {}  # name -> DerivedStream, filtered copies computed by pump()
+        self.derived_lock = threading.Lock()
+        # Timestamps are checked against the nominal rate: non monotonic samples and gaps are counted, samples
+        # clearly out of order are only dropped or regridded with `backwards` ('drop' or 'regrid'), and gaps
+        # are filled with `repair` ('nan' or 'linear') so the ring stays uniformly sampled
+        self.gaps = GapDetector(self.fs, repair=repair, backwards=backwards)
+
+        buffer_length = int(self.fs * self.buffer_duration) if self.fs > 0 else IRREGULAR_BUFFER_LENGTH
 
-    def run(self, stop, buffer_queue, chunk_queue=None):
+        # Samples are kept in the stream's native format (an int16 stream takes a quarter of the memory
+        # of float64), `scale` (a factor, or one per channel) converts them to float on read if asked
+        self.dtype = channel_dtype(channel_format)
+        self.scale = scale
+        if repair == 'nan' and self.dtype.kind != 'f':
+            raise ValueError("repair='nan' needs a floating point channel format, not %s" % channel_format)
 
-        buffer_length = int(self.fs * self.buffer_duration)
+        # Instantiate mirrored ring buffers for the samples and their timestamps.
+        # Reads from them are contiguous views, so consumers never unwrap (copy) the window.
+        # With `shared_memory` (True or a segment name) the rings live in shared memory, and other
+        # processes can read them with SharedRingBuffer.attach(self.get_shared_memory_name()).
+        if shared_memory:
+            if self.dtype.hasobject:
+                raise ValueError('string streams can not be kept in shared memory')
+            self.ring = SharedRingBuffer.create(capacity=buffer_length, n_channels=self.num_channels,
+                                                dtype=self.dtype,
+                                                name=shared_memory if isinstance(shared_memory, str) else None,
+                                                info=self.get_lsl_info())
+        else:
+            self.ring = TimestampedRingBuffer(capacity=buffer_length, n_channels=self.num_channels, dtype=self.dtype)
 
-        # Instantiate numpy_ringbuffer object with the required buffer size and number of channels
-        buffer_data = RingBuffer(capacity=buffer_length, dtype=(float, self.num_channels))
+        # hot path metrics of this buffer, keyed by stream uid, see application.Buffers.instrumentation
+        key = '%s@%s' % (self.stream_name, self.uid) if self.uid else self.stream_name
+        self.pull_seconds = metrics.histogram('pull_seconds/%s' % key, owner=self)
+        self.pull_latency = metrics.histogram('pull_latency_seconds/%s' % key, owner=self)
+        self.chunk_samples = metrics.histogram('chunk_samples/%s' % key, owner=self)
+        metrics.register('LSLRINGBUFFER/%s' % key, self)
+
+    def run(self, stop, buffer_queue, chunk_queue=None, timeout=None):
+
+        # Each pull sleeps in liblsl until samples arrive (or `timeout` expires) instead of spinning
+        timeout = self.get_pull_timeout() if timeout is None else timeout
+        self.queues = [queue for queue in (buffer_queue, chunk_queue) if queue is not None]
 
-        # create a new inlet to read from the stream
         # Send data to the buffer
         while True:
             
@@ -47,27 +91,149 @@ class LSLRINGBUFFER:
                 print("Thread stopped")
                 break
 
-            # get a new data chunk (you can also omit the timestamp part if you're not interested)
-            #self.chunk = self.pull_next_chunk()
-            sample, timestamp = self.get_next_chunk()#get_next_chunk()
-            
+            # get a new data chunk and put it in the ring buffer
+            sample, timestamp = self.pump(timeout=timeout)
             
-            # If new chunk is received, then put in the buffer
-            if timestamp:
-                #print(sample.shape)
-                buffer_data.extend(np.array(sample))
-                # Put the data in the thread
-                buffer_queue.put(buffer_data)
+            # If new chunk is received, then pass it on
+            if sample is not None:
+                # Put the latest window (read-only view) in the thread. Windows are only put once the
+                # consumer took the previous one, so a lagging consumer can't make the queue grow;
+                # use subscribe() for every chunk or for independent cursors with drop policies.
+                if buffer_queue.empty():
+                    buffer_queue.put(self.ring.samples.view())
                 if chunk_queue:
                     chunk_queue.put(np.array(sample))
 
-    def get_next_chunk(self):
-        # get next chunk
-        chunk, timestamp = self.inlet.pull_chunk()
-        # convert to numpy array
-        chunk = np.array(chunk, dtype=self.get_channel_format())
-        # return first n_channels channels or None if empty chunk
-        return (chunk, timestamp) if chunk.shape[0] > 0 else (None, None)
+    def pump(self, timeout=0.0):
+        # Pull the next chunk from the inlet into the ring buffer, waiting up to `timeout` seconds.
+        # Used by run() and by the shared AcquisitionEngine. Consumers waiting on the ring are woken.
+        sample, timestamp = self.get_next_chunk(timeout=timeout)
+        if sample is not None:
+            sample, timestamp = self.gaps.process(sample, timestamp)
+            if len(timestamp) == 0:
+                return None, None
+            self.ring.extend(sample, timestamp)
+            # the dict is replaced, never mutated, so iterating a reference to it is safe
+            for derived in self.derived.values():
+                derived.push(sample, timestamp)
+        return sample, timestamp
+
+    def derive(self, name, filter):
+        """Return the DerivedStream `name`, created with `filter` if it doesn't
+        exist yet (it is shared otherwise, and `filter` is ignored). Every call
+        should be matched by a `release_derived`.
+        """
+        with self.derived_lock:
+            derived = self.derived.get(name)
+            if derived is None:
+                derived = DerivedStream(self, name, filter)
+                self.derived = dict(self.derived, **{name: derived})
+            derived.refcount += 1
+            return derived
+
+    def release_derived(self, derived):
+        # the derived stream is no longer computed once its last user released it
+        with self.derived_lock:
+            derived.refcount -= 1
+            if derived.refcount <= 0 and self.derived.get(derived.name) is derived:
+                self.derived = {name: d for name, d in self.derived.items() if d is not derived}
+
+    def get_next_chunk(self, timeout=0.0):
+        # get next chunk, pulled straight into the reader's preallocated arrays.
+        # The returned arrays are views that are overwritten by the next pull.
+        if self.reader is None:
+            self.reader = ChunkReader(self.inlet)
+        # return chunk and timestamps or None if empty chunk
+        t0 = time.perf_counter()
+        sample, timestamp = self.reader.pull(timeout=timeout)
+        self.pull_seconds.record(time.perf_counter() - t0)
+        if sample is not None:
+            # age of the newest sample (without time correction, includes the clock offset of remote hosts)
+            self.pull_latency.record(local_clock() - timestamp[-1])
+            self.chunk_samples.record(len(sample))
+        return sample, timestamp
+
+    def get_pull_timeout(self):
+        # about one sample period, kept between MIN_PULL_TIMEOUT (latency) and MAX_PULL_TIMEOUT
+        if self.fs > 0:
+            return min(MAX_PULL_TIMEOUT, max(MIN_PULL_TIMEOUT, 1.0 / self.fs))
+        return MAX_PULL_TIMEOUT
+
+    def wait_for_data(self, position, timeout=None):
+        # block until samples past `position` are in the ring (or timeout), return n_written
+        return self.ring.wait_for_data(position, timeout=timeout)
+
+    def subscribe(self, policy=DROP_OLDEST, max_chunks=32, timeout=None):
+        # new consumer with its own read cursor into the ring, see Subscription
+        return self.ring.subscribe(policy=policy, max_chunks=max_chunks, timeout=timeout)
+
+    def stream(self, maxsize=8, pump=True, timeout=None):
+        # Asynchronously iterate over the chunks (copies of samples and timestamps):
+        #     async for samples, timestamps in lsl.stream():
+        # With `pump` the blocking pulls of the inlet run in the event loop's default executor, so
+        # nothing else (run() or an AcquisitionEngine) may pull this buffer. Without it the chunks
+        # are read from a subscription to a buffer that is acquired elsewhere. Pulls wait at most
+        # `timeout` seconds (get_pull_timeout() by default) and at most `maxsize` chunks are queued.
+        timeout = self.get_pull_timeout() if timeout is None else timeout
+
+        if pump:
+            def pull():
+                sample, timestamp = self.pump(timeout=timeout)
+                return None if sample is None else (np.array(sample, dtype=self.ring.samples.dtype),
+                                                    np.array(timestamp))
+            return stream_chunks(pull, maxsize=maxsize)
+
+        subscription = self.subscribe(policy=DROP_OLDEST, max_chunks=maxsize)
+
+        def pull():
+            sample, timestamp = subscription.get(timeout=timeout)
+            return None if sample is None else (np.array(sample), np.array(timestamp))
+
+        async def chunks():
+            try:
+                async for chunk in stream_chunks(pull, maxsize=maxsize):
+                    yield chunk
+            finally:
+                subscription.close()
+
+        return chunks()
+
+    def read_since(self, position, scaled=False):
+        # samples and timestamps (read-only views) written after `position`, and the new position
+        samples, timestamps, position = self.ring.read_since(position)
+        return (self.to_float(samples) if scaled else samples), timestamps, position
+
+    def get_window(self, t_start, t_end, scaled=False):
+        # samples and timestamps (read-only views) with t_start <= timestamp <= t_end
+        samples, timestamps = self.ring.get_window(t_start, t_end)
+        return (self.to_float(samples) if scaled else samples), timestamps
+
+    def get_latest(self, seconds, scaled=False):
+        # samples and timestamps (read-only views) of the last `seconds` of data
+        samples, timestamps = self.ring.get_latest(seconds)
+        return (self.to_float(samples) if scaled else samples), timestamps
+
+    def to_float(self, samples):
+        # float64 copy of native samples, multiplied by `scale` if set
+        samples = np.asarray(samples, dtype='float64')
+        return samples if self.scale is None else samples * self.scale
+
+    def get_shared_memory_name(self):
+        # name that reader processes attach to, or None if the ring is not shared
+        return self.ring.name if isinstance(self.ring, SharedRingBuffer) else None
+
+    def close(self):
+        # release the shared memory of the ring, if any
+        if isinstance(self.ring, SharedRingBuffer):
+            self.ring.close()
+
+    def get_stats(self):
+        # state of the ring, the run() queues and the subscriptions, reported by the metrics registry
+        return {"fill": len(self.ring) / self.ring.capacity, "n_written": self.ring.n_written,
+                "queue_depth": [queue.qsize() for queue in self.queues],
+                "subscriptions": [subscription.stats() for subscription in self.ring.subscriptions],
+                "gaps": self.gaps.stats(),
+                "derived": {name: derived.get_stats() for name, derived in self.derived.items()}}
 
     def get_stream_name(self):
         return self.stream_name
@@ -0,0 +1,478 @@
+import json
+import logging
+import struct
+import threading
+import time
+
+import numpy as np
+
+from application.Buffers.chunkreader import CHANNEL_FORMATS
+from application.Buffers.subscription import DROP_OLDEST
+
+logger = logging.getLogger(__name__)
+
+# File layout, all little endian and every part 8 byte aligned:
+#   file header   FILE_MAGIC, uint64 size of the json, json {"version", "created", "streams": [info, ...]}
+#   blocks        BLOCK_HEADER, float64 timestamps, then the samples (C order) or the json encoded markers
+#   index block   one INDEX_DTYPE entry per block, written by Recorder.stop()
+#   trailer       TRAILER_MAGIC, uint64 offset of the index block
+# A file without a trailer (the recorder was killed) is still readable, its blocks are scanned.
+FILE_MAGIC = b'LSLREC\x00\x01'
+TRAILER_MAGIC = b'LSLRIDX\x00'
+VERSION = 1
+
+DATA = b'DATA'
+MARKERS = b'MRKR'
+INDEX = b'INDX'
+
+# kind, stream id, number of samples, number of channels, payload size, first and last timestamp
+BLOCK_HEADER = struct.Struct('<4sIIIQdd')
+TRAILER = struct.Struct('<8sQ')
+
+INDEX_DTYPE = np.dtype([
+    ('offset', '<u8'),  # file offset of the block header
+    ('kind', 'S4'),
+    ('stream', '<u4'),
+    ('n_samples', '<u4'),
+    ('first', '<f8'),
+    ('last', '<f8'),
+])
+
+# Samples kept per block of streams without a nominal sampling rate
+IRREGULAR_BLOCK_LENGTH = 1024
+
+
+def _padding(n_bytes):
+    return -n_bytes % 8
+
+
+class _RecordedStream:
+    # per stream state of the recorder: the subscription it drains and the block being filled
+
+    def __init__(self, stream_id, info, subscription, dtype, n_channels, block_length):
+        self.id = stream_id
+        self.info = info
+        self.subscription = subscription
+        self.samples = np.empty((block_length, n_channels), dtype=dtype)
+        self.timestamps = np.empty(block_length, dtype='float64')
+        self.fill = 0
+        self.started = None  # monotonic time the first sample of the block was collected
+        self.n_samples = 0
+        self.n_blocks = 0
+        self.n_overwritten = 0  # samples lapped by the writer while they were copied
+
+
+class Recorder:
+    """Record LSLRINGBUFFERs (and marker inlets) to an append-only chunked file.
+
+    The recorder subscribes to every buffer with a DROP_OLDEST subscription,
+    so it never stalls acquisition: if the disk can't keep up, the samples it
+    misses are counted in `stats()` and the file goes on. A background thread
+    drains the subscriptions into one preallocated block per stream and writes
+    full blocks (`block_duration` seconds of data) with one bulk write, so the
+    memory used is bounded by the block size whatever the recording length.
+
+    The file header holds the `get_lsl_info()` metadata of every stream, the
+    blocks their samples and timestamps, and an index of all blocks is appended
+    when the recording stops. See `RecordingReader` to read it back.
+
+    Examples
+    --------
+        >>> recorder = Recorder('session.lslrec')
+        >>> recorder.add_stream(lslringbuffer)
+        >>> recorder.add_marker_stream(marker_inlet)
+        >>> recorder.start()
+        >>> ...
+        >>> recorder.stop()
+    """
+
+    def __init__(self, path, block_duration=1.0, interval=0.05, max_chunks=256):
+        self.path = path
+        self.block_duration = block_duration  # seconds of data per block
+        self.interval = interval  # seconds between two passes of the writer over the subscriptions
+        self.max_chunks = max_chunks  # unread chunks kept per subscription before dropping
+
+        self.streams = []
+        self.marker_inlets = []  # (stream id, inlet)
+        self.infos = []
+        self.index = []
+        self.file = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def add_stream(self, buffer):
+        """Record the samples of an LSLRINGBUFFER from now on. Returns the stream id.
+        """
+        if self.thread is not None:
+            raise RuntimeError('streams have to be added before the recording starts')
+
+        fs = buffer.get_nominal_srate()
+        block_length = max(1, int(fs * self.block_duration)) if fs and fs > 0 else IRREGULAR_BLOCK_LENGTH
+        dtype = buffer.ring.samples.dtype
+
+        info = dict(buffer.get_lsl_info(), kind='samples', dtype=dtype.str)
+        subscription = buffer.subscribe(policy=DROP_OLDEST, max_chunks=self.max_chunks)
+        stream = _RecordedStream(len(self.infos), info, subscription, dtype, buffer.get_channel_count(),
+                                 block_length)
+        self.infos.append(info)
+        self.streams.append(stream)
+        return stream.id
+
+    def add_marker_stream(self, inlet):
+        """Record the markers of a (string) lsl inlet, pulled by the writer thread. Returns the stream id.
+        """
+        if self.thread is not None:
+            raise RuntimeError('streams have to be added before the recording starts')
+
+        lsl_info = inlet.info()
+        info = {"stream_name": lsl_info.name(), "sampling_rate": lsl_info.nominal_srate(),
+                "number_of_channels": lsl_info.channel_count(),
+                "channel_format": CHANNEL_FORMATS[lsl_info.channel_format()], "uid": lsl_info.uid(),
+                "hostname": lsl_info.hostname(), "stream_type": lsl_info.type(), "kind": 'markers'}
+        stream_id = len(self.infos)
+        self.infos.append(info)
+        self.marker_inlets.append((stream_id, inlet))
+        return stream_id
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.file = open(self.path, 'wb')
+        self._write_header()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._work, name='lsl-recorder', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Write the pending samples and the block index, and close the file.
+        """
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+        for stream in self.streams:
+            self._drain(stream)
+            self._write_samples(stream)
+            stream.subscription.close()
+        for stream_id, inlet in self.marker_inlets:
+            self._pull_markers(stream_id, inlet)
+        self._write_index()
+        self.file.close()
+        self.file = None
+
+    def stats(self):
+        return [{"stream_name": stream.info["stream_name"], "samples": stream.n_samples, "blocks": stream.n_blocks,
+                 "dropped_samples": stream.subscription.dropped_samples + stream.n_overwritten} for stream in self.streams]
+
+    def _work(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                for stream in self.streams:
+                    self._drain(stream)
+                for stream_id, inlet in self.marker_inlets:
+                    self._pull_markers(stream_id, inlet)
+            except Exception:
+                logger.exception('Recording to %s failed.', self.path)
+
+    def _drain(self, stream):
+        # copy the unread samples into the block, writing every block that fills up
+        subscription = stream.subscription
+        ring = subscription.ring
+        with subscription.condition:
+            samples, timestamps = subscription.get_all()
+            position = subscription.position - (len(samples) if samples is not None else 0)  # of samples[0]
+        while samples is not None and len(samples) > 0:
+            if stream.fill == 0:
+                stream.started = time.monotonic()
+            n = min(len(samples), len(stream.timestamps) - stream.fill)
+            stream.samples[stream.fill:stream.fill + n] = samples[:n]
+            stream.timestamps[stream.fill:stream.fill + n] = timestamps[:n]
+            # the views alias the ring: the oldest samples may have been overwritten by the writer during
+            # the copy, so they are removed from the block and counted as dropped, like the subscription does
+            with ring.lock:
+                oldest = ring.n_written - ring.capacity
+            lost = min(max(oldest - position, 0), n)
+            if lost:
+                kept = slice(stream.fill + lost, stream.fill + n)
+                stream.samples[stream.fill:stream.fill + n - lost] = stream.samples[kept].copy()
+                stream.timestamps[stream.fill:stream.fill + n - lost] = stream.timestamps[kept].copy()
+                stream.n_overwritten += lost
+            stream.fill += n - lost
+            position += n
+            samples, timestamps = samples[n:], timestamps[n:]
+            if stream.fill == len(stream.timestamps):
+                self._write_samples(stream)
+
+        # don't keep a partial block of a slow (or stalled) stream in memory for long
+        if stream.fill and time.monotonic() - stream.started >= self.block_duration:
+            self._write_samples(stream)
+
+    def _pull_markers(self, stream_id, inlet):
+        markers, timestamps = inlet.pull_chunk(timeout=0.0)
+        if timestamps:
+            payload = json.dumps(markers).encode()
+            self._write_block(MARKERS, stream_id, len(timestamps), len(markers[0]),
+                              np.asarray(timestamps, dtype='float64'), payload)
+
+    def _write_samples(self, stream):
+        n = stream.fill
+        if n == 0:
+            return
+        self._write_block(DATA, stream.id, n, stream.samples.shape[1], stream.timestamps[:n], stream.samples[:n])
+        stream.fill = 0
+        stream.n_samples += n
+        stream.n_blocks += 1
+
+    def _write_block(self, kind, stream_id, n_samples, n_channels, timestamps, payload):
+        payload = memoryview(payload).cast('B')
+        size = timestamps.nbytes + len(payload)
+        offset = self.file.tell()
+        self.file.write(BLOCK_HEADER.pack(kind, stream_id, n_samples, n_channels, size,
+                                          timestamps[0], timestamps[-1]))
+        self.file.write(memoryview(timestamps).cast('B'))
+        self.file.write(payload)
+        self.file.write(b'\x00' * _padding(size))
+        # a block is only complete on disk once it is flushed, a reader of a killed recording stops before it
+        self.file.flush()
+        self.index.append((offset, kind, stream_id, n_samples, timestamps[0], timestamps[-1]))
+
+    def _write_header(self):
+        header = json.dumps({"version": VERSION, "created": time.time(), "streams": self.infos}).encode()
+        self.file.write(FILE_MAGIC + struct.pack('<Q', len(header)) + header + b'\x00' * _padding(len(header)))
+        self.index = []
+
+    def _write_index(self):
+        index = np.array(self.index, dtype=INDEX_DTYPE)
+        offset = self.file.tell()
+        first, last = (index['first'][0], index['last'][-1]) if len(index) else (0.0, 0.0)
+        self.file.write(BLOCK_HEADER.pack(INDEX, 0, len(index), 0, index.nbytes, first, last))
+        self.file.write(index.tobytes())
+        self.file.write(TRAILER.pack(TRAILER_MAGIC, offset))
+
+
+class RecordingReader:
+    """Random access to a file written by `Recorder`.
+
+    The file is memory-mapped, so hour-long recordings are never loaded into
+    RAM: only the pages of the blocks that are read are. The block index is
+    loaded from the end of the file, or rebuilt by scanning the blocks if the
+    recording was not stopped cleanly.
+
+    Every stream is read through a `RecordedStream`, which has the window
+    queries of the live `LSLRINGBUFFER` (`get_window`, `get_latest`), so the
+    same analysis code runs on both.
+
+    Examples
+    --------
+        >>> reader = RecordingReader('session.lslrec')
+        >>> eeg = reader.get_stream('EEG')
+        >>> samples, timestamps = eeg.read(t0, t1, channels=[0, 3])
+        >>> samples, timestamps = eeg.get_window(t0, t1)
+        >>> for samples, timestamps in reader.iter_blocks(stream=0):
+        ...     process(samples)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            magic, size = struct.unpack('<8sQ', file.read(16))
+            if magic != FILE_MAGIC:
+                raise ValueError('%s is not an lsl recording' % path)
+            header = json.loads(file.read(size))
+        self.version = header["version"]
+        self.created = header["created"]
+        self.streams = header["streams"]
+        self.data_offset = 16 + size + _padding(size)
+
+        self.data = np.memmap(path, dtype='u1', mode='r').view(np.ndarray)
+        self.file_size = len(self.data)
+
+        self.index = self._load_index()
+        if self.index is None:
+            self.index = self._scan()
+        self._streams = {}
+
+    def _block_header(self, offset):
+        return BLOCK_HEADER.unpack(self.data[offset:offset + BLOCK_HEADER.size].tobytes())
+
+    def _load_index(self):
+        if self.file_size < self.data_offset + TRAILER.size:
+            return None
+        magic, offset = TRAILER.unpack(self.data[-TRAILER.size:].tobytes())
+        if magic != TRAILER_MAGIC or offset + BLOCK_HEADER.size > self.file_size:
+            return None
+        kind, _, _, _, size, _, _ = self._block_header(offset)
+        if kind != INDEX:
+            return None
+        start = offset + BLOCK_HEADER.size
+        return self.data[start:start + size].view(INDEX_DTYPE)
+
+    def _scan(self):
+        # rebuild the index block by block, up to the first incomplete block
+        entries = []
+        offset = self.data_offset
+        while offset + BLOCK_HEADER.size <= self.file_size:
+            kind, stream, n_samples, _, size, first, last = self._block_header(offset)
+            end = offset + BLOCK_HEADER.size + size + _padding(size)
+            if kind not in (DATA, MARKERS) or end > self.file_size:
+                break
+            entries.append((offset, kind, stream, n_samples, first, last))
+            offset = end
+        return np.array(entries, dtype=INDEX_DTYPE)
+
+    def read_block(self, i):
+        """Return the samples (or list of markers) and timestamps of the `i`th
+        block, samples and timestamps as read-only views of the file.
+        """
+        offset = int(self.index['offset'][i])
+        kind, stream, n_samples, n_channels, size, _, _ = self._block_header(offset)
+        start = offset + BLOCK_HEADER.size
+        timestamps = self.data[start:start + 8 * n_samples].view('<f8')
+        start += 8 * n_samples
+        if kind == MARKERS:
+            return json.loads(self.data[start:offset + BLOCK_HEADER.size + size].tobytes()), timestamps
+        dtype = np.dtype(self.streams[stream]["dtype"])
+        samples = self.data[start:start + n_samples * n_channels * dtype.itemsize].view(dtype)
+        return samples.reshape(n_samples, n_channels), timestamps
+
+    def iter_blocks(self, stream=None):
+        """Iterate over the (samples, timestamps) of the blocks of `stream` (all streams by default) in file order.
+        """
+        for i in range(len(self.index)):
+            if stream is None or self.index['stream'][i] == stream:
+                yield self.read_block(i)
+
+    def get_stream(self, stream=0):
+        """Return the RecordedStream of a stream id, or of the first stream with
+        that name or type.
+        """
+        if not isinstance(stream, int):
+            matches = [i for i, info in enumerate(self.streams)
+                       if stream in (info.get("stream_name"), info.get("stream_type"))]
+            if not matches:
+                raise KeyError('no stream named %r in %s' % (stream, self.path))
+            stream = matches[0]
+        if stream not in self._streams:
+            self._streams[stream] = RecordedStream(self, stream)
+        return self._streams[stream]
+
+    def read(self, t_start, t_end, channels=None, stream=0):
+        return self.get_stream(stream).read(t_start, t_end, channels)
+
+    def close(self):
+        self._streams = {}
+        self.index = self.data = None
+
+
+class RecordedStream:
+    """One stream of a recording, with the window queries of LSLRINGBUFFER.
+
+    A coarse index of the first timestamp of every block locates the blocks
+    of a window with a binary search, and a second binary search in the
+    timestamps of the first and last block (a few pages of the mapped file)
+    locates the samples. Windows within one block are returned as read-only
+    views of the file, windows spanning blocks are concatenated.
+    """
+
+    def __init__(self, reader, stream):
+        self.reader = reader
+        self.id = stream
+        self.info = reader.streams[stream]
+        self.blocks = np.flatnonzero(reader.index['stream'] == stream)
+        self.first = np.asarray(reader.index['first'][self.blocks])
+        self.last = np.asarray(reader.index['last'][self.blocks])
+        # position of the first sample of every block in the stream
+        self.starts = np.r_[0, np.cumsum(reader.index['n_samples'][self.blocks], dtype='int64')]
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    @property
+    def duration(self):
+        return float(self.last[-1] - self.first[0]) if len(self.blocks) else 0.0
+
+    def _channels(self, channels):
+        # channel indices from indices or labels
+        if channels is None or isinstance(channels, slice):
+            return channels
+        labels = self.info.get("channels") or []
+        return [labels.index(ch) if isinstance(ch, str) else ch for ch in channels]
+
+    def _locate(self, t, side):
+        # (block number, sample in the block) of the searchsorted position of `t` in the stream
+        b = max(np.searchsorted(self.first, t, side='right') - 1, 0)
+        if t > self.last[b] or (side == 'right' and t == self.last[b]):
+            # past the last sample of block b: the start of the next one
+            return b + 1, 0
+        _, timestamps = self.reader.read_block(self.blocks[b])
+        return b, int(np.searchsorted(timestamps, t, side=side))
+
+    def read(self, t_start, t_end, channels=None):
+        """Return the samples of `channels` (indices or labels, all by default)
+        and the timestamps with t_start <= timestamp <= t_end.
+        """
+        channels = self._channels(channels)
+        if len(self.blocks) == 0:
+            return self._empty(channels)
+
+        b_start, i_start = self._locate(t_start, side='left')
+        b_end, i_end = self._locate(t_end, side='right')
+
+        pieces = []
+        for b in range(b_start, min(b_end, len(self.blocks) - 1) + 1):
+            samples, timestamps = self.reader.read_block(self.blocks[b])
+            start = i_start if b == b_start else 0
+            end = i_end if b == b_end else len(timestamps)
+            if end > start:
+                pieces.append((samples[start:end], timestamps[start:end]))
+
+        if not pieces:
+            return self._empty(channels)
+        if len(pieces) == 1:
+            samples, timestamps = pieces[0]
+        elif self.info.get("kind") == 'markers':
+            samples = [marker for piece, _ in pieces for marker in piece]
+            timestamps = np.concatenate([ts for _, ts in pieces])
+        else:
+            samples = np.concatenate([piece for piece, _ in pieces])
+            timestamps = np.concatenate([ts for _, ts in pieces])
+        if channels is not None and not isinstance(samples, list):
+            samples = samples[:, channels]
+        return samples, timestamps
+
+    def _empty(self, channels):
+        if self.info.get("kind") == 'markers':
+            return [], np.empty(0)
+        samples = np.empty((0, self.info["number_of_channels"]), dtype=self.info["dtype"])
+        return (samples if channels is None else samples[:, channels]), np.empty(0)
+
+    def get_window(self, t_start, t_end):
+        # samples and timestamps with t_start <= timestamp <= t_end
+        return self.read(t_start, t_end)
+
+    def get_latest(self, seconds):
+        # samples and timestamps of the last `seconds` of the recording
+        if len(self.blocks) == 0:
+            return self._empty(None)
+        t_end = self.last[-1]
+        # strictly later than t_end - seconds, like the live ring
+        samples, timestamps = self.read(t_end - seconds, t_end)
+        n = np.searchsorted(timestamps, t_end - seconds, side='right')
+        return samples[n:], timestamps[n:]
+
+    def get_lsl_info(self):
+        return self.info
+
+    def get_stream_name(self):
+        return self.info.get("stream_name")
+
+    def get_nominal_srate(self):
+        return self.info.get("sampling_rate")
+
+    def get_channel_count(self):
+        return self.info.get("number_of_channels")
+
+    def get_channels(self):
+        return self.info.get("channels")
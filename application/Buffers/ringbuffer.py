@@ -0,0 +1,255 @@
+import threading
+
+import numpy as np
+
+from application.Buffers.subscription import Subscription, DROP_OLDEST
+
+
+class RingBuffer:
+    """Preallocated mirrored ring buffer for multichannel samples.
+
+    Every sample is written twice, at position ``i`` and ``i + capacity`` of a
+    storage array of length ``2 * capacity``. Because of this mirroring the
+    latest ``n`` samples always sit in one contiguous slice of the storage, so
+    reading a window is an O(1) read-only view instead of an unwrapping copy.
+
+    The constructor follows ``numpy_ringbuffer.RingBuffer`` so it can be used as
+    a drop-in replacement: ``dtype=(float, n_channels)`` gives a ring of
+    ``(capacity, n_channels)`` samples, a scalar dtype gives a 1-D ring.
+
+    Examples
+    --------
+        >>> ring = RingBuffer(capacity=1000, dtype=(float, 32))
+        >>> ring.extend(chunk)            # chunk has shape (n_samples, 32)
+        >>> window = ring.view()          # latest samples, oldest first
+        >>> last = ring.view(250)         # latest 250 samples
+
+    The storage and the write counter can also be supplied by the caller (e.g.
+    arrays in shared memory): `buffer` must have ``2 * capacity`` samples and
+    `counter` is a one element int64 array.
+    """
+
+    def __init__(self, capacity, dtype=float, buffer=None, counter=None):
+        self._capacity = int(capacity)
+        if self._capacity <= 0:
+            raise ValueError('capacity should be a positive number of samples')
+
+        if buffer is None:
+            buffer = np.zeros(2 * self._capacity, dtype=dtype)
+        elif len(buffer) != 2 * self._capacity:
+            raise ValueError('buffer should hold 2 * capacity samples')
+        self._data = buffer
+
+        # number of samples written since creation
+        self._counter = np.zeros(1, dtype='int64') if counter is None else counter
+
+    @property
+    def _count(self):
+        return int(self._counter[0])
+
+    @_count.setter
+    def _count(self, value):
+        self._counter[0] = value
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    @property
+    def shape(self):
+        return (len(self),) + self._data.shape[1:]
+
+    @property
+    def n_written(self):
+        """Total number of samples written since the buffer was created."""
+        return self._count
+
+    @property
+    def is_full(self):
+        return self._count >= self._capacity
+
+    def __len__(self):
+        return min(self._count, self._capacity)
+
+    def __array__(self, dtype=None, copy=None):
+        window = self.view()
+        return window if dtype is None else window.astype(dtype)
+
+    def __getitem__(self, item):
+        return self.view()[item]
+
+    def extend(self, values):
+        """Append a chunk of samples, dropping the oldest ones if the ring is full.
+        """
+        values = np.asarray(values)
+        n = len(values)
+        if n == 0:
+            return
+
+        # only the latest `capacity` samples of an oversized chunk can be kept
+        count = self._count
+        if n > self._capacity:
+            count += n - self._capacity
+            values = values[-self._capacity:]
+            n = self._capacity
+
+        start = count % self._capacity
+        end = start + n
+        self._data[start:end] = values
+
+        # mirror the written region into the other half of the storage
+        split = min(end, self._capacity)
+        if start < split:
+            self._data[start + self._capacity:split + self._capacity] = self._data[start:split]
+        if end > self._capacity:
+            self._data[:end - self._capacity] = self._data[self._capacity:end]
+
+        # the counter is only advanced once the samples are in place
+        self._count = count + n
+
+    def append(self, value):
+        self.extend(np.asarray(value)[np.newaxis])
+
+    def view(self, n=None):
+        """Return the latest `n` samples (all stored samples by default) as a
+        contiguous read-only view, oldest sample first.
+
+        The view aliases the ring storage: it is only guaranteed to hold the
+        same values until another `capacity - n` samples have been written.
+        """
+        size = len(self) if n is None else max(0, min(int(n), len(self)))
+        end = self._count % self._capacity + self._capacity
+        window = self._data[end - size:end]
+        window.flags.writeable = False
+        return window
+
+    def clear(self):
+        self._count = 0
+
+
+class TimestampedRingBuffer:
+    """Pair of mirrored rings holding samples and their lsl timestamps.
+
+    Both rings are written together under a lock, so a window read from them
+    always has one timestamp per sample. Timestamps are expected to be
+    monotonic, which allows windows to be located with a binary search (the
+    jitter of lsl timestamps only moves the edges of a window by a few samples).
+
+    Examples
+    --------
+        >>> ring = TimestampedRingBuffer(capacity=1000, n_channels=32)
+        >>> ring.extend(chunk, timestamps)
+        >>> samples, timestamps = ring.get_latest(2.0)
+        >>> samples, timestamps = ring.get_window(t0, t1)
+    """
+
+    def __init__(self, capacity, n_channels, dtype=float):
+        self.samples = RingBuffer(capacity, dtype=(dtype, n_channels))
+        self.timestamps = RingBuffer(capacity, dtype='float64')
+        self.lock = threading.Lock()
+        self.data_available = threading.Condition(self.lock)
+        self.subscriptions = []
+
+    @property
+    def capacity(self):
+        return self.samples.capacity
+
+    @property
+    def n_written(self):
+        return self.samples.n_written
+
+    def __len__(self):
+        return len(self.samples)
+
+    def subscribe(self, policy=DROP_OLDEST, max_chunks=32, timeout=None):
+        """Return a new Subscription, an independent read cursor starting at the
+        current write position.
+        """
+        subscription = Subscription(self, policy=policy, max_chunks=max_chunks, timeout=timeout)
+        self.subscriptions = self.subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions = [s for s in self.subscriptions if s is not subscription]
+
+    def extend(self, samples, timestamps):
+        # the list is replaced, never mutated, so iterating a reference to it is safe
+        subscriptions = self.subscriptions
+        for subscription in subscriptions:
+            subscription.wait_for_room(len(samples))
+
+        with self.lock:
+            start = self.n_written
+            self.samples.extend(samples)
+            self.timestamps.extend(timestamps)
+            end = self.n_written
+            self.data_available.notify_all()
+
+        for subscription in subscriptions:
+            subscription.publish(start, end)
+
+    def wait_for_data(self, position, timeout=None):
+        """Sleep until samples past `position` have been written or `timeout`
+        expires, and return `n_written`.
+        """
+        with self.data_available:
+            self.data_available.wait_for(lambda: self.n_written > position, timeout=timeout)
+            return self.n_written
+
+    def view(self, n=None):
+        """Return the latest `n` samples and timestamps as read-only views.
+        """
+        with self.lock:
+            return self.samples.view(n), self.timestamps.view(n)
+
+    def read_range(self, start, end=None):
+        """Return the samples and timestamps at write positions [start, end)
+        (`end` defaults to `n_written`) as read-only views, and the positions
+        they actually cover, as samples older than `capacity` are already lost.
+        """
+        with self.lock:
+            return self._read_range(start, end)
+
+    def _read_range(self, start, end):
+        n_written = self.n_written
+        end = n_written if end is None else min(end, n_written)
+        start = min(max(start, n_written - len(self)), end)
+        samples = self.samples.view(n_written - start)[:end - start]
+        timestamps = self.timestamps.view(n_written - start)[:end - start]
+        return samples, timestamps, start, end
+
+    def read_since(self, position):
+        """Return the samples and timestamps written after `position` (a previous
+        value of `n_written`) and the new position.
+
+        At most `capacity` samples can be returned; older ones are already lost.
+        """
+        samples, timestamps, start, end = self.read_range(position)
+        return samples, timestamps, end
+
+    def get_window(self, t_start, t_end):
+        """Return the samples and timestamps with t_start <= timestamp <= t_end.
+        """
+        samples, timestamps = self.view()
+        start = np.searchsorted(timestamps, t_start, side='left')
+        end = np.searchsorted(timestamps, t_end, side='right')
+        return samples[start:end], timestamps[start:end]
+
+    def get_latest(self, seconds):
+        """Return the samples and timestamps of the last `seconds` of data,
+        measured back from the newest timestamp.
+        """
+        samples, timestamps = self.view()
+        if len(timestamps) == 0:
+            return samples, timestamps
+        start = np.searchsorted(timestamps, timestamps[-1] - seconds, side='right')
+        return samples[start:], timestamps[start:]
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+            self.timestamps.clear()
@@ -0,0 +1,255 @@
+import json
+import os
+import sys
+import threading
+import time
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from application.Buffers.ringbuffer import RingBuffer, TimestampedRingBuffer
+from application.Buffers.subscription import BLOCK, DROP_OLDEST
+
+MAGIC = 0x4C534C52494E4700  # "LSLRING"
+VERSION = 2
+
+# Published header at the start of the shared memory block. The write counters
+# of both rings live in it, `seq` is odd while the writer is updating the rings.
+HEADER_DTYPE = np.dtype([
+    ('magic', '<u8'),
+    ('version', '<u8'),
+    ('capacity', '<i8'),
+    ('n_channels', '<i8'),
+    ('dtype', 'S8'),
+    ('seq', '<u8'),
+    ('samples_written', '<i8'),
+    ('timestamps_written', '<i8'),
+    ('info_size', '<i8'),
+    ('writer_pid', '<i8'),
+])
+HEADER_SIZE = 128
+INFO_SIZE = 4096  # room for the json encoded stream info
+
+
+def _align(n_bytes, alignment=64):
+    return (n_bytes + alignment - 1) // alignment * alignment
+
+
+class SharedRingBuffer(TimestampedRingBuffer):
+    """TimestampedRingBuffer backed by `multiprocessing.shared_memory`.
+
+    The process that acquires the stream creates the buffer, every other
+    process attaches to it by name and reads the latest windows as zero-copy
+    views, without pickling and without opening its own lsl inlet.
+
+    Memory layout: a header (see `HEADER_DTYPE`) with the write counters, the
+    json encoded stream info, then the mirrored sample and timestamp storage.
+
+    Examples
+    --------
+        >>> # acquisition process
+        >>> ring = SharedRingBuffer.create(capacity=1000, n_channels=32, info=lsl.get_lsl_info())
+        >>> ring.extend(chunk, timestamps)
+        >>> # analysis process
+        >>> ring = SharedRingBuffer.attach(name)
+        >>> samples, timestamps = ring.get_latest(2.0)
+    """
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner  # only the creating process writes and unlinks
+
+        self.header = np.ndarray(1, dtype=HEADER_DTYPE, buffer=shm.buf)
+        if self.header['magic'][0] != MAGIC or self.header['version'][0] != VERSION:
+            raise ValueError('%s is not a shared lsl ring buffer' % shm.name)
+
+        capacity = int(self.header['capacity'][0])
+        n_channels = int(self.header['n_channels'][0])
+        dtype = np.dtype(self.header['dtype'][0].decode())
+
+        samples_offset = HEADER_SIZE + INFO_SIZE
+        samples_size = _align(2 * capacity * n_channels * dtype.itemsize)
+        samples = np.ndarray((2 * capacity, n_channels), dtype=dtype, buffer=shm.buf, offset=samples_offset)
+        timestamps = np.ndarray(2 * capacity, dtype='float64', buffer=shm.buf,
+                                offset=samples_offset + samples_size)
+
+        # field views of the header, so the rings update the published counters in place
+        self.samples = RingBuffer(capacity, buffer=samples, counter=self.header['samples_written'])
+        self.timestamps = RingBuffer(capacity, buffer=timestamps, counter=self.header['timestamps_written'])
+        self.lock = threading.Lock()
+        self.data_available = threading.Condition(self.lock)
+        self.subscriptions = []
+        # in a reader process, a thread polls the write counter and publishes to the subscriptions
+        self.poller = None
+        self.poller_lock = threading.Lock()
+        self.closing = threading.Event()
+
+    @classmethod
+    def create(cls, capacity, n_channels, dtype=float, name=None, info=None):
+        """Allocate a new shared ring buffer (in the writing process).
+        """
+        dtype = np.dtype(dtype)
+        size = (HEADER_SIZE + INFO_SIZE + _align(2 * capacity * n_channels * dtype.itemsize)
+                + _align(2 * capacity * 8))
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        header = np.ndarray(1, dtype=HEADER_DTYPE, buffer=shm.buf)
+        header[0] = (MAGIC, VERSION, capacity, n_channels, dtype.str.encode(), 0, 0, 0, 0, os.getpid())
+
+        info = json.dumps(info or {}).encode()
+        if len(info) > INFO_SIZE:
+            raise ValueError('stream info does not fit in %d bytes' % INFO_SIZE)
+        shm.buf[HEADER_SIZE:HEADER_SIZE + len(info)] = info
+        header['info_size'] = len(info)
+        del header
+
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to the shared ring buffer published under `name` (in a reader process).
+        """
+        # The creating process owns the segment, this process' resource tracker must not
+        # unlink it when the reader exits
+        if sys.version_info >= (3, 13):
+            return cls(shared_memory.SharedMemory(name=name, track=False), owner=False)
+
+        # Before 3.13 attaching registers the segment anyway, undo it, unless the tracker is
+        # the writer's own (this is the writer, or a child started by it with multiprocessing):
+        # it only tracks a segment once, and the writer's registration has to stay
+        shm = shared_memory.SharedMemory(name=name)
+        writer = int(np.ndarray(1, dtype=HEADER_DTYPE, buffer=shm.buf)['writer_pid'][0])
+        parent = multiprocessing.parent_process()
+        if writer != os.getpid() and (parent is None or parent.pid != writer):
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def info(self):
+        """Stream info (`LSLRINGBUFFER.get_lsl_info()`) published by the writer."""
+        size = int(self.header['info_size'][0])
+        return json.loads(bytes(self.shm.buf[HEADER_SIZE:HEADER_SIZE + size]) or b'{}')
+
+    @property
+    def seq(self):
+        return int(self.header['seq'][0])
+
+    def subscribe(self, policy=DROP_OLDEST, max_chunks=32, timeout=None):
+        """Return a new Subscription (see `TimestampedRingBuffer.subscribe`).
+
+        The writer only notifies the subscriptions of its own process. In a
+        reader process a background thread polls the published write counter
+        instead and hands every new range of samples to the subscriptions. A
+        reader can't hold the writer back, so BLOCK subscriptions are refused.
+        """
+        if self.owner:
+            return super(SharedRingBuffer, self).subscribe(policy=policy, max_chunks=max_chunks, timeout=timeout)
+        if policy == BLOCK:
+            raise ValueError('BLOCK subscriptions need the writing process, a reader can not hold the writer')
+        with self.poller_lock:
+            subscription = super(SharedRingBuffer, self).subscribe(policy=policy, max_chunks=max_chunks,
+                                                                   timeout=timeout)
+            if self.poller is None:
+                self.poller = threading.Thread(target=self._poll, args=(subscription.position,),
+                                               name='shared-ring-poller', daemon=True)
+                self.poller.start()
+        return subscription
+
+    def _poll(self, position):
+        # reader process: publish the samples written past `position`, until the last subscription is closed
+        while not self.closing.is_set():
+            with self.poller_lock:
+                if not self.subscriptions:
+                    self.poller = None
+                    return
+            n_written = self.wait_for_data(position, timeout=0.05)
+            if n_written > position:
+                for subscription in self.subscriptions:
+                    subscription.publish(position, n_written)
+                position = n_written
+
+    def extend(self, samples, timestamps):
+        if not self.owner:
+            raise PermissionError('only the process that created the shared ring buffer can write to it')
+        subscriptions = self.subscriptions
+        for subscription in subscriptions:
+            subscription.wait_for_room(len(samples))
+
+        with self.lock:
+            start = self.n_written
+            self.header['seq'] += 1
+            self.samples.extend(samples)
+            self.timestamps.extend(timestamps)
+            self.header['seq'] += 1
+            end = self.n_written
+            self.data_available.notify_all()
+
+        for subscription in subscriptions:
+            subscription.publish(start, end)
+
+    def view(self, n=None):
+        """Return the latest `n` samples and timestamps as read-only views.
+
+        In a reader process the counters are read with a sequence lock, so both
+        views always cover the same samples.
+        """
+        if self.owner:
+            return super(SharedRingBuffer, self).view(n)
+
+        while True:
+            seq = self.seq
+            if seq % 2 == 0:
+                samples, timestamps = self.samples.view(n), self.timestamps.view(n)
+                if self.seq == seq:
+                    return samples, timestamps
+            time.sleep(0)
+
+    def wait_for_data(self, position, timeout=None):
+        if self.owner:
+            return super(SharedRingBuffer, self).wait_for_data(position, timeout=timeout)
+
+        # the writer lives in another process and can't notify us, poll the published counter
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while (self.n_written <= position and not self.closing.is_set()
+               and (deadline is None or time.monotonic() < deadline)):
+            time.sleep(0.001)
+        return self.n_written
+
+    def read_range(self, start, end=None):
+        if self.owner:
+            return super(SharedRingBuffer, self).read_range(start, end)
+
+        while True:
+            seq = self.seq
+            if seq % 2 == 0:
+                window = self._read_range(start, end)
+                if self.seq == seq:
+                    return window
+            time.sleep(0)
+
+    def close(self):
+        """Release this process' mapping, and the segment itself in the writer.
+
+        The windows handed out (by `view`, `get_window`, subscriptions, ...)
+        point into the segment, so closing is refused with a BufferError while
+        any of them is still referenced, and the buffer stays usable.
+        """
+        # numpy doesn't hold the segment's buffer, so unmapping it wouldn't fail but leave them dangling.
+        # Every window is a view of a ring's array and references it: only the ring should
+        if any(sys.getrefcount(ring._data) > 2 for ring in (self.samples, self.timestamps)):
+            raise BufferError('windows of the shared ring buffer %s are still referenced, '
+                              'delete them before closing it' % self.shm.name)
+        self.closing.set()
+        poller = self.poller
+        if poller is not None:
+            poller.join()
+        self.samples = self.timestamps = self.header = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
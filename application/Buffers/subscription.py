@@ -0,0 +1,155 @@
+import collections
+import threading
+
+# What happens when a subscriber has `max_chunks` unread chunks and a new one arrives
+BLOCK = 'block'  # the writer waits until the subscriber has read a chunk
+DROP_OLDEST = 'drop-oldest'  # the oldest unread chunk is dropped
+COALESCE = 'coalesce'  # the new chunk is merged into the last unread one
+
+POLICIES = (BLOCK, DROP_OLDEST, COALESCE)
+
+
+class Subscription:
+    """A consumer's independent read cursor into a TimestampedRingBuffer.
+
+    The ring publishes the position range of every chunk written to it to all
+    of its subscriptions. The subscription only keeps these ranges, never the
+    data, so its memory is bounded by `max_chunks` whatever the consumer does,
+    and the data it hands out are read-only views of the ring.
+
+    Samples that the writer has overwritten before they were read are dropped
+    and counted, whatever the policy.
+
+    Examples
+    --------
+        >>> subscription = ring.subscribe(policy=DROP_OLDEST, max_chunks=32)
+        >>> samples, timestamps = subscription.get(timeout=0.1)   # next chunk
+        >>> samples, timestamps = subscription.get_all()          # everything since the cursor
+        >>> samples, timestamps = subscription.latest(250)        # snapshot, skips the rest
+        >>> subscription.stats()
+    """
+
+    def __init__(self, ring, policy=DROP_OLDEST, max_chunks=32, timeout=None):
+        if policy not in POLICIES:
+            raise ValueError('policy should be one of %s' % (POLICIES,))
+
+        self.ring = ring
+        self.policy = policy
+        self.max_chunks = max_chunks
+        self.timeout = timeout  # longest time a BLOCK subscription makes the writer wait (None: forever)
+
+        self.position = ring.n_written  # read cursor, the next sample to hand out
+        self.chunks = collections.deque()  # end positions of the unread chunks
+        self.condition = threading.Condition()
+        self.dropped_chunks = 0
+        self.dropped_samples = 0
+        self.closed = False
+
+    @property
+    def depth(self):
+        """Number of unread chunks."""
+        return len(self.chunks)
+
+    @property
+    def pending(self):
+        """Number of unread samples."""
+        return self.chunks[-1] - self.position if self.chunks else 0
+
+    def stats(self):
+        return {"policy": self.policy, "depth": self.depth, "pending_samples": self.pending,
+                "dropped_chunks": self.dropped_chunks, "dropped_samples": self.dropped_samples}
+
+    def wait_for_room(self, n_samples):
+        """Called by the writer before it writes `n_samples`: blocks BLOCK
+        subscriptions until the chunk fits without losing unread samples.
+        """
+        if self.policy != BLOCK:
+            return
+        with self.condition:
+            self.condition.wait_for(lambda: self.closed or (len(self.chunks) < self.max_chunks and
+                                                           self.pending + n_samples <= self.ring.capacity),
+                                    timeout=self.timeout)
+
+    def publish(self, start, end):
+        """Called by the writer once the samples [start, end) are in the ring.
+        """
+        with self.condition:
+            if self.closed:
+                return
+
+            if not self.chunks:
+                self.position = max(self.position, start)
+
+            if len(self.chunks) >= self.max_chunks:
+                if self.policy == COALESCE:
+                    self.chunks.pop()
+                else:
+                    # DROP_OLDEST, or BLOCK after its timeout expired
+                    self._drop(self.chunks.popleft())
+
+            self.chunks.append(end)
+            self.condition.notify_all()
+
+    def _drop(self, end):
+        self.dropped_chunks += 1
+        self.dropped_samples += end - self.position
+        self.position = end
+
+    def _wait(self, timeout):
+        # wait for an unread chunk, True if there is one
+        if not self.chunks and timeout:
+            self.condition.wait_for(lambda: self.chunks or self.closed, timeout=timeout)
+        return bool(self.chunks)
+
+    def _read(self, end):
+        samples, timestamps, start, end = self.ring.read_range(self.position, end)
+        self.dropped_samples += start - self.position
+        self._advance(end)
+        return samples, timestamps
+
+    def _advance(self, end):
+        # move the cursor to `end` and forget the chunks read up to it
+        self.position = max(self.position, end)
+        while self.chunks and self.chunks[0] <= self.position:
+            self.chunks.popleft()
+        self.condition.notify_all()
+
+    def get(self, timeout=0.0):
+        """Return the next unread chunk as (samples, timestamps) views, or
+        (None, None) if there is none within `timeout` seconds.
+        """
+        with self.condition:
+            if not self._wait(timeout):
+                return None, None
+            # chunks the writer has already overwritten are skipped, _read counts their samples as dropped
+            oldest = self.ring.n_written - len(self.ring)
+            while len(self.chunks) > 1 and self.chunks[0] <= oldest:
+                self.chunks.popleft()
+            return self._read(self.chunks[0])
+
+    def get_all(self, timeout=0.0):
+        """Return all unread samples as one (samples, timestamps) pair of views,
+        or (None, None) if there are none within `timeout` seconds.
+        """
+        with self.condition:
+            if not self._wait(timeout):
+                return None, None
+            return self._read(self.chunks[-1])
+
+    def latest(self, n=None):
+        """Return a snapshot of the latest `n` samples (the whole ring by
+        default) and mark everything up to it as read.
+        """
+        with self.condition:
+            start = 0 if n is None else self.ring.n_written - n
+            samples, timestamps, start, end = self.ring.read_range(start)
+            # skipping unread samples is the point of a snapshot, they are not counted as dropped
+            self._advance(end)
+            return samples, timestamps
+
+    def close(self):
+        self.ring.unsubscribe(self)
+        with self.condition:
+            self.closed = True
+            self.chunks.clear()
+            self.condition.notify_all()
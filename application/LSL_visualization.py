@@ -11,7 +11,8 @@ from application.Widgets.Error import ErrorBox
 from application.Widgets.FrequencyViewer import SpectrumAnalyzer
 from application.Widgets.TimeSeriesViewer import TimeSeriesSignal
 from application.Widgets.QueryData import StreamData
-from application.Buffers.lslringbuffer_multithreaded import LSLRINGBUFFER
+from application.Buffers.acquisition import AcquisitionEngine, BufferPool
+from application.Buffers.discovery import discovery
 
 #Python library modules
 import pylsl
@@ -25,10 +26,14 @@ class LSLgui(QMainWindow):
         self.setWindowTitle('LSL Real-Time Analysis')   
         self.setMaximumSize(1150,1000) 
 
-        self.avail_streams = dict()  # holds information about all of the availableStreams for the query
+        self.avail_streams = dict()  # holds the metadata of all of the availableStreams for the query, by name
         self.availableFilters = {"Notch": False, "Butter": False}  # holds UI information for the various filters, i.e. notch and butter
         self.bands = {"Low" : None, "High": None} # Holds UI widgets for lowPass and highPass bands used for butter filter
-        self.lslobj = dict() # Contains the lsl inlets for each stream object
+        self.acquisition = AcquisitionEngine() # Pulls all open inlets into their ring buffers off the GUI thread
+        self.acquisition.start()
+        self.pool = BufferPool(self.acquisition) # Opens the inlet and ring of a stream only while it is viewed
+        discovery.start() # Resolves the streams and caches their metadata in the background
+        self.viewedBuffer = None # Ring buffer of the stream shown in the current graph
 
         self.channels = []  # holds the QCheckList object for the channels for the current available stream
         self.showChannels = []  # holds the channels selected for visualization
@@ -44,28 +49,33 @@ class LSLgui(QMainWindow):
 
     def getAvailableStreams(self):
         self.isAvailable = False # Resets availability of streams -> Always false unless stream is found
-        self.lslobj.clear() # Clears container of lsl inlets for new batch of inlets
 
-        streams = pylsl.resolve_streams(wait_time=1.0) # Contains information about all available lsl inlets
+        # Metadata of all available lsl streams, cached by the discovery service
+        # No inlet is opened here, only the stream being viewed gets one (see viewBuffer)
+        self.avail_streams = {s.get_stream_name(): s for s in discovery.streams()}
 
         # If streams list is empty, no streams are available
-        # Clear the channelLayout of all previously listed channels, since no streams are available
-        if len(streams) == 0:
+        if len(self.avail_streams) == 0:
             print("No streams available.")
-            self.clearChannels()
 
         else:
             self.isAvailable = True
-            print("Got all available streams. Starting streams now.....")
+            print("Got all available streams.")
 
-            for s in streams:
-                lsl_inlet = pylsl.StreamInlet(s, max_buflen=4)
-                lsl_inlet.open_stream()
-                lsl = LSLRINGBUFFER(lsl_type=lsl_inlet.info().type(), name=lsl_inlet.info().name(), inlet=lsl_inlet,\
-                        fs=lsl_inlet.info().nominal_srate(), buffer_duration=4.0, \
-                        num_channels=lsl_inlet.info().channel_count(), uid=lsl_inlet.info().uid(),\
-                        hostname=lsl_inlet.info().hostname(), channel_format='float64')
-                self.lslobj[lsl_inlet.info().name()] = lsl
+
+    # Opens (or shares) the ring buffer of the stream to view
+    # And releases the one of the previous graph, whose inlet is closed if nothing else uses it
+    # Returns None, after showing an error, if the stream does not answer anymore
+    def viewBuffer(self, streamName):
+        try:
+            buffer = self.pool.acquire(self.avail_streams[streamName])
+        except ConnectionError as e:
+            self.displayError(str(e))
+            return None
+        if self.viewedBuffer is not None:
+            self.pool.release(self.viewedBuffer)
+        self.viewedBuffer = buffer
+        return buffer
 
 
     def loadQuery(self):
@@ -86,8 +96,8 @@ class LSLgui(QMainWindow):
 
             self.streamButtonGroup = QButtonGroup()
 
-            for index, stream in enumerate(self.lslobj.keys()):
-                info = self.lslobj[stream]
+            for index, stream in enumerate(self.avail_streams.keys()):
+                info = self.avail_streams[stream]
 
                 metaData = StreamData(["Name: %s - Type: %s" % (stream, info.get_stream_type())])
                 self.Query.addTopLevelItem(metaData)
@@ -161,7 +171,7 @@ class LSLgui(QMainWindow):
 
 
         # Loads the available channels for the current stream under observation
-        for index, c in enumerate(self.lslobj[self.currentStreamName].get_channels()):
+        for index, c in enumerate(self.avail_streams[self.currentStreamName].get_channels()):
             channelBtn = QCheckBox(c)
             channelBtn.setObjectName(c)
             channelID = index+1
@@ -304,9 +314,9 @@ class LSLgui(QMainWindow):
     def applyHighPass(self,):
         if self.availableFilters["Butter"] == True:
             if len(self.bands["High"].text()) == 0:
-                self.highPass = (self.lslobj[self.currentStreamName].get_nominal_srate() / 2) - .001
+                self.highPass = (self.avail_streams[self.currentStreamName].get_nominal_srate() / 2) - .001
             else:
-                if float(self.bands["High"].text()) < self.lslobj[self.currentStreamName].get_nominal_srate() / 2:
+                if float(self.bands["High"].text()) < self.avail_streams[self.currentStreamName].get_nominal_srate() / 2:
                     self.highPass = float(self.bands["High"].text())
 
             self.graph.changeFilter("Butter", (self.lowPass, self.highPass))
@@ -337,7 +347,7 @@ class LSLgui(QMainWindow):
     def showTSStream(self):
 
         #Check is stream have been queried and at least ONE stream is selected to vizualize
-        if not self.lslobj:
+        if self.currentStreamName not in self.avail_streams:
             self.displayError("Please have ONE stream available to view.")
 
         #Check to see if at least ONE channel has been chosen to visualize from the current stream
@@ -363,7 +373,9 @@ class LSLgui(QMainWindow):
                 self.loadFilters()
             
             #Obtain the current stream inlet to pass into the Signal Viewer
-            lsl_inlet = self.lslobj[self.currentStreamName]
+            lsl_inlet = self.viewBuffer(self.currentStreamName)
+            if lsl_inlet is None:
+                return
             fs = lsl_inlet.get_nominal_srate()
             channels = lsl_inlet.get_channels()
             view_channels = [channel for channel in self.showChannels]
@@ -371,7 +383,7 @@ class LSLgui(QMainWindow):
             #If another Time Series graph is being visualized
             #Remove the current graph and replace with a new one with a different set of arguments to use
             if not self.TimeSeriesLayout.isEmpty():
-                self.graph.close()
+                self.graph.close_window()
                 self.TimeSeriesViewer.removeWidget(self.graph)
 
 
@@ -386,7 +398,7 @@ class LSLgui(QMainWindow):
 
     def showTFStream(self):
         #Check is stream have been queried and at least ONE stream is selected to vizualize
-        if not self.lslobj:
+        if self.currentStreamName not in self.avail_streams:
             self.displayError("Please have ONE stream available to view.")
 
         #Check to see that only ONE channel has been chosen to visualize from the current stream
@@ -423,7 +435,9 @@ class LSLgui(QMainWindow):
             #Get the current stream inlet and the selected channel to view
             #Pass these in as arguments to create a SpectrumAnalyzer object
             if self.FrequencyLayout.isEmpty():
-                lsl_inlet = self.lslobj[self.currentStreamName]
+                lsl_inlet = self.viewBuffer(self.currentStreamName)
+                if lsl_inlet is None:
+                    return
             
                 view_channel = self.showChannels[0]
                 self.graph = SpectrumAnalyzer(lsl_inlet, view_channel)
@@ -503,10 +517,10 @@ class LSLgui(QMainWindow):
         if self.graph is not None:
             self.graph.close_window()    
 
-        for key in self.lslobj.keys():
-            if self.lslobj[key]:
-                del self.lslobj[key]
-                self.lslobj[key] = None
+        self.acquisition.stop()
+        discovery.stop()
+        self.pool.close()
+        self.viewedBuffer = None
 
         print("Exiting App.......")
         self.close()
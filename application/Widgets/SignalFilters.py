@@ -1,13 +1,56 @@
 import numpy as np
-from scipy.signal import butter, lfilter
+from scipy.signal import iirfilter, sosfilt, sosfilt_zi, tf2sos
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from multiprocessing import shared_memory
+import multiprocessing
+import os
+import time
+
+from application.Buffers.instrumentation import metrics
+
+@lru_cache(maxsize=128)
+def design_sos(ftype, order, band, fs):
+    # second-order sections of an iir filter, cached by (type, order, band, fs) so going back to
+    # a previous band (or opening another viewer with the same one) costs nothing
+    low, high = band
+
+    if low is None and high is None:
+        raise ValueError('band should involve one or two not None values')
+    elif low is None:
+        sos = iirfilter(order, high/fs*2, btype='low', ftype=ftype, output='sos')
+    elif high is None:
+        sos = iirfilter(order, low/fs*2, btype='high', ftype=ftype, output='sos')
+    else:
+        sos = iirfilter(order, [low/fs*2, high/fs*2], btype='band', ftype=ftype, output='sos')
+    return sos
 
 class BaseFilter:
+    # Filters are cascades of second-order sections (`sos`, shape (n_sections, 6)) with a persistent
+    # state `zi` of shape (n_sections, 2, n_channels): high orders at low cutoffs stay stable, unlike
+    # the (b, a) form, and stages compose into one cascade, see FilterChain
+    sos = np.empty((0, 6))
+    level = None  # last input sample, the state of a redesigned filter starts from it
+
     def apply(self, chunk: np.ndarray):
         '''
-        :param chunk:
-        :return:
+        :param chunk: samples of shape (n_samples, n_channels)
+        :return: filtered samples, the state carries over to the next chunk
         '''
-        raise NotImplementedError
+        t0 = time.perf_counter()
+        y, self.zi = sosfilt(self.sos, chunk, axis=0, zi=self.zi)
+        if len(chunk):
+            self.level = np.array(chunk[-1], dtype=float)
+        self.apply_seconds.record(time.perf_counter() - t0)
+        return y
+
+    def reset_state(self, level=None):
+        # zero state, or the steady state of a constant input at `level` (one value per channel),
+        # so a filter swapped in mid-stream doesn't ring from the signal's offset
+        if level is None or len(self.sos) == 0:
+            self.zi = np.zeros((len(self.sos), 2, self.n_channels))
+        else:
+            self.zi = sosfilt_zi(self.sos)[:, :, np.newaxis] * np.asarray(level, dtype=float)
 
 class NotchFilter(BaseFilter):
     def __init__(self, f0, fs, n_channels, mu=0.05):
@@ -15,38 +58,204 @@ class NotchFilter(BaseFilter):
         w0 = 2*np.pi*f0/fs
         self.a = np.array([1., 2 * (mu - 1) * np.cos(w0), (1 - 2 * mu)])
         self.b = np.array([1., -2 * np.cos(w0), 1.]) * (1 - mu)
-        self.zi = np.zeros((max(len(self.b), len(self.a)) - 1, n_channels))
-
-    def apply(self, chunk: np.ndarray):
-        y, self.zi = lfilter(self.b, self.a, chunk, axis=0, zi=self.zi)
-        return y
+        self.sos = tf2sos(self.b, self.a)
+        self.apply_seconds = metrics.histogram('filter_seconds/NotchFilter', owner=self)
+        self.reset_state()
 
     def reset(self):
-        self.zi = np.zeros((max(len(self.b), len(self.a)) - 1, self.n_channels))
+        self.reset_state()
 
 class ButterFilter(BaseFilter):
     def __init__(self, band, fs, n_channels, order=4):
         self.n_channels = n_channels
         self.fs = fs
         self.order = order
+        self.apply_seconds = metrics.histogram('filter_seconds/ButterFilter', owner=self)
         self.reset(band)
 
     def reset(self, band):
-        low, high = band
-
-        if low is None and high is None:
-            raise ValueError('band should involve one or two not None values')
-        elif low is None:
-            self.b, self.a = butter(self.order, high/self.fs*2, btype='low')
-        elif high is None:
-            self.b, self.a = butter(self.order, low/self.fs*2, btype='high')
+        # new band, the state restarts from the last filtered sample (if any) instead of zero
+        self.band = tuple(band)
+        self.sos = design_sos('butter', self.order, self.band, self.fs)
+        self.reset_state(self.level)
+
+class FilterChain(BaseFilter):
+    """Any number of filters run as one cascade of second-order sections.
+
+    The sections of all stages are stacked, so a chunk goes through the whole
+    chain in a single `sosfilt` pass over all channels instead of one pass
+    per filter. Every stage keeps its part of the state when stages are added
+    or removed.
+
+    Examples
+    --------
+        >>> chain = FilterChain([NotchFilter(50, fs, n_channels), ButterFilter((1, 40), fs, n_channels)])
+        >>> filtered = chain.apply(chunk)
+        >>> chain.remove(chain.stages[0])
+    """
+
+    def __init__(self, stages=(), n_channels=None):
+        self.stages = list(stages)
+        self.n_channels = n_channels if n_channels is not None else self.stages[0].n_channels
+        self.apply_seconds = metrics.histogram('filter_seconds/FilterChain', owner=self)
+        self._compose()
+
+    def _compose(self):
+        # stack the sections and the states of the stages
+        self.sos = np.concatenate([np.empty((0, 6))] + [stage.sos for stage in self.stages])
+        self.zi = np.concatenate([np.zeros((0, 2, self.n_channels))] + [stage.zi for stage in self.stages])
+        self.sizes = [len(stage.sos) for stage in self.stages]  # sections of every stage in the cascade
+
+    def _split(self, skip=None):
+        # hand every stage (but `skip`) its part of the state of the cascade
+        start = 0
+        for stage, size in zip(self.stages, self.sizes):
+            end = start + size
+            if stage is not skip:
+                stage.zi = self.zi[start:end].copy()
+            start = end
+
+    def add(self, stage):
+        self._split()
+        self.stages.append(stage)
+        self._compose()
+
+    def remove(self, stage):
+        self._split()
+        self.stages = [s for s in self.stages if s is not stage]
+        self._compose()
+
+    def apply(self, chunk: np.ndarray):
+        if len(self.sos) == 0:
+            return chunk
+        return super(FilterChain, self).apply(chunk)
+
+    def update(self, stage):
+        # compose again after `stage` was redesigned (e.g. ButterFilter.reset), the others keep their state.
+        # The stages don't see their input, so the state of `stage` starts from the level of the chain's
+        # input through the DC gain of the stages before it
+        if self.level is not None:
+            gain = 1.0
+            for previous in self.stages[:self.stages.index(stage)]:
+                gain *= np.prod(previous.sos[:, :3].sum(axis=1) / previous.sos[:, 3:].sum(axis=1))
+            stage.reset_state(self.level * gain)
+        self._split(skip=stage)
+        self._compose()
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset_state()
+        self._compose()
+
+# Backends of ParallelFilter
+THREADS = 'thread'  # sosfilt releases the GIL, so shards run in parallel in one process
+PROCESSES = 'process'  # worker processes reading and writing the chunk through shared memory
+
+def _filter_shard(sos, zi, names, shape, start, end, connection):
+    # worker process of ParallelFilter: keeps the state of channels [start, end) and filters them
+    # in place, in the shared input block, every time it receives the number of samples of a chunk
+    # spawned workers share the resource tracker of the parent, which unlinks the blocks in close()
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    x = np.ndarray(shape, dtype='float64', buffer=blocks[0].buf)
+    y = np.ndarray(shape, dtype='float64', buffer=blocks[1].buf)
+    connection.send(0)  # ready
+    while True:
+        n = connection.recv()
+        if n is None:
+            break
+        y[:n, start:end], zi = sosfilt(sos, x[:n, start:end], axis=0, zi=zi)
+        connection.send(n)
+    del x, y
+    for block in blocks:
+        block.close()
+
+class ParallelFilter(BaseFilter):
+    """Filter the channels of every chunk in shards, in parallel.
+
+    The channels are split into `n_workers` contiguous shards, each with its
+    own part of the state of `filter` (its sos are used, a chain works too).
+    Channels are filtered independently, with the same operations as the
+    serial path, so the output is bit-identical to ``filter.apply``.
+
+    With the THREADS backend the shards run in a thread pool (sosfilt releases
+    the GIL). With PROCESSES every shard is owned by a worker process, the
+    chunk is written once to a shared memory block of `max_samples` samples
+    and the workers write their channels of the result to another one.
+
+    Examples
+    --------
+        >>> parallel = ParallelFilter(ButterFilter((1, 40), 4000, 256), n_workers=4, backend=PROCESSES)
+        >>> filtered = parallel.apply(chunk)
+        >>> parallel.close()
+    """
+
+    def __init__(self, filter, n_workers=None, backend=THREADS, max_samples=4096):
+        if backend not in (THREADS, PROCESSES):
+            raise ValueError('backend should be one of %s' % ((THREADS, PROCESSES),))
+        self.sos = filter.sos
+        self.n_channels = filter.n_channels
+        self.n_workers = min(n_workers or os.cpu_count(), self.n_channels)
+        self.backend = backend
+        self.max_samples = max_samples
+        self.apply_seconds = metrics.histogram('filter_seconds/ParallelFilter', owner=self)
+
+        bounds = np.linspace(0, self.n_channels, self.n_workers + 1).astype(int)
+        self.shards = list(zip(bounds[:-1], bounds[1:]))
+        if backend == THREADS:
+            self.zi = [filter.zi[:, :, start:end].copy() for start, end in self.shards]
+            self.pool = ThreadPoolExecutor(self.n_workers, thread_name_prefix='filter-shard')
         else:
-            self.b, self.a = butter(self.order, [low/self.fs*2, high/self.fs*2], btype='band')
-        self.zi = np.zeros((max(len(self.b), len(self.a)) - 1, self.n_channels))
+            shape = (max_samples, self.n_channels)
+            self.blocks = [shared_memory.SharedMemory(create=True, size=8 * max_samples * self.n_channels)
+                           for _ in range(2)]
+            self.x = np.ndarray(shape, dtype='float64', buffer=self.blocks[0].buf)
+            self.y = np.ndarray(shape, dtype='float64', buffer=self.blocks[1].buf)
+            context = multiprocessing.get_context('spawn')
+            self.connections, self.workers = [], []
+            for start, end in self.shards:
+                connection, child = context.Pipe()
+                worker = context.Process(target=_filter_shard, daemon=True,
+                                         args=(self.sos, filter.zi[:, :, start:end].copy(),
+                                               [block.name for block in self.blocks], shape, start, end, child))
+                worker.start()
+                self.connections.append(connection)
+                self.workers.append(worker)
+            # spawning takes a while, don't let the first chunk pay for it
+            for connection in self.connections:
+                connection.recv()
+
+    def _apply_shard(self, i, chunk, out):
+        start, end = self.shards[i]
+        out[:, start:end], self.zi[i] = sosfilt(self.sos, chunk[:, start:end], axis=0, zi=self.zi[i])
 
     def apply(self, chunk: np.ndarray):
-        y, self.zi = lfilter(self.b, self.a, chunk, axis=0, zi=self.zi)
-        return y
+        t0 = time.perf_counter()
+        out = np.empty(chunk.shape, dtype=np.result_type(self.sos, chunk))
+        if self.backend == THREADS:
+            for future in [self.pool.submit(self._apply_shard, i, chunk, out) for i in range(len(self.shards))]:
+                future.result()
+        else:
+            # longer chunks go through in blocks, the state carries over so the result is the same
+            for first in range(0, len(chunk), self.max_samples):
+                n = min(self.max_samples, len(chunk) - first)
+                self.x[:n] = chunk[first:first + n]
+                for connection in self.connections:
+                    connection.send(n)
+                for connection in self.connections:
+                    connection.recv()
+                out[first:first + n] = self.y[:n]
+        self.apply_seconds.record(time.perf_counter() - t0)
+        return out
 
-    #def reset(self):
-    #    self.zi = np.zeros((max(len(self.b), len(self.a)) - 1, self.n_channels))
\ No newline at end of file
+    def close(self):
+        if self.backend == THREADS:
+            self.pool.shutdown()
+            return
+        for connection in self.connections:
+            connection.send(None)
+        for worker in self.workers:
+            worker.join()
+        del self.x, self.y
+        for block in self.blocks:
+            block.close()
+            block.unlink()
@@ -1,9 +1,13 @@
 import numpy as np
 import pyqtgraph as pg
 import os
+import time
 import pylsl
 from scipy import signal, stats
 
+from application.Buffers.envelope import EnvelopePyramid
+from application.Buffers.instrumentation import metrics
+
 
 # import sys
 # from pynfb.signal_processing.filters import NotchFilter, IdentityFilter, FilterSequence
@@ -64,9 +68,13 @@ class SignalViewer(pg.PlotWidget):
         self.vertical_line = pg.InfiniteLine(pos=0, angle=90, pen=pg.mkPen(color='B48375', width=1))
         self.addItem(self.vertical_line)
 
+        # time spent per frame in update(), see application.Buffers.instrumentation
+        self.render_seconds = metrics.histogram('render_seconds/%s' % type(self).__name__, owner=self)
+
 
 
     def update(self, chunk, setX=None, setPos=None):
+        t0 = time.perf_counter()
         # estimate current pos
         chunk_len = len(chunk)
         current_pos = (self.previous_pos + chunk_len) % self.n_samples
@@ -97,6 +105,7 @@ class SignalViewer(pg.PlotWidget):
 
         # update pos
         self.previous_pos = self.current_pos
+        self.render_seconds.record(time.perf_counter() - t0)
 
     def prepare_y_data(self, chunk_len):
         return self.y_raw_buffer
@@ -163,4 +172,107 @@ class DerivedSignalViewer(SignalViewer):
     """
 
     def __init__(self, fs, names, seconds_to_plot=5, **kwargs):
-        super(DerivedSignalViewer, self).__init__(fs, names, seconds_to_plot, overlap=True, **kwargs)
\ No newline at end of file
+        super(DerivedSignalViewer, self).__init__(fs, names, seconds_to_plot, overlap=True, **kwargs)
+
+class EnvelopeSignalViewer(pg.PlotWidget):
+    """
+    Plot a scrolling history of each channel on a separate line. Samples are kept in a min/max envelope
+    pyramid and every redraw uses the level with about one bin per pixel, so long histories can be zoomed
+    out at the cost of the plot width, not of the number of samples
+    """
+
+    def __init__(self, fs, names, view_channels, seconds_to_plot=10, history=600, capacity=8192, factor=4,
+                 **kwargs):
+        super(EnvelopeSignalViewer, self).__init__(**kwargs)
+        # gui settings
+        self.setTitle("Time-Series Graph")
+        self.getPlotItem().showGrid(x=True, y=True)
+        self.getPlotItem().setMenuEnabled(enableMenu=False)
+        self.getPlotItem().setMouseEnabled(x=True, y=False)
+        self.getPlotItem().disableAutoRange()
+        self.getPlotItem().setLabel('bottom', 'Time (s)')
+        self.setBackgroundBrush(pg.mkBrush('#252120'))
+
+        self.fs = fs
+        self.indices = list(view_channels)
+        self.names = [n for i, n in enumerate(names) if i in view_channels]
+        self.n_signals = len(self.indices)
+
+        # enough levels for the coarsest one to cover `history` seconds in about a screen width of bins
+        n_levels = 1
+        while capacity * factor ** (n_levels - 1) < history * fs or history * fs / factor ** (n_levels - 1) > 1024:
+            n_levels += 1
+        self.pyramid = EnvelopePyramid(self.n_signals, capacity=max(capacity, factor ** (n_levels - 1)),
+                                       factor=factor, n_levels=n_levels)
+
+        self.getPlotItem().setXRange(-seconds_to_plot, 0, padding=0)
+        self.getPlotItem().setYRange(0, self.n_signals + 1)
+        ticks = [[(i + 1, name) for i, name in enumerate(self.names)]]
+        self.getPlotItem().getAxis('left').setTicks(ticks)
+
+        self.curves = []
+        for i in range(self.n_signals):
+            curve = pg.PlotDataItem(pen=paired_colors[i % len(paired_colors)], name=self.names[i])
+            curve.setPos(0, i + 1)
+            self.addItem(curve)
+            self.curves.append(curve)
+
+        self.center = np.zeros(self.n_signals)
+        self.spread = np.ones(self.n_signals)
+        self.stats_update_counter = np.inf
+        self.level = 0
+
+        # zooming and panning redraw the visible range at the matching level
+        self.getPlotItem().sigXRangeChanged.connect(self.rescale)
+        self.render_seconds = metrics.histogram('render_seconds/%s' % type(self).__name__, owner=self)
+
+    def update(self, chunk, setX=None, setPos=None):
+        t0 = time.perf_counter()
+        chunk = np.asarray(chunk)
+        self.pyramid.extend(chunk[:, self.indices])
+        self.stats_update_counter += len(chunk)
+        self.redraw()
+        self.render_seconds.record(time.perf_counter() - t0)
+
+    def rescale(self):
+        self.stats_update_counter = np.inf
+        self.redraw()
+
+    def redraw(self):
+        n_written = self.pyramid.n_written
+        if n_written == 0:
+            return
+
+        # visible range (seconds before the newest sample) in sample positions, one bin per pixel
+        x_start, x_end = self.getPlotItem().getViewBox().viewRange()[0]
+        start = n_written + int(np.floor(x_start * self.fs))
+        end = n_written + int(np.ceil(x_end * self.fs)) + 1
+        width = max(1, int(self.getPlotItem().getViewBox().width()))
+        self.level, positions, lo, hi, mean = self.pyramid.window(start, end, max_points=width)
+        if len(positions) == 0:
+            return
+
+        # update scaling stats of the visible envelope about once a second
+        if self.stats_update_counter > self.fs:
+            self.center = np.mean(mean, axis=0)
+            self.spread = np.max(hi, axis=0) - np.min(lo, axis=0)
+            self.spread[self.spread <= 0] = 1
+            self.stats_update_counter = 0
+
+        t = (positions - n_written) / self.fs
+        if self.level == 0:
+            x, y = t, lo
+        else:
+            # min and max of every bin drawn as a vertical stroke at its center
+            bin_size = self.pyramid.levels[self.level - 1].bin_size
+            x = np.repeat(t + 0.5 * bin_size / self.fs, 2)
+            y = np.stack((lo, hi), axis=1).reshape(-1, self.n_signals)
+
+        y = (y - self.center) / self.spread
+        for i, curve in enumerate(self.curves):
+            curve.setData(x, y[:, i])
+
+    def reset_buffer(self):
+        self.pyramid.clear()
+        for curve in self.curves:
+            curve.setData([], [])
@@ -1,8 +1,4 @@
 import pdb
-from queue import Queue
-from threading import Thread
-import time
-import pdb
 from scipy import signal
 
 import pyqtgraph as pg
@@ -12,6 +8,8 @@ from PyQt5.QtWidgets import*
 from PyQt5.QtCore import*
 from PyQt5.QtGui import*
 
+from application.Buffers.subscription import COALESCE
+
 # Audio Format (check Audio MIDI Setup if on Mac)
 # FORMAT = pyaudio.paInt16
 RATE = 250
@@ -39,12 +37,9 @@ class SpectrumAnalyzer(QWidget):
 
         # self.BUFFERSIZE=2**12 #1024 is a good buffer size
 
-        self.stop_threads = False
-        self.eeg_sig = Queue()
-        self.t1 = Thread(target=self.lsl.run, args=(lambda: self.stop_threads,self.eeg_sig))
-        self.t1.start()
-        time.sleep(1)
-
+        # The buffer is filled by the shared AcquisitionEngine, no thread is started here.
+        # Each frame takes a snapshot of the latest window through its own subscription.
+        self.subscription = self.lsl.subscribe(policy=COALESCE, max_chunks=1)
         self.initUI()
 
     
@@ -54,7 +49,8 @@ class SpectrumAnalyzer(QWidget):
 
 
     def readData(self):
-        sample = self.eeg_sig.get()
+        # latest window of the ring buffer, a read-only view
+        sample, timestamps = self.subscription.latest()
         shorts = sample[:, self.channel]
 
         return np.array(shorts)
@@ -84,17 +80,10 @@ class SpectrumAnalyzer(QWidget):
 
         self.show()
 
-    #Kills thread safely
-    def kill_thread(self):
-        print("Killing thread....")
-        self.stop_threads=True
-        self.t1.join() 
-        print('Thread killed.') 
-
-    #Kills any active threads and open windows
+    #Kills any open windows
     def close_window(self):
-        self.kill_thread()
         self.main_timer.stop()
+        self.subscription.close()
         self.close()
 
     def get_spectrum(self, data):
@@ -141,10 +130,9 @@ class SpectrumAnalyzer(QWidget):
             print("timer is inactive")
 
     def main_loop(self):
-        try:
-            data = self.readData()
-        except IOError:
-            pass
+        data = self.readData()
+        if len(data) == 0:
+            return
 
         f, Pxx = self.get_spectral_density(data)
 
@@ -5,21 +5,28 @@ from threading import Thread
 import time
 import pylsl
 
-from application.Widgets.SignalViewer import RawSignalViewer
+from application.Widgets.SignalViewer import EnvelopeSignalViewer
 from application.Widgets.SignalFilters import NotchFilter, ButterFilter
 from application.Buffers.lslringbuffer_multithreaded import LSLRINGBUFFER
+from application.Buffers.chunkreader import CHANNEL_FORMATS
+from application.Buffers.subscription import COALESCE
 
 import sys
 import pdb
 
-class TimeSeriesSignal(RawSignalViewer):
-    def __init__(self, fs, num_channels, showChannels, applyFilter=None, lsl_inlet=None):#lsl, view_channels=None, label1=None):
-        super(TimeSeriesSignal, self).__init__(fs, num_channels, showChannels)
+class TimeSeriesSignal(EnvelopeSignalViewer):
+    # Samples are kept in a min/max envelope pyramid (`history` seconds), so the graph can be zoomed out
+    # over minutes of data while every redraw stays about one bin per pixel
+    def __init__(self, fs, num_channels, showChannels, applyFilter=None, lsl_inlet=None, history=600):#lsl, view_channels=None, label1=None):
+        super(TimeSeriesSignal, self).__init__(fs, num_channels, showChannels, history=history)
 
         self.fs = fs
         self.num_channels = num_channels
         self.showChannels = showChannels
         self.lsl_inlet = lsl_inlet
+        # read cursor into the ring buffer (filled by the AcquisitionEngine); chunks arriving between
+        # two frames are coalesced, samples overwritten before a frame are dropped and counted
+        self.subscription = lsl_inlet.subscribe(policy=COALESCE)
 
         self.filter = applyFilter
         self.Filters = {"Notch" : False, "Butter" : False}
@@ -46,6 +53,12 @@ class TimeSeriesSignal(RawSignalViewer):
     def initFilteredGraphs(self):
         self.notch_graph = None
         self.butter_graph = None
+        # filtered streams computed in the acquisition thread and shared with every other viewer of the buffer,
+        # with this viewer's subscriptions to them
+        self.notch_stream = None
+        self.butter_stream = None
+        self.notch_subscription = None
+        self.butter_subscription = None
 
     
     def resetChannels(self):
@@ -54,25 +67,30 @@ class TimeSeriesSignal(RawSignalViewer):
     
     #Creates a new window with the specified Filter
     def addFilter(self, Filter=None):
-        if Filter == "Notch":
+        if Filter == "Notch" and self.notch_graph is None:
             self.Filters["Notch"] = True
-            self.notch_graph = RawSignalViewer(self.fs, self.num_channels, self.showChannels)
+            self.notch_graph = EnvelopeSignalViewer(self.fs, self.num_channels, self.showChannels)
             self.notch_graph.setWindowTitle('Notch Filter')
-            self.notch_filter = NotchFilter(60, self.fs, len(self.num_channels))
+            self.notch_stream = self.lsl_inlet.derive("Notch", NotchFilter(60, self.fs, len(self.num_channels)))
+            self.notch_subscription = self.notch_stream.subscribe(policy=COALESCE)
             self.notch_graph.show()
 
-        if Filter == "Butter":
+        if Filter == "Butter" and self.butter_graph is None:
             self.Filters["Butter"] = True
-            self.butter_graph = RawSignalViewer(self.fs, self.num_channels, self.showChannels)
+            self.butter_graph = EnvelopeSignalViewer(self.fs, self.num_channels, self.showChannels)
             self.butter_graph.setWindowTitle('Butter Filter')
-            self.butter_filter = ButterFilter((0.1, (self.fs / 2) - 0.001), self.fs, len(self.num_channels))
+            self.butter_stream = self.lsl_inlet.derive("Butter", ButterFilter((0.1, (self.fs / 2) - 0.001), self.fs,
+                                                                              len(self.num_channels)))
+            self.butter_subscription = self.butter_stream.subscribe(policy=COALESCE)
             self.butter_graph.show()
 
     
     #Changes the low/high band pass for the butter filter
     def changeFilter(self, Filter, band):
         if Filter == "Butter" and self.butter_graph is not None:
-            self.butter_filter.reset(band)
+            # redesigned (from the coefficient cache) by the acquisition thread at the next chunk boundary,
+            # its state starting from the current signal level
+            self.butter_stream.configure(ButterFilter.reset, band)
 
 
     #Destroys all windows of the specified Filter
@@ -82,12 +100,18 @@ class TimeSeriesSignal(RawSignalViewer):
             if self.notch_graph is not None:
                 self.notch_graph.close()
                 self.notch_graph = None
+                self.notch_subscription.close()
+                self.lsl_inlet.release_derived(self.notch_stream)
+                self.notch_stream = None
 
         if Filter == "Butter":
             self.Filters["Butter"] = False
             if self.butter_graph is not None:
                 self.butter_graph.close()
                 self.butter_graph = None
+                self.butter_subscription.close()
+                self.lsl_inlet.release_derived(self.butter_stream)
+                self.butter_stream = None
         
     #Starts
     def start(self):
@@ -135,19 +159,23 @@ class TimeSeriesSignal(RawSignalViewer):
 
     
     def main_loop(self):
-        self.chunk, timestamp = self.lsl_inlet.get_next_chunk()
+        # Only read the samples acquired since the last tick, the GUI thread never pulls the inlet
+        self.chunk, timestamp = self.subscription.get_all()
         
-        if self.chunk is not None:  # Update signal and signal data if pulled chunk is not None
+        if self.chunk is not None:  # Update signal and signal data if new samples were acquired
             self.update(self.chunk)
             self.updateMetaData()
 
-            if any(self.Filters):
-
-                if self.Filters["Notch"] == True:
-                    self.notch_graph.update(self.notch_filter.apply(self.chunk))
+            # The filtered streams are computed in the acquisition thread, only render them here
+            if self.Filters["Notch"] == True:
+                notched, _ = self.notch_subscription.get_all()
+                if notched is not None:
+                    self.notch_graph.update(notched)
 
-                if self.Filters["Butter"] == True:
-                    self.butter_graph.update(self.butter_filter.apply(self.chunk))
+            if self.Filters["Butter"] == True:
+                filtered, _ = self.butter_subscription.get_all()
+                if filtered is not None:
+                    self.butter_graph.update(filtered)
 
             
     
@@ -155,6 +183,9 @@ class TimeSeriesSignal(RawSignalViewer):
     def close_window(self):
         self.label1.clear()
         self.main_timer.stop()
+        self.subscription.close()
+        self.removeFilter("Notch")
+        self.removeFilter("Butter")
         self.close()
 
 
@@ -173,7 +204,7 @@ if __name__ == "__main__":
         lsl = LSLRINGBUFFER(lsl_type=lsl_inlet.info().type(), name=lsl_inlet.info().name(), inlet=lsl_inlet,\
                 fs=lsl_inlet.info().nominal_srate(), buffer_duration=4.0, \
                 num_channels=lsl_inlet.info().channel_count(), uid=lsl_inlet.info().uid(),\
-                hostname=lsl_inlet.info().hostname(), channel_format='float64')
+                hostname=lsl_inlet.info().hostname(), channel_format=CHANNEL_FORMATS[lsl_inlet.info().channel_format()])
         
         graph = TimeSeriesSignal(lsl, [0,1,2])
         graph.createTimer()
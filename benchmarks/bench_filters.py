@@ -0,0 +1,100 @@
+'''
+  bench_filters.py
+  ----------------
+
+  Scaling of the channel-parallel filter backends with the number of workers.
+
+  A notch + band-pass FilterChain (SignalFilters.py) filters `duration` seconds
+  of random data, chunk by chunk as the acquisition thread would, serially and
+  through ParallelFilter with every backend and worker count. Every run is
+  checked to be bit-identical to the serial output, and the results are
+  written to a json file.
+
+      python -m benchmarks.bench_filters --channels 256 --rates 4000 --workers 1 2 4 8 --output results.json
+
+'''
+
+import argparse
+import itertools
+import json
+import time
+
+import numpy as np
+
+from application.Widgets.SignalFilters import NotchFilter, ButterFilter, FilterChain, ParallelFilter, THREADS, PROCESSES
+from benchmarks.bench_pipeline import environment
+
+BACKENDS = ('serial', THREADS, PROCESSES)
+
+
+def make_chain(fs, n_channels):
+    return FilterChain([NotchFilter(50, fs, n_channels), ButterFilter((1.0, 40.0), fs, n_channels)])
+
+
+def run(backend, n_workers, n_channels, fs, chunk_size, data, reference):
+    chain = make_chain(fs, n_channels)
+    if backend == 'serial':
+        filter = chain
+    else:
+        filter = ParallelFilter(chain, n_workers=n_workers, backend=backend, max_samples=max(chunk_size, 1024))
+    # ParallelFilter returns once its workers are up, only the filtering is timed
+    chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+    times = []
+    outputs = []
+    wall = time.perf_counter()
+    for chunk in chunks:
+        t0 = time.perf_counter()
+        outputs.append(filter.apply(chunk))
+        times.append(time.perf_counter() - t0)
+    wall = time.perf_counter() - wall
+    if backend != 'serial':
+        filter.close()
+
+    output = np.concatenate(outputs)
+    seconds = len(data) / fs
+    return {
+        "backend": backend, "workers": n_workers, "channels": n_channels, "sampling_rate": fs,
+        "chunk_size": chunk_size, "seconds_of_data": seconds, "duration": wall,
+        "realtime_factor": seconds / wall,
+        "chunk_ms": {"p50": float(np.percentile(times, 50) * 1e3), "p99": float(np.percentile(times, 99) * 1e3)},
+        "identical": None if reference is None else bool(np.array_equal(output, reference)),
+    }, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the channel-parallel filter backends.')
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--channels', type=int, nargs='+', default=[256])
+    parser.add_argument('--rates', type=float, nargs='+', default=[4000])
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[64])
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of data filtered per configuration')
+    parser.add_argument('--output', default='bench_filters.json')
+    args = parser.parse_args()
+
+    print('%-8s %7s %8s %6s %5s %9s %8s %9s %9s %9s' % (
+        'backend', 'workers', 'channels', 'rate', 'chunk', 'realtime', 'speedup', 'chunk p50', 'chunk p99',
+        'identical'))
+    results = []
+    for n_channels, fs, chunk_size in itertools.product(args.channels, args.rates, args.chunk_sizes):
+        data = np.random.randn(int(args.duration * fs), n_channels)
+        serial, reference = run('serial', 1, n_channels, fs, chunk_size, data, None)
+        configs = [('serial', 1)] + [(backend, n_workers) for backend in args.backends if backend != 'serial'
+                                     for n_workers in args.workers]
+        for backend, n_workers in configs:
+            result = serial if backend == 'serial' else run(backend, n_workers, n_channels, fs, chunk_size, data,
+                                                            reference)[0]
+            result["speedup"] = result["realtime_factor"] / serial["realtime_factor"]
+            results.append(result)
+            print('%-8s %7d %8d %6g %5d %8.1fx %7.2fx %7.2fms %7.2fms %9s' % (
+                backend, n_workers, n_channels, fs, chunk_size, result["realtime_factor"], result["speedup"],
+                result["chunk_ms"]["p50"], result["chunk_ms"]["p99"],
+                '-' if result["identical"] is None else result["identical"]))
+
+    with open(args.output, 'w') as file:
+        json.dump({"environment": environment(), "arguments": vars(args), "results": results}, file, indent=2)
+    print('Results written to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
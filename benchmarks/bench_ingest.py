@@ -0,0 +1,86 @@
+'''
+  bench_ingest.py
+  ---------------
+
+  Before/after benchmark of the lsl chunk ingest path.
+
+  "list" is the old path (`pull_chunk()` + `np.array(chunk)`), "dest_obj" pulls
+  into the preallocated arrays of `ChunkReader`. Both inlets are connected to
+  the same local outlet and drain the same pre-pushed samples.
+
+      python -m benchmarks.bench_ingest --channels 8 64 256 --samples 20000
+
+'''
+
+import argparse
+import time
+
+import numpy as np
+import pylsl
+
+from application.Buffers.chunkreader import ChunkReader
+
+
+def drain_list(inlet, n_samples, dtype):
+    received = 0
+    t0 = time.perf_counter()
+    while received < n_samples:
+        chunk, timestamps = inlet.pull_chunk(timeout=0.0, max_samples=1024)
+        chunk = np.array(chunk, dtype=dtype)
+        received += chunk.shape[0]
+    return time.perf_counter() - t0
+
+
+def drain_dest_obj(reader, n_samples):
+    received = 0
+    t0 = time.perf_counter()
+    while received < n_samples:
+        samples, timestamps = reader.pull(timeout=0.0)
+        if samples is not None:
+            received += samples.shape[0]
+    return time.perf_counter() - t0
+
+
+def run(n_channels, n_samples, channel_format='float32'):
+    name = 'BenchIngest%d' % n_channels
+    info = pylsl.StreamInfo(name, 'EEG', n_channels, 1000, channel_format, 'bench_ingest_%d' % n_channels)
+    outlet = pylsl.StreamOutlet(info, chunk_size=1024, max_buffered=n_samples // 1000 + 10)
+
+    stream = pylsl.resolve_byprop('source_id', info.source_id(), timeout=5)[0]
+    list_inlet = pylsl.StreamInlet(stream, max_buflen=n_samples // 1000 + 10)
+    dest_inlet = pylsl.StreamInlet(stream, max_buflen=n_samples // 1000 + 10)
+    list_inlet.open_stream()
+    dest_inlet.open_stream()
+    reader = ChunkReader(dest_inlet, max_samples=1024)
+    time.sleep(0.5)
+
+    data = np.random.randn(n_samples, n_channels).astype(channel_format)
+    for start in range(0, n_samples, 1024):
+        outlet.push_chunk(data[start:start + 1024])
+    # give both inlets time to receive everything before draining
+    time.sleep(1.0 + n_samples * n_channels * 4 / 200e6)
+
+    t_list = drain_list(list_inlet, n_samples, channel_format)
+    t_dest = drain_dest_obj(reader, n_samples)
+
+    list_inlet.close_stream()
+    dest_inlet.close_stream()
+    return t_list, t_dest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark list vs dest_obj lsl chunk ingest.')
+    parser.add_argument('--channels', type=int, nargs='+', default=[8, 64, 256])
+    parser.add_argument('--samples', type=int, default=20000)
+    args = parser.parse_args()
+
+    print('%9s %14s %14s %8s' % ('channels', 'list [Ms/s]', 'dest_obj [Ms/s]', 'speedup'))
+    for n_channels in args.channels:
+        t_list, t_dest = run(n_channels, args.samples)
+        rate_list = args.samples * n_channels / t_list / 1e6
+        rate_dest = args.samples * n_channels / t_dest / 1e6
+        print('%9d %14.2f %14.2f %7.1fx' % (n_channels, rate_list, rate_dest, t_list / t_dest))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+'''
+  bench_pipeline.py
+  -----------------
+
+  End-to-end latency, throughput and CPU benchmark of the acquisition pipeline.
+
+  A child process publishes paced local outlets (like lib/dummylsl.DummyLSL, but
+  in chunks and at any rate). Channel 0 of every sample carries its
+  `local_clock()` acquisition time (the last sample of a chunk is pushed at once)
+  and channel 1 a sample counter, so every stage can measure the glass-to-buffer
+  latency of the chunks it receives and count the samples it lost. Only the
+  samples acquired during the measured `duration` are counted (also those still
+  in flight when it ends), so the throughput is that of a window of known length
+  whatever the backlog of the warmup. Stages:
+
+      ringbuffer  LSLRINGBUFFER.run() threads, chunks read from a subscription
+      lslbuffer   LSLBUFFER.get_data() loops
+      filters     ringbuffer + NotchFilter and ButterFilter in a FilterChain (SignalFilters.py)
+      viewer      ringbuffer + headless RawSignalViewer.update() every 30 ms
+
+  Every combination of stage, stream count, channel count, sampling rate and
+  chunk size is run, and the results are written to a json file so runs of
+  different releases can be compared.
+
+      python -m benchmarks.bench_pipeline --streams 1 4 --channels 8 64 --rates 250 2000 --output results.json
+
+'''
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import threading
+import time
+from queue import Queue
+
+import numpy as np
+import pylsl
+
+from application.Buffers.lslbuffer import LSLBUFFER
+from application.Buffers.lslringbuffer_multithreaded import LSLRINGBUFFER
+from application.Buffers.subscription import DROP_OLDEST
+from application.Widgets.SignalFilters import NotchFilter, ButterFilter, FilterChain
+
+STAGES = ('ringbuffer', 'lslbuffer', 'filters', 'viewer')
+FRAME_INTERVAL = 0.03  # seconds between two viewer updates, as the TimeSeriesSignal timer
+DRAIN = 0.5  # seconds the stages keep receiving after the measured window, for the samples still in flight
+
+_config_ids = itertools.count()
+
+
+def generate(source_ids, n_channels, fs, chunk_size, ready, stop):
+    # child process: push a chunk of `chunk_size` samples on every outlet every chunk_size / fs seconds
+    outlets = [pylsl.StreamOutlet(pylsl.StreamInfo('BenchPipeline', 'EEG', n_channels, fs, 'double64', source_id))
+               for source_id in source_ids]
+    chunk = np.random.randn(chunk_size, n_channels)
+    ramp = np.arange(chunk_size)
+    counter = 0
+    interval = chunk_size / fs
+    ready.set()
+
+    due = time.perf_counter()
+    while not stop.is_set():
+        due += interval
+        time.sleep(max(0.0, due - time.perf_counter()))
+        chunk[:, 1] = counter + ramp
+        for outlet in outlets:
+            # the last sample is acquired at the push, the others one period apart before it
+            chunk[:, 0] = pylsl.local_clock() - (chunk_size - 1 - ramp) / fs
+            outlet.push_chunk(chunk)
+        counter += chunk_size
+
+
+class Meter:
+    """Latency, received and lost samples of one stream, and the time spent in the stage, for the samples
+    acquired between `t_start` and `t_end` (local_clock times)."""
+
+    def __init__(self, t_start, t_end):
+        self.t_start = t_start
+        self.t_end = t_end
+        self.latencies = []
+        self.stage_times = []
+        self.samples = 0
+        self.dropped = 0
+        self.last_counter = None
+
+    def record(self, chunk, stage_time=None):
+        now = pylsl.local_clock()
+        if len(chunk) == 0:
+            return
+        first, last = chunk[0, 1], chunk[-1, 1]
+        lost = (last - first + 1 - len(chunk)) + (0 if self.last_counter is None else first - self.last_counter - 1)
+        self.last_counter = last
+        acquired = chunk[:, 0]
+        measured = int(np.count_nonzero((acquired >= self.t_start) & (acquired < self.t_end)))
+        if measured == 0:
+            return
+        self.latencies.append(now - chunk[-1, 0])
+        self.samples += measured
+        self.dropped += int(max(0, lost))
+        if stage_time is not None:
+            self.stage_times.append(stage_time)
+
+
+def _run_ringbuffers(inlets, fs, n_channels, running):
+    buffers = [LSLRINGBUFFER(lsl_type='EEG', name='BenchPipeline', inlet=inlet, fs=fs, buffer_duration=4.0,
+                             num_channels=n_channels, channel_format='float64') for inlet in inlets]
+    subscriptions = [buffer.subscribe(policy=DROP_OLDEST, max_chunks=1024) for buffer in buffers]
+    threads = [threading.Thread(target=buffer.run, args=(lambda: not running.is_set(), Queue()), daemon=True)
+               for buffer in buffers]
+    for thread in threads:
+        thread.start()
+    return subscriptions, threads
+
+
+def stage_ringbuffer(inlets, fs, n_channels, meters, running, filters=False):
+    subscriptions, threads = _run_ringbuffers(inlets, fs, n_channels, running)
+
+    def consume(subscription, meter):
+        if filters:
+            chain = FilterChain([NotchFilter(50, fs, n_channels), ButterFilter((1.0, 0.4 * fs), fs, n_channels)])
+        while running.is_set():
+            samples, timestamps = subscription.get(timeout=0.1)
+            if samples is None:
+                continue
+            if filters:
+                t0 = time.perf_counter()
+                chain.apply(samples)
+                meter.record(samples, time.perf_counter() - t0)
+            else:
+                meter.record(samples)
+
+    consumers = [threading.Thread(target=consume, args=(subscription, meter), daemon=True)
+                 for subscription, meter in zip(subscriptions, meters)]
+    for consumer in consumers:
+        consumer.start()
+    return threads + consumers
+
+
+def stage_filters(inlets, fs, n_channels, meters, running):
+    return stage_ringbuffer(inlets, fs, n_channels, meters, running, filters=True)
+
+
+def stage_lslbuffer(inlets, fs, n_channels, meters, running):
+    def consume(inlet, meter):
+        # configure() resolves the first EEG stream, set up the benchmark inlet instead
+        lslobj = LSLBUFFER(stream_type='EEG', buffer_size=4.0)
+        lslobj.lsl_inlet = inlet
+        lslobj.bool_marker_streams = False
+        lslobj.n_channels = n_channels
+        lslobj.fs = fs
+        lslobj.max_samples = int(fs * lslobj.buffer_size)
+        while running.is_set():
+            meter.record(lslobj.get_data(timeout=0.1))
+
+    threads = [threading.Thread(target=consume, args=(inlet, meter), daemon=True)
+               for inlet, meter in zip(inlets, meters)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def stage_viewer(inlets, fs, n_channels, meters, running, duration):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5 import QtWidgets
+    from application.Widgets.SignalViewer import RawSignalViewer
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    subscriptions, threads = _run_ringbuffers(inlets, fs, n_channels, running)
+    names = ['Ch %i' % i for i in range(n_channels)]
+    viewers = [RawSignalViewer(fs, names, list(range(n_channels))) for _ in inlets]
+    for viewer in viewers:
+        viewer.resize(800, 600)
+        viewer.show()
+
+    # the GUI thread runs the frames, like the QTimer of TimeSeriesSignal
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        frame_start = time.perf_counter()
+        for subscription, viewer, meter in zip(subscriptions, viewers, meters):
+            samples, timestamps = subscription.get_all()
+            if samples is not None:
+                t0 = time.perf_counter()
+                viewer.update(samples)
+                app.processEvents()
+                meter.record(samples, time.perf_counter() - t0)
+        time.sleep(max(0.0, frame_start + FRAME_INTERVAL - time.perf_counter()))
+
+    for viewer in viewers:
+        viewer.close()
+    return threads
+
+
+def _percentiles(values, scale=1e3):
+    if not values:
+        return None
+    values = np.asarray(values) * scale
+    return {"p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95)),
+            "p99": float(np.percentile(values, 99)), "max": float(values.max())}
+
+
+def run(stage, n_streams, n_channels, fs, chunk_size, duration, warmup):
+    config = next(_config_ids)
+    source_ids = ['bench_pipeline_%d_%d_%d' % (os.getpid(), config, i) for i in range(n_streams)]
+
+    context = multiprocessing.get_context('spawn')
+    ready, stop = context.Event(), context.Event()
+    generator = context.Process(target=generate, args=(source_ids, n_channels, fs, chunk_size, ready, stop),
+                                daemon=True)
+    generator.start()
+    ready.wait()
+
+    inlets = []
+    for source_id in source_ids:
+        stream = pylsl.resolve_byprop('source_id', source_id, timeout=10)[0]
+        inlet = pylsl.StreamInlet(stream, max_buflen=10)
+        inlet.open_stream()
+        inlets.append(inlet)
+
+    running = threading.Event()
+    running.set()
+    t_start = pylsl.local_clock() + warmup
+    meters = [Meter(t_start, t_start + duration) for _ in inlets]
+    cpu = {}
+
+    def mark(key):
+        cpu[key] = (time.perf_counter(), time.process_time())
+
+    timers = [threading.Timer(warmup, mark, args=('start',)), threading.Timer(warmup + duration, mark, args=('end',))]
+    for timer in timers:
+        timer.start()
+    if stage == 'viewer':
+        threads = stage_viewer(inlets, fs, n_channels, meters, running, warmup + duration + DRAIN)
+    else:
+        threads = globals()['stage_' + stage](inlets, fs, n_channels, meters, running)
+        time.sleep(warmup + duration + DRAIN)
+    for timer in timers:
+        timer.join()
+
+    running.clear()
+    for thread in threads:
+        thread.join()
+    for inlet in inlets:
+        inlet.close_stream()
+    stop.set()
+    generator.join()
+
+    wall = cpu['end'][0] - cpu['start'][0]
+    cpu_percent = 100.0 * (cpu['end'][1] - cpu['start'][1]) / wall
+    samples = sum(meter.samples for meter in meters)
+    return {
+        "stage": stage, "streams": n_streams, "channels": n_channels, "sampling_rate": fs,
+        "chunk_size": chunk_size, "duration": duration,
+        "samples": samples,
+        "throughput": samples / duration,
+        "throughput_ratio": samples / (duration * fs * n_streams),
+        "dropped_samples": sum(meter.dropped for meter in meters),
+        "latency_ms": _percentiles([latency for meter in meters for latency in meter.latencies]),
+        "stage_time_ms": _percentiles([t for meter in meters for t in meter.stage_times]),
+        "cpu_percent": cpu_percent,
+        "cpu_percent_per_stream": cpu_percent / n_streams,
+    }
+
+
+def environment():
+    return {"created": time.strftime('%Y-%m-%dT%H:%M:%S%z'), "platform": platform.platform(),
+            "python": platform.python_version(), "numpy": np.__version__,
+            "pylsl": getattr(pylsl, '__version__', None), "liblsl": pylsl.library_version(),
+            "cpu_count": os.cpu_count()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark latency, throughput and CPU of the lsl pipeline.')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--streams', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--channels', type=int, nargs='+', default=[8, 64])
+    parser.add_argument('--rates', type=float, nargs='+', default=[250, 2000])
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[16])
+    parser.add_argument('--duration', type=float, default=3.0, help='seconds measured per configuration')
+    parser.add_argument('--warmup', type=float, default=1.0, help='seconds ignored per configuration')
+    parser.add_argument('--output', default='bench_pipeline.json')
+    args = parser.parse_args()
+
+    print('%-10s %7s %8s %6s %5s %12s %8s %8s %9s %9s %6s' % (
+        'stage', 'streams', 'channels', 'rate', 'chunk', 'samples/s', 'ratio', 'dropped', 'lat p50', 'lat p99',
+        'cpu%'))
+    results = []
+    for stage, n_streams, n_channels, fs, chunk_size in itertools.product(
+            args.stages, args.streams, args.channels, args.rates, args.chunk_sizes):
+        result = run(stage, n_streams, n_channels, fs, chunk_size, args.duration, args.warmup)
+        results.append(result)
+        latency = result["latency_ms"] or {"p50": np.nan, "p99": np.nan}
+        print('%-10s %7d %8d %6g %5d %12.0f %8.3f %8d %7.1fms %7.1fms %6.1f' % (
+            stage, n_streams, n_channels, fs, chunk_size, result["throughput"], result["throughput_ratio"],
+            result["dropped_samples"], latency["p50"], latency["p99"], result["cpu_percent"]))
+
+    with open(args.output, 'w') as file:
+        json.dump({"environment": environment(), "arguments": vars(args), "results": results}, file, indent=2)
+    print('Results written to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
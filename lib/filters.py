@@ -2,11 +2,14 @@ from scipy import signal
 import numpy as np
 
 class Filters:
-	def __init__(self,window_size, low, high):
-		fs_Hz = 250;
+	def __init__(self,window_size, low, high, fs=250, filter_order=2, axis=-1):
+		fs_Hz = fs;
 		fn = fs_Hz/2
+		self.fs = fs
+		self.low = low
+		self.axis = axis
 		self.filtered_data = np.array((window_size,1))
-		
+
 
 		#######################################
 		# Filter Creation
@@ -21,22 +24,94 @@ class Filters:
 		#		a) filter_order = 2
 		#		b) high pass cutoff = 15Hz
 		#		c) low pass cutoff = 5Hz
+		#		d) fs = sampling rate of the stream (250Hz by default)
 		# 2) Calculate the coefficients, store in variables
+		# 3) The same cascade (high pass then low pass) as
+		#    second-order sections, for streaming
 
-		filter_order = 2
 		f_high = high
 		f_low = low
 		self.high_pass_coefficients = signal.butter(filter_order,f_low/fn, 'high')
 		self.low_pass_coefficients = signal.butter(filter_order,f_high/fn, 'low')
+		self.sos = np.vstack((signal.butter(filter_order,f_low/fn, 'high', output='sos'),
+							  signal.butter(filter_order,f_high/fn, 'low', output='sos')))
+		self.zi = None
+
+
+	#######################################
+	# Streaming bandpass filter
+	# -------------------------------------
+	# Causal, the filter state is kept between
+	# chunks, so every chunk costs the same
+	# whatever the length of the recording.
+	#
+	# Input:
+	#			the latest chunk (time along `axis`)
+	# Output:
+	#			filtered chunk as a numpy array
+
+	def stream(self,chunk):
+		chunk = np.asarray(chunk)
+		if self.zi is None:
+			# start from the steady state of the first sample, not from zero
+			zi = signal.sosfilt_zi(self.sos)
+			first = np.take(chunk, [0], axis=self.axis)
+			shape = [1] * chunk.ndim
+			shape[self.axis] = 2
+			self.zi = zi.reshape([len(self.sos)] + shape) * first[np.newaxis]
+		filtered_data, self.zi = signal.sosfilt(self.sos, chunk, axis=self.axis, zi=self.zi)
+		return filtered_data
+
+	def reset(self):
+		self.zi = None
+
+
+	#######################################
+	# Offline zero-phase bandpass filter
+	# -------------------------------------
+	# Forward-backward filter of a whole
+	# recording, in blocks of `block_size`
+	# samples with `overlap` samples of context
+	# on both sides, so only one block is
+	# filtered in memory at a time. The data
+	# may be memory-mapped (RecordingReader),
+	# and so may `out`.
+	#
+	# Input:
+	#			the recording (time along `axis`)
+	# Output:
+	#			filtered recording as a numpy array
+
+	def offline(self,data, block_size=None, overlap=None, out=None):
+		data = np.asarray(data)
+		axis = self.axis % data.ndim
+		n = data.shape[axis]
+		# the transients of the high pass decay within a few periods of its cutoff
+		overlap = int(6 * self.fs / self.low) if overlap is None else overlap
+		block_size = max(8 * overlap, 4096) if block_size is None else block_size
+		if out is None:
+			out = np.empty(data.shape, dtype=np.result_type(data, float))
+
+		def along(start, end):
+			index = [slice(None)] * data.ndim
+			index[axis] = slice(start, end)
+			return tuple(index)
+
+		for start in range(0, n, block_size):
+			end = min(start + block_size, n)
+			first, last = max(0, start - overlap), min(n, end + overlap)
+			filtered = signal.sosfiltfilt(self.sos, data[along(first, last)], axis=axis)
+			out[along(start, end)] = filtered[along(start - first, end - first)]
+		return out
 
 
 	#######################################
 	# Bandpass filter
 	# -------------------------------------
-	# Filter the data, using a bandpass of 
+	# Filter the data, using a bandpass of
 	# 5-15Hz.
-	# 
-	# Input: 
+	#
+	# Input:
 	#			the data buffer from Data_Buffer class
 	# Output:
 	#			filtered data as a numpy array
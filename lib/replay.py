@@ -0,0 +1,156 @@
+'''
+  replay.py
+  ---------------
+
+  This module republishes sessions recorded with application.Buffers.recording.Recorder into labstreaminglayer
+
+
+'''
+
+import heapq
+import threading
+import time
+
+import numpy as np
+import pylsl
+from pylsl import StreamInfo, StreamOutlet
+
+from application.Buffers.chunkreader import CHANNEL_FORMATS
+from application.Buffers.recording import RecordingReader, MARKERS
+
+# lsl channel format of every numpy dtype name (and 'string')
+LSL_FORMATS = {name: channel_format for channel_format, name in CHANNEL_FORMATS.items()}
+
+AS_FAST_AS_POSSIBLE = None
+
+
+class ReplayLSL:
+    """Replay a recording as lsl outlets, one per recorded stream, with the
+    recorded stream metadata (name, type, channels, rate, format). The source
+    id is the recorded one prefixed with 'replay-', so consumers resolving the
+    live device by source id never pick the replay instead.
+
+    Samples are pushed with `push_chunk` in chunks of `chunk_duration`
+    seconds of recorded data. The chunks of all streams are merged in
+    timestamp order and paced by `speed`: 1.0 replays in real time, N replays
+    N times faster and AS_FAST_AS_POSSIBLE (None) pushes without waiting.
+    Every sample is stamped with its recorded time, from the start of the
+    replay and divided by `speed` (the outlets declare `speed` times the
+    recorded rate), so timestamps only go back where they did in the
+    recording, and its gaps and jitter are preserved. As fast as possible,
+    samples keep the recorded spacing and run ahead of `local_clock()`.
+
+    Examples
+    --------
+        >>> replay = ReplayLSL('session.lslrec', speed=4.0)
+        >>> replay.start_streaming()
+        >>> replay.wait()
+        >>> replay.stats()
+    """
+
+    def __init__(self, path, speed=1.0, chunk_duration=0.02):
+        self.reader = RecordingReader(path)
+        self.speed = speed
+        self.chunk_duration = chunk_duration
+
+        self.outlets = [StreamOutlet(self.create_info(info, speed)) for info in self.reader.streams]
+        self.n_samples = [0] * len(self.outlets)
+        self.lag = 0.0  # largest delay of a chunk behind its schedule, seconds
+        self.elapsed = 0.0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @staticmethod
+    def create_info(info, speed=1.0):
+        """Build the lsl StreamInfo of a recorded stream from its `get_lsl_info()` metadata,
+        with its nominal rate scaled by `speed` and a source id of its own.
+        """
+        srate = (info.get("sampling_rate") or pylsl.IRREGULAR_RATE) * (speed or 1.0)
+        original = info.get("uid") or info.get("stream_name") or ''
+        stream_info = StreamInfo(info.get("stream_name") or 'Replay', info.get("stream_type") or '',
+                                 info["number_of_channels"], srate,
+                                 LSL_FORMATS.get(info.get("channel_format"), pylsl.cf_float32),
+                                 'replay-' + original)
+
+        # the original id stays available to consumers that want to match the replay to its device
+        stream_info.desc().append_child_value('replayed_source_id', original)
+        chns = stream_info.desc().append_child('channels')
+        for label in info.get("channels") or []:
+            ch = chns.append_child("channel")
+            ch.append_child_value('label', label)
+        return stream_info
+
+    def chunks(self, stream):
+        # (first timestamp, stream, samples, timestamps) of `chunk_duration` seconds, in recording order
+        for i in np.flatnonzero(self.reader.index['stream'] == stream):
+            samples, timestamps = self.reader.read_block(i)
+            if self.reader.index['kind'][i] == MARKERS:
+                yield timestamps[0], stream, samples, timestamps
+                continue
+
+            bounds = np.arange(timestamps[0], timestamps[-1], self.chunk_duration)[1:]
+            splits = np.searchsorted(timestamps, bounds, side='left')
+            for start, end in zip(np.r_[0, splits], np.r_[splits, len(timestamps)]):
+                if end > start:
+                    yield timestamps[start], stream, samples[start:end], timestamps[start:end]
+
+    def run(self):
+        index = self.reader.index
+        if len(index) == 0:
+            return
+        t_first = index['first'].min()
+        started = time.monotonic()
+        lsl_started = pylsl.local_clock()
+
+        merged = heapq.merge(*[self.chunks(stream) for stream in range(len(self.outlets))], key=lambda c: c[0])
+        for _, stream, samples, timestamps in merged:
+            if self.stop_event.is_set():
+                break
+            outlet = self.outlets[stream]
+
+            if self.speed is AS_FAST_AS_POSSIBLE:
+                stamps = lsl_started + (timestamps - t_first)
+            else:
+                # a chunk is due once its last sample has been "acquired"
+                stamps = lsl_started + (timestamps - t_first) / self.speed
+                delay = started + (timestamps[-1] - t_first) / self.speed - time.monotonic()
+                if delay > 0:
+                    if self.stop_event.wait(delay):
+                        break
+                else:
+                    self.lag = max(self.lag, float(-delay))
+
+            if isinstance(samples, list):
+                # markers have an irregular rate, every one is stamped
+                outlet.push_chunk(samples, list(stamps))
+            else:
+                # push_chunk only takes its fast path for writable contiguous arrays of the outlet's type.
+                # Every sample gets its stamp: with only the last one, liblsl would back-date the others
+                # at the declared rate, and the chunks would overlap whenever that isn't the replay's pace
+                samples = np.require(samples, dtype=CHANNEL_FORMATS[outlet.channel_format], requirements=['C', 'W'])
+                outlet.push_chunk(samples, stamps)
+            self.n_samples[stream] += len(timestamps)
+
+        self.elapsed = time.monotonic() - started
+
+    def start_streaming(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='lsl-replay', daemon=True)
+        self.thread.start()
+
+    def stop_streaming(self):
+        self.stop_event.set()
+        self.wait()
+
+    def wait(self, timeout=None):
+        # block until the whole recording has been replayed (or stopped)
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def stats(self):
+        return {"samples": dict(zip([info.get("stream_name") for info in self.reader.streams], self.n_samples)),
+                "elapsed": self.elapsed, "lag": self.lag}
+
+    def cleanUp(self):
+        self.stop_streaming()
+        self.reader.close()
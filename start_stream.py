@@ -1,10 +1,18 @@
 import sys
 
 from lib.dummylsl import DummyLSL
+from lib.replay import ReplayLSL
 
 
 def main(argv):
     # if no arguments are provided, default ia to stream 4 channels with fs=250Hz to LSL
+    # otherwise replay a recording: start_stream.py session.lslrec [speed]
+	if argv:
+		replay = ReplayLSL(argv[0], speed=float(argv[1]) if len(argv) > 1 else 1.0)
+		replay.start_streaming()
+		replay.wait()
+		print(replay.stats())
+		return
 
 	lsl1 = DummyLSL("DummyStream1", 1)
 	lsl1.create_lsl()
@@ -0,0 +1,50 @@
+import numpy as np
+
+from application.Buffers.envelope import EnvelopePyramid
+
+
+def brute_force(data, positions, size, tail, end):
+    # min, max and mean of every bin straight from the samples; the last bin may be incomplete
+    bounds = [(p, p + size if p < tail else end) for p in positions]
+    lo = np.array([data[a:b].min(axis=0) for a, b in bounds])
+    hi = np.array([data[a:b].max(axis=0) for a, b in bounds])
+    mean = np.array([data[a:b].mean(axis=0) for a, b in bounds])
+    return lo, hi, mean
+
+
+def test_pyramid_matches_brute_force_min_max():
+    rng = np.random.default_rng(0)
+    pyramid = EnvelopePyramid(n_channels=3, capacity=256, factor=4, n_levels=5)
+    data = rng.standard_normal((5000, 3))
+    # chunks of random sizes, so bins straddle chunk boundaries
+    bounds = np.cumsum(rng.integers(1, 97, size=200))
+    for start, end in zip(np.r_[0, bounds], bounds):
+        pyramid.extend(data[start:min(end, len(data))])
+        if end >= len(data):
+            break
+
+    n = pyramid.n_written
+    assert n == len(data)
+    for level in range(pyramid.n_levels):
+        size = pyramid.factor ** level
+        first = n - len(pyramid.raw) if level == 0 else pyramid.levels[level - 1].first
+        for start, end in ((first, n), (first + 7, n - 3), (n - 100, n - 1)):
+            got_level, positions, lo, hi, mean = pyramid.window(start, end, level=level)
+            assert got_level == level
+            if level == 0:
+                assert np.array_equal(lo, data[start:end])
+                continue
+            tail = pyramid.levels[level - 1].n_written * size
+            ref_lo, ref_hi, ref_mean = brute_force(data, positions, size, tail, end)
+            assert positions[0] <= start < positions[0] + size
+            assert np.array_equal(lo, ref_lo)
+            assert np.array_equal(hi, ref_hi)
+            assert np.allclose(mean, ref_mean)
+
+
+def test_window_picks_level_by_points():
+    pyramid = EnvelopePyramid(n_channels=1, capacity=1024, factor=4, n_levels=4)
+    pyramid.extend(np.arange(20000.0)[:, np.newaxis])
+    level, positions, lo, hi, mean = pyramid.window(pyramid.n_written - 17000, max_points=1000)
+    assert level == 3 and len(positions) <= 1000
+    assert pyramid.window(pyramid.n_written - 500, max_points=1000)[0] == 0
@@ -0,0 +1,66 @@
+import numpy as np
+
+from application.Buffers.epocher import Epocher
+
+FS = 100
+
+
+def chunk(start, n):
+    # samples numbered from `start`, channel c holds counter + 1000 * c, timestamps on the sample count
+    counter = np.arange(start, start + n, dtype=float)
+    return np.stack([counter, counter + 1000], axis=1), counter / FS
+
+
+def test_epochs_hold_tmin_to_tmax_included():
+    epocher = Epocher(fs=FS, n_channels=2, tmin=-0.1, tmax=0.2)
+    assert epocher.n_samples == 31
+    collected = []
+    for start in range(0, 300, 17):
+        samples, timestamps = chunk(start, 17)
+        markers = [t for t in (0.5, 0.6, 1.234, 2.004) if timestamps[0] <= t <= timestamps[-1]]
+        epochs, labels, onsets = epocher.push(samples, timestamps, markers, ['m%g' % t for t in markers])
+        collected += zip(epochs, labels, onsets)
+
+    assert [label for _, label, _ in collected] == ['m0.5', 'm0.6', 'm1.234', 'm2.004']
+    for epoch, label, onset in collected:
+        onset_sample = int(round(float(label[1:]) * FS))  # nearest sample to the marker
+        assert onset == onset_sample / FS
+        assert epoch.shape == (2, 31)
+        assert np.array_equal(epoch[0], np.arange(onset_sample - 10, onset_sample + 21))  # tmax sample included
+        assert np.array_equal(epoch[1], epoch[0] + 1000)
+    assert epocher.dropped == 0 and epocher.n_pending == 0
+
+
+def test_epoch_is_emitted_with_its_tmax_sample():
+    epocher = Epocher(fs=FS, n_channels=2, tmin=0.0, tmax=0.1)
+    epocher.add_markers([1.0], ['go'])
+    epochs, _, _ = epocher.push(*chunk(0, 110))  # up to sample 109, 0.09 s after the marker
+    assert len(epochs) == 0 and epocher.n_pending == 1
+    epochs, _, _ = epocher.push(*chunk(110, 1))  # sample 110, tmax
+    assert len(epochs) == 1 and epochs[0][0, -1] == 110
+
+
+def test_markers_before_their_samples_stay_pending():
+    epocher = Epocher(fs=FS, n_channels=2, tmin=-0.2, tmax=0.3, buffer_size=2.0)
+    # the marker comes while the ring is empty, and its pre-stimulus samples come later
+    epochs, _, _ = epocher.push(None, None, [0.5], ['early'])
+    assert len(epochs) == 0 and epocher.n_pending == 1 and epocher.dropped == 0
+    epochs, labels, _ = epocher.push(*chunk(0, 100))
+    assert list(labels) == ['early'] and np.array_equal(epochs[0][0], np.arange(30, 81))
+
+    # a marker whose window starts before the first sample ever received waits, and is only lost once
+    # the ring overwrites samples
+    epocher.reset()
+    epocher.add_markers([0.1], ['too early'])
+    epocher.push(*chunk(0, 100))
+    assert epocher.n_pending == 1 and epocher.dropped == 0
+    epocher.push(*chunk(100, 150))  # the ring of 200 samples laps
+    assert epocher.n_pending == 0 and epocher.dropped == 1
+
+
+def test_push_chunk_follows_get_data():
+    epocher = Epocher(fs=FS, n_channels=2, tmin=-0.05, tmax=0.05)
+    epocher.push_chunk(chunk(0, 50)[0])
+    # 120 ms after the first sample of the chunk: sample 62
+    epochs, labels, onsets = epocher.push_chunk(chunk(50, 50)[0], [(120.0, 'stim')])
+    assert list(labels) == ['stim'] and np.array_equal(epochs[0][0], np.arange(57, 68))
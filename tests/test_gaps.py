@@ -0,0 +1,58 @@
+import numpy as np
+
+from application.Buffers.gaps import GapDetector, DROP, LINEAR
+
+
+def lsl_chunks(fs, seconds, chunk_size, jitter, seed=0):
+    # a complete stream as an inlet receives it: every chunk is stamped when it is pushed (late by a random
+    # delay) and its samples are back-dated at the nominal rate, so timestamps step back and forth at boundaries
+    rng = np.random.default_rng(seed)
+    n = int(fs * seconds)
+    counter = np.arange(n, dtype=float)
+    for start in range(0, n, chunk_size):
+        end = min(start + chunk_size, n)
+        pushed = end / fs + rng.uniform(0, jitter)
+        timestamps = pushed - (end - 1 - np.arange(start, end)) / fs
+        yield np.stack([counter[start:end]] * 2, axis=1), timestamps
+
+
+def run(detector, chunks):
+    samples, timestamps = zip(*[detector.process(*chunk) for chunk in chunks])
+    return np.concatenate(samples), np.concatenate(timestamps)
+
+
+def test_jittered_complete_stream_loses_no_samples():
+    fs = 2000
+    for backwards in (None, DROP):
+        detector = GapDetector(fs, repair=LINEAR, backwards=backwards)
+        samples, timestamps = run(detector, lsl_chunks(fs, 4.0, chunk_size=16, jitter=0.008))
+        stats = detector.stats()
+        assert np.array_equal(samples[:, 0], np.arange(4 * fs))
+        assert stats["non_monotonic"] > 0
+        assert stats["gaps"] == stats["missing_samples"] == stats["filled_samples"] == 0
+        assert stats["dropped"] == 0
+
+
+def test_gap_is_counted_and_filled():
+    fs = 100
+    chunks = list(lsl_chunks(fs, 3.0, chunk_size=10, jitter=0.002))
+    del chunks[10]  # 10 samples (100 ms) lost
+    detector = GapDetector(fs, repair=LINEAR)
+    samples, timestamps = run(detector, chunks)
+    stats = detector.stats()
+    assert stats["gaps"] == 1
+    assert stats["missing_samples"] == stats["filled_samples"] == 10
+    assert np.allclose(samples[:, 0], np.arange(3 * fs), atol=0.5)
+
+
+def test_only_clearly_bad_steps_are_dropped():
+    fs = 250
+    samples = np.arange(10.0)[:, np.newaxis]
+    timestamps = np.arange(10) / fs
+    timestamps[4] -= 0.004  # jitter, one period back
+    timestamps[7] -= 1.0  # clearly out of order
+    detector = GapDetector(fs, backwards=DROP)
+    kept, kept_timestamps = detector.process(samples, timestamps)
+    assert detector.stats()["non_monotonic"] == 2
+    assert detector.stats()["out_of_order"] == detector.stats()["dropped"] == 1
+    assert np.array_equal(kept[:, 0], [0, 1, 2, 3, 4, 5, 6, 8, 9])
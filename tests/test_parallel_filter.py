@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from scipy import signal
+
+from application.Widgets.SignalFilters import NotchFilter, ButterFilter, FilterChain, ParallelFilter, THREADS, PROCESSES
+from lib.filters import Filters
+
+FS, N_CHANNELS = 1000, 10
+
+
+def make_chain():
+    return FilterChain([NotchFilter(50, FS, N_CHANNELS), ButterFilter((1.0, 40.0), FS, N_CHANNELS)])
+
+
+@pytest.fixture
+def parallel_filters():
+    # worker processes are spawned, they import SignalFilters (never this module's test code) and are
+    # always stopped, also when a test fails
+    filters = []
+
+    def make(*args, **kwargs):
+        filters.append(ParallelFilter(*args, **kwargs))
+        return filters[-1]
+
+    yield make
+    for filter in filters:
+        filter.close()
+
+
+@pytest.mark.parametrize('backend', [THREADS, PROCESSES])
+@pytest.mark.parametrize('dtype', ['float64', 'float32'])
+def test_parallel_output_equals_the_serial_filter(parallel_filters, backend, dtype):
+    rng = np.random.default_rng(0)
+    serial = make_chain()
+    parallel = parallel_filters(make_chain(), n_workers=3, backend=backend, max_samples=64)
+    assert parallel.shards == [(0, 3), (3, 6), (6, 10)]
+    # chunks longer than the shared blocks go through in several blocks
+    for size in (1, 37, 64, 200, 5):
+        chunk = (rng.standard_normal((size, N_CHANNELS)) * 100).astype(dtype)
+        expected = serial.apply(chunk)
+        filtered = parallel.apply(chunk)
+        assert filtered.dtype == expected.dtype == np.float64
+        assert np.array_equal(filtered, expected)
+
+
+def test_more_workers_than_channels(parallel_filters):
+    parallel = parallel_filters(ButterFilter((None, 40.0), FS, 2), n_workers=8, backend=THREADS)
+    assert parallel.n_workers == 2
+
+
+def test_unknown_backend_is_refused():
+    with pytest.raises(ValueError):
+        ParallelFilter(make_chain(), backend='gpu')
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32'])
+def test_blocked_zero_phase_filter_matches_sosfiltfilt(dtype):
+    rng = np.random.default_rng(1)
+    data = (rng.standard_normal((N_CHANNELS, 30000)) * 50).astype(dtype)
+    filters = Filters(window_size=None, low=5, high=15, fs=FS)
+    expected = signal.sosfiltfilt(filters.sos, data, axis=-1)
+    # blocks with their overlapping context give the whole-recording result up to rounding
+    blocked = filters.offline(data, block_size=4096)
+    assert blocked.dtype == np.float64
+    assert np.max(np.abs(blocked - expected)) < 1e-9 * np.max(np.abs(expected))
+
+    out = np.empty(data.shape)
+    assert filters.offline(data, block_size=5000, out=out) is out
+    assert np.max(np.abs(out - expected)) < 1e-9 * np.max(np.abs(expected))
@@ -0,0 +1,144 @@
+import numpy as np
+
+from application.Buffers.lslringbuffer_multithreaded import LSLRINGBUFFER
+from application.Buffers.recording import Recorder, RecordingReader
+
+
+def make_buffer(name, fs, n_channels, channel_format, buffer_duration=4.0):
+    # a buffer without an inlet, the tests write its ring directly
+    return LSLRINGBUFFER(lsl_type='EEG', name=name, fs=fs, buffer_duration=buffer_duration, num_channels=n_channels,
+                         channel_format=channel_format, channels=['C%d' % i for i in range(n_channels)])
+
+
+def write(buffer, n, fs):
+    start = buffer.ring.n_written
+    counter = np.arange(start, start + n)
+    samples = np.stack([counter * (c + 1) for c in range(buffer.num_channels)], axis=1) % 30000
+    buffer.ring.extend(samples.astype(buffer.dtype), counter / fs)
+    return samples
+
+
+def test_recording_round_trip(tmp_path):
+    path = str(tmp_path / 'session.lslrec')
+    eeg = make_buffer('EEG', 100, 4, 'int16')
+    aux = make_buffer('AUX', 50, 2, 'float32')
+    recorder = Recorder(path, block_duration=1.0, interval=3600)  # only the test drains before stop()
+    assert recorder.add_stream(eeg) == 0 and recorder.add_stream(aux) == 1
+    recorder.start()
+    expected = {0: [], 1: []}
+    for _ in range(25):
+        expected[0].append(write(eeg, 13, 100))
+        expected[1].append(write(aux, 7, 50))
+        recorder._drain(recorder.streams[0])  # as the writer thread would, several drains per block
+    recorder.stop()
+    assert [s["dropped_samples"] for s in recorder.stats()] == [0, 0]
+    assert [s["samples"] for s in recorder.stats()] == [325, 175]
+
+    reader = RecordingReader(path)
+    assert [info["stream_name"] for info in reader.streams] == ['EEG', 'AUX']
+    for stream_id, fs in ((0, 100), (1, 50)):
+        stream = reader.get_stream(stream_id)
+        samples, timestamps = stream.read(-np.inf, np.inf)
+        assert samples.dtype == (np.int16 if stream_id == 0 else np.float32)
+        assert np.array_equal(samples, np.concatenate(expected[stream_id]))
+        assert np.array_equal(timestamps, np.arange(len(stream)) / fs)
+    assert reader.get_stream('AUX').get_channels() == ['C0', 'C1']
+    assert sum(len(ts) for _, ts in reader.iter_blocks(stream=0)) == 325
+    reader.close()
+
+
+def test_samples_lapped_during_the_copy_are_dropped(tmp_path):
+    path = str(tmp_path / 'lapped.lslrec')
+    buffer = make_buffer('EEG', 100, 2, 'float32', buffer_duration=1.0)  # a ring of 100 samples
+    recorder = Recorder(path, interval=3600)
+    recorder.add_stream(buffer)
+    recorder.start()
+
+    stream = recorder.streams[0]
+    get_all = stream.subscription.get_all
+
+    def lapping_get_all(timeout=0.0):
+        # the writer writes 50 more samples right after the views are handed out: the first 10 are lapped
+        samples, timestamps = get_all(timeout)
+        write(buffer, 50, 100)
+        return samples, timestamps
+
+    write(buffer, 60, 100)
+    stream.subscription.get_all = lapping_get_all
+    recorder._drain(stream)
+    stream.subscription.get_all = get_all
+    recorder.stop()
+    assert recorder.stats()[0]["dropped_samples"] == 10
+
+    samples, timestamps = RecordingReader(path).get_stream(0).read(-np.inf, np.inf)
+    assert np.array_equal(timestamps, np.arange(10, 110) / 100)
+    assert np.array_equal(samples[:, 0], np.arange(10, 110))
+
+
+def record(path, n_samples=1000, fs=100, n_channels=4, channel_format='int16', block_duration=1.0):
+    # a recording of n_samples numbered samples (channel c holds counter * (c + 1)), blocks of fs samples
+    buffer = make_buffer('EEG', fs, n_channels, channel_format, buffer_duration=n_samples / fs)
+    recorder = Recorder(path, block_duration=block_duration, interval=3600)
+    recorder.add_stream(buffer)
+    recorder.start()
+    samples = np.concatenate([write(buffer, min(37, n_samples - start), fs) for start in range(0, n_samples, 37)])
+    recorder.stop()
+    return samples, np.arange(len(samples)) / fs
+
+
+def test_memmapped_reads_are_views_of_the_file(tmp_path):
+    path = str(tmp_path / 'int16.lslrec')
+    expected, _ = record(path)
+    reader = RecordingReader(path)
+    assert isinstance(reader.data, np.ndarray) and not reader.data.flags.writeable
+    samples, timestamps = reader.read_block(3)
+    assert samples.dtype == np.int16 and samples.shape == (100, 4)
+    assert np.shares_memory(samples, reader.data)  # no copy within a block
+    assert np.array_equal(samples, expected[300:400])
+
+
+def test_seek_by_timestamp_and_channel_subsets(tmp_path):
+    path = str(tmp_path / 'seek.lslrec')
+    expected, times = record(path)
+    stream = RecordingReader(path).get_stream('EEG')
+    assert len(stream) == 1000 and stream.duration == times[-1]
+
+    for t0, t1 in ((2.5, 2.7), (0.95, 4.05), (0.0, 9.99), (3.0, 3.0), (4.001, 4.009), (-5.0, 0.5), (9.5, 20.0)):
+        samples, timestamps = stream.read(t0, t1)
+        inside = (times >= t0) & (times <= t1)  # both edges included, like the live ring
+        assert np.array_equal(timestamps, times[inside])
+        assert np.array_equal(samples, expected[inside])
+
+    samples, _ = stream.read(1.5, 3.5, channels=[3, 'C1'])
+    inside = (times >= 1.5) & (times <= 3.5)
+    assert np.array_equal(samples, expected[inside][:, [3, 1]])
+    assert stream.read(20.0, 30.0)[0].shape == (0, 4)
+    assert stream.read(20.0, 30.0, channels=[0])[0].shape == (0, 1)
+
+    samples, timestamps = stream.get_latest(1.0)
+    assert np.array_equal(timestamps, times[times > times[-1] - 1.0])  # strictly newer, like the live ring
+    assert np.array_equal(samples, expected[times > times[-1] - 1.0])
+    assert np.array_equal(stream.get_window(2.0, 2.1)[0], expected[200:211])
+
+
+def test_truncated_recording_rebuilds_its_index(tmp_path):
+    path = str(tmp_path / 'killed.lslrec')
+    expected, times = record(path)
+    with open(path, 'rb') as file:
+        data = file.read()
+    complete = RecordingReader(path)
+    offsets = [int(offset) for offset in complete.index['offset']]
+    complete.close()
+
+    # cut in the middle of the 7th block: the trailer and the index are gone, 6 blocks are readable
+    with open(path, 'wb') as file:
+        file.write(data[:offsets[6] + 500])
+    reader = RecordingReader(path)
+    assert len(reader.index) == 6 and list(reader.index['offset']) == offsets[:6]
+    samples, timestamps = reader.get_stream(0).read(-np.inf, np.inf)
+    assert np.array_equal(samples, expected[:600]) and np.array_equal(timestamps, times[:600])
+
+    # cut right after a block: it is complete
+    with open(path, 'wb') as file:
+        file.write(data[:offsets[6]])
+    assert len(RecordingReader(path).index) == 6
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from application.Buffers.ringbuffer import RingBuffer, TimestampedRingBuffer
+
+
+def test_views_stay_contiguous_across_wraparound():
+    rng = np.random.default_rng(0)
+    ring = RingBuffer(capacity=100, dtype=(float, 3))
+    written = np.empty((0, 3))
+    for n in rng.integers(1, 60, size=50):
+        chunk = rng.standard_normal((n, 3))
+        ring.extend(chunk)
+        written = np.concatenate((written, chunk))
+        for size in (None, 1, 37, 100):
+            window = ring.view(size)
+            expected = written[-min(size or len(ring), len(ring)):]
+            assert np.array_equal(window, expected)
+            assert window.flags.c_contiguous and not window.flags.writeable
+            assert np.shares_memory(window, ring._data)  # a view of the storage, not an unwrapping copy
+
+
+def test_oversized_chunk_keeps_the_latest_samples():
+    ring = RingBuffer(capacity=10, dtype=float)
+    ring.extend(np.arange(3.0))
+    ring.extend(np.arange(3.0, 28.0))
+    assert ring.n_written == 28 and len(ring) == 10 and ring.is_full
+    assert np.array_equal(ring.view(), np.arange(18.0, 28.0))
+
+
+def test_get_latest_and_n_written_over_several_laps():
+    fs, capacity = 128, 250  # timestamps exact in binary, so the 1 s edge is sharp
+    ring = TimestampedRingBuffer(capacity=capacity, n_channels=2)
+    n = 0
+    for _ in range(40):  # 1200 samples, almost 5 laps
+        chunk = np.stack([np.arange(n, n + 30.0)] * 2, axis=1)
+        ring.extend(chunk, np.arange(n, n + 30) / fs)
+        n += 30
+        assert ring.n_written == n and len(ring) == min(n, capacity)
+
+        samples, timestamps = ring.get_latest(1.0)
+        assert len(samples) == min(n, fs)  # samples newer than (newest - 1 s)
+        assert samples[-1, 0] == n - 1
+
+    assert np.array_equal(ring.view()[0][:, 0], np.arange(n - capacity, n))
+
+
+def test_timestamps_stay_aligned_with_samples():
+    rng = np.random.default_rng(1)
+    ring = TimestampedRingBuffer(capacity=64, n_channels=1, dtype='int32')
+    n = 0
+    for size in rng.integers(1, 90, size=60):
+        ring.extend(np.arange(n, n + size, dtype='int32')[:, np.newaxis], np.arange(n, n + size) * 0.5)
+        n += size
+        samples, timestamps = ring.view()
+        assert len(samples) == len(timestamps) == min(n, 64)
+        assert np.array_equal(samples[:, 0] * 0.5, timestamps)
+
+        # ranges older than the ring are clipped to what is still stored
+        samples, timestamps, start, end = ring.read_range(n - 100, n - 3)
+        assert start == max(n - 100, n - 64, 0) and end == max(n - 3, start)
+        assert np.array_equal(samples[:, 0], np.arange(start, end))
+        assert np.array_equal(timestamps, np.arange(start, end) * 0.5)
+
+    samples, timestamps = ring.get_window((n - 20) * 0.5, (n - 10) * 0.5)
+    assert np.array_equal(samples[:, 0], np.arange(n - 20, n - 9))
+
+
+def test_caller_storage_is_validated():
+    with pytest.raises(ValueError):
+        RingBuffer(capacity=0)
+    with pytest.raises(ValueError):
+        RingBuffer(capacity=10, buffer=np.zeros(10))
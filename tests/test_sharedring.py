@@ -0,0 +1,64 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+
+from application.Buffers.sharedring import SharedRingBuffer
+from application.Buffers.subscription import BLOCK, COALESCE
+
+
+def write_chunks(name, created, subscribed, done, n_chunks, size):
+    # writer process: creates the ring and fills it with numbered samples once the reader subscribed
+    ring = SharedRingBuffer.create(capacity=1000, n_channels=2, dtype='float32', name=name)
+    created.set()
+    subscribed.wait(10)
+    for i in range(n_chunks):
+        counter = np.arange(i * size, (i + 1) * size, dtype='float32')
+        ring.extend(np.stack([counter, -counter], axis=1), counter / 100.0)
+    done.wait(10)
+    ring.close()
+
+
+def test_reader_subscription_receives_the_writer_chunks():
+    context = multiprocessing.get_context('spawn')
+    created, subscribed, done = context.Event(), context.Event(), context.Event()
+    name = 'test_ring_%d' % os.getpid()
+    writer = context.Process(target=write_chunks, args=(name, created, subscribed, done, 20, 25))
+    writer.start()
+    try:
+        assert created.wait(10)
+        reader = SharedRingBuffer.attach(name)
+        subscription = reader.subscribe(max_chunks=64)
+        subscribed.set()
+
+        received = []
+        while len(received) < 500:
+            samples, timestamps = subscription.get(timeout=5.0)
+            assert samples is not None, 'nothing was published to the reader'
+            assert np.array_equal(timestamps, samples[:, 0] / 100.0)
+            assert np.array_equal(samples[:, 1], -samples[:, 0])
+            received.extend(samples[:, 0])
+        assert np.array_equal(received, np.arange(500)) and subscription.stats()["dropped_samples"] == 0
+
+        poller = reader.poller
+        subscription.close()
+        poller.join(1.0)
+        assert not poller.is_alive() and reader.poller is None  # stops with the last subscription
+        del samples, timestamps
+        reader.close()
+    finally:
+        done.set()
+        writer.join(10)
+
+
+def test_reader_refuses_block_subscriptions():
+    ring = SharedRingBuffer.create(capacity=100, n_channels=1)
+    reader = SharedRingBuffer.attach(ring.name)
+    with pytest.raises(ValueError):
+        reader.subscribe(policy=BLOCK)
+    reader.subscribe(policy=COALESCE)
+    poller = reader.poller
+    reader.close()  # also stops the poller
+    assert not poller.is_alive()
+    ring.close()
@@ -0,0 +1,84 @@
+import numpy as np
+
+from application.Widgets.SignalFilters import NotchFilter, ButterFilter, FilterChain
+
+FS, N_CHANNELS = 500, 4
+
+
+def chunks(n_chunks=20, size=37, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.standard_normal((size, N_CHANNELS)) + 3.0 for _ in range(n_chunks)]
+
+
+def stages():
+    return [NotchFilter(50, FS, N_CHANNELS), ButterFilter((1.0, 40.0), FS, N_CHANNELS),
+            ButterFilter((None, 30.0), FS, N_CHANNELS)]
+
+
+def test_chain_is_bit_identical_to_the_stages_one_after_another():
+    chain = FilterChain(stages())
+    serial = stages()
+    for chunk in chunks():
+        expected = chunk
+        for stage in serial:
+            expected = stage.apply(expected)
+        assert np.array_equal(chain.apply(chunk), expected)
+
+
+def test_stages_keep_their_state_when_the_chain_changes():
+    notch, butter, lowpass = stages()
+    chain = FilterChain([notch, butter])
+    serial = stages()
+    data = chunks()
+
+    def step(chunk, active):
+        expected = chunk
+        for stage in active:
+            expected = stage.apply(expected)
+        assert np.array_equal(chain.apply(chunk), expected)
+
+    for chunk in data[:5]:
+        step(chunk, serial[:2])
+    chain.add(lowpass)
+    for chunk in data[5:10]:
+        step(chunk, serial)
+    chain.remove(notch)
+    for chunk in data[10:]:
+        step(chunk, serial[1:])
+    assert chain.stages == [butter, lowpass]
+
+
+def test_empty_chain_passes_chunks_through():
+    chain = FilterChain([], n_channels=N_CHANNELS)
+    chunk = chunks(1)[0]
+    assert chain.apply(chunk) is chunk
+
+
+def test_state_starts_from_the_signal_level():
+    # the steady state of a constant input: no transient at all, the output is the level times the DC gain
+    level = np.array([1.0, -2.0, 50.0, 1e3])
+    constant = np.tile(level, (200, 1))
+
+    lowpass = ButterFilter((None, 30.0), FS, N_CHANNELS)
+    lowpass.reset_state(level)
+    assert np.allclose(lowpass.apply(constant), constant)
+
+    notch = NotchFilter(50, FS, N_CHANNELS)
+    notch.reset_state(level)
+    assert np.allclose(notch.apply(constant), constant)
+
+    # from zero, the same filter rings
+    lowpass.reset_state()
+    assert not np.allclose(lowpass.apply(constant)[:20], constant[:20], atol=1e-3)
+
+
+def test_redesign_in_a_chain_starts_from_the_level_of_its_input():
+    notch, lowpass = NotchFilter(50, FS, N_CHANNELS), ButterFilter((None, 30.0), FS, N_CHANNELS)
+    chain = FilterChain([notch, lowpass])
+    level = np.array([5.0, -5.0, 0.5, 100.0])
+    constant = np.tile(level, (2000, 1))
+    chain.apply(constant)  # settled
+    lowpass.reset((None, 10.0))
+    chain.update(lowpass)
+    # the notch has a DC gain of 1, the new low pass starts from its steady state: no step, no ringing
+    assert np.allclose(chain.apply(constant[:100]), constant[:100])
@@ -0,0 +1,142 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from application.Buffers.ringbuffer import TimestampedRingBuffer
+from application.Buffers.subscription import BLOCK, DROP_OLDEST, COALESCE
+
+
+def write(ring, n):
+    # n samples numbered by their write position, timestamps in ms
+    start = ring.n_written
+    positions = np.arange(start, start + n, dtype=float)
+    ring.extend(positions[:, np.newaxis], positions / 1000)
+
+
+def values(samples):
+    return list(samples[:, 0].astype(int))
+
+
+def test_drop_oldest_drops_whole_chunks_and_counts_them():
+    ring = TimestampedRingBuffer(capacity=1000, n_channels=1)
+    subscription = ring.subscribe(policy=DROP_OLDEST, max_chunks=3)
+    for _ in range(5):
+        write(ring, 10)
+    assert subscription.depth == 3 and subscription.pending == 30
+    assert subscription.stats()["dropped_chunks"] == 2 and subscription.stats()["dropped_samples"] == 20
+
+    samples, timestamps = subscription.get()
+    assert values(samples) == list(range(20, 30))
+    assert np.array_equal(timestamps, samples[:, 0] / 1000)
+    assert values(subscription.get_all()[0]) == list(range(30, 50))
+    assert subscription.get() == (None, None)
+
+
+def test_coalesce_merges_into_the_last_chunk_without_dropping():
+    ring = TimestampedRingBuffer(capacity=1000, n_channels=1)
+    subscription = ring.subscribe(policy=COALESCE, max_chunks=3)
+    for _ in range(5):
+        write(ring, 10)
+    assert subscription.depth == 3 and subscription.pending == 50
+    assert values(subscription.get()[0]) == list(range(0, 10))
+    assert values(subscription.get()[0]) == list(range(10, 20))
+    assert values(subscription.get()[0]) == list(range(20, 50))
+    assert subscription.stats()["dropped_samples"] == 0
+
+
+def test_block_holds_the_writer_until_the_reader_catches_up():
+    ring = TimestampedRingBuffer(capacity=1000, n_channels=1)
+    subscription = ring.subscribe(policy=BLOCK, max_chunks=2)
+    writer = threading.Thread(target=lambda: [write(ring, 10) for _ in range(4)])
+    writer.start()
+    time.sleep(0.2)
+    assert ring.n_written == 20  # the third chunk waits for room
+    read = []
+    while len(read) < 40:
+        samples, timestamps = subscription.get(timeout=1.0)
+        read += values(samples)
+    writer.join(1.0)
+    assert read == list(range(40))
+    assert subscription.stats()["dropped_samples"] == 0
+
+
+def test_block_gives_up_after_its_timeout_and_drops():
+    ring = TimestampedRingBuffer(capacity=1000, n_channels=1)
+    subscription = ring.subscribe(policy=BLOCK, max_chunks=2, timeout=0.05)
+    t0 = time.perf_counter()
+    for _ in range(3):
+        write(ring, 10)
+    assert time.perf_counter() - t0 >= 0.05
+    assert subscription.stats()["dropped_chunks"] == 1
+    assert values(subscription.get_all()[0]) == list(range(10, 30))
+
+
+def test_block_never_lets_the_ring_overwrite_unread_samples():
+    ring = TimestampedRingBuffer(capacity=25, n_channels=1)
+    subscription = ring.subscribe(policy=BLOCK, max_chunks=10, timeout=0.05)
+    write(ring, 10)
+    write(ring, 10)
+    t0 = time.perf_counter()
+    write(ring, 10)  # 30 unread samples don't fit in 25
+    assert time.perf_counter() - t0 >= 0.05
+
+
+def test_lagging_cursor_counts_overwritten_samples():
+    ring = TimestampedRingBuffer(capacity=50, n_channels=1)
+    subscription = ring.subscribe(policy=DROP_OLDEST, max_chunks=100)
+    for _ in range(8):
+        write(ring, 10)
+    assert subscription.pending == 80  # the cursor lags more than the ring holds
+    samples, timestamps = subscription.get()
+    assert subscription.stats()["dropped_samples"] == 30
+    assert values(samples) == list(range(30, 40))  # the rest of the first readable chunk
+    assert values(subscription.get_all()[0]) == list(range(40, 80))
+    assert subscription.stats()["dropped_chunks"] == 0
+
+
+def test_cursors_are_independent():
+    ring = TimestampedRingBuffer(capacity=100, n_channels=1)
+    fast = ring.subscribe(max_chunks=2)
+    write(ring, 5)
+    slow = ring.subscribe(max_chunks=2)  # starts at the current write position
+    write(ring, 5)
+    write(ring, 5)
+    assert values(fast.get_all()[0]) == list(range(5, 15))
+    assert fast.stats()["dropped_samples"] == 5
+    assert values(slow.get()[0]) == list(range(5, 10))
+    write(ring, 5)
+    assert values(slow.get_all()[0]) == list(range(10, 20))
+    assert values(fast.get_all()[0]) == list(range(15, 20))
+
+
+def test_latest_skips_without_counting_drops():
+    ring = TimestampedRingBuffer(capacity=100, n_channels=1)
+    subscription = ring.subscribe(max_chunks=2)
+    for _ in range(4):
+        write(ring, 10)
+    samples, timestamps = subscription.latest(15)
+    assert values(samples) == list(range(25, 40))
+    assert subscription.depth == 0 and subscription.stats()["dropped_samples"] == 20  # from DROP_OLDEST only
+    write(ring, 10)
+    assert values(subscription.get()[0]) == list(range(40, 50))
+
+
+def test_close_releases_a_blocked_writer():
+    ring = TimestampedRingBuffer(capacity=100, n_channels=1)
+    subscription = ring.subscribe(policy=BLOCK, max_chunks=1)
+    write(ring, 10)
+    writer = threading.Thread(target=write, args=(ring, 10))
+    writer.start()
+    time.sleep(0.1)
+    assert writer.is_alive()
+    subscription.close()
+    writer.join(1.0)
+    assert not writer.is_alive() and ring.n_written == 20
+    assert ring.subscriptions == [] and subscription.get() == (None, None)
+
+
+def test_unknown_policy_is_refused():
+    with pytest.raises(ValueError):
+        TimestampedRingBuffer(capacity=10, n_channels=1).subscribe(policy='lossless')